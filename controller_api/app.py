@@ -1,11 +1,18 @@
+import time
+
+# startup is measured from here, before flask, requests and psycopg2 are imported
+STARTED_AT = time.monotonic()
+
 import os
+import json
 import logging
-from http.client import responses
+import threading
 
 import psycopg2
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from psycopg2.extras import DictCursor
+from crawler_client import CircuitOpenError, CrawlerClient
 
 # logging
 logging.basicConfig(
@@ -16,6 +23,19 @@ logger = logging.getLogger(__name__)
 
 CRAWLER_SERVICE = os.environ.get('CRAWLER_SERVICE', 'crawler')
 CRAWLER_PORT = os.environ.get('CRAWLER_PORT', '8000')
+CRAWLER_POOL_SIZE = int(os.environ.get('CRAWLER_POOL_SIZE', '10'))
+CRAWLER_CONNECT_TIMEOUT = float(os.environ.get('CRAWLER_CONNECT_TIMEOUT', '2'))
+CRAWLER_TIMEOUT = float(os.environ.get('CRAWLER_TIMEOUT', '5'))
+CRAWLER_RETRIES = int(os.environ.get('CRAWLER_RETRIES', '2'))
+CRAWLER_BREAKER_THRESHOLD = int(os.environ.get('CRAWLER_BREAKER_THRESHOLD', '5'))
+CRAWLER_BREAKER_RESET = float(os.environ.get('CRAWLER_BREAKER_RESET', '30'))
+# longest wait for the next result line of a batch crawl
+CRAWLER_BATCH_TIMEOUT = float(os.environ.get('CRAWLER_BATCH_TIMEOUT', '60'))
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', '500'))
+# article urls the controller accepts, the replay server's address for load tests
+ARTICLE_URL_PREFIX = os.environ.get('ARTICLE_URL_PREFIX', 'https://www.tagesschau.de')
+
+RUN_STATS_INTERVALS = ('hour', 'day', 'week')
 
 DB_HOST = os.environ.get('DB_HOST', 'postgres')
 DB_PORT = os.environ.get('DB_PORT', '5432')
@@ -23,8 +43,33 @@ DB_NAME = os.environ.get('DB_NAME', 'tagesschau')
 DB_USER = os.environ.get('DB_USER', 'postgres')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'postgres')
 
+# schema_migrations version this service needs. the crawler applies migrations (crawler/migrations) at startup.
+# it is the newest migration this service reads from, 0007_overview_teasers for crawl_runs.links_skipped in the run
+# stats. raise it only when the service starts using a newer migration
+SCHEMA_VERSION = 7
+SCHEMA_WAIT_SECONDS = int(os.environ.get('SCHEMA_WAIT_SECONDS', '120'))
+
 app = Flask(__name__)
 
+# shared keep-alive pool to the crawler, which owns crawler_config. requests to it never hold a db connection
+crawler_client = CrawlerClient(
+    f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}',
+    pool_size=CRAWLER_POOL_SIZE,
+    connect_timeout=CRAWLER_CONNECT_TIMEOUT,
+    read_timeout=CRAWLER_TIMEOUT,
+    retries=CRAWLER_RETRIES,
+    failure_threshold=CRAWLER_BREAKER_THRESHOLD,
+    reset_timeout=CRAWLER_BREAKER_RESET,
+)
+
+# set by the warm-up thread once the database schema is at SCHEMA_VERSION, api requests are refused until then
+schema_ready = threading.Event()
+# whether the warm-up reached the crawler, informational since requests to it fall back or fail on their own
+crawler_reachable = None
+startup_seconds = None
+
+logger.info(f'Controller api imported in {time.monotonic() - STARTED_AT:.2f}s')
+
 
 def get_db_connection():
     """ connect to db """
@@ -42,6 +87,91 @@ def get_db_connection():
         raise
 
 
+def wait_for_schema():
+    """ wait until the crawler has migrated the database to SCHEMA_VERSION """
+    deadline = time.monotonic() + SCHEMA_WAIT_SECONDS
+    while True:
+        version = 0
+        try:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT MAX(version) FROM schema_migrations')
+                    version = cursor.fetchone()[0] or 0
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logger.info(f'Schema version not available yet: {e}')
+
+        if version >= SCHEMA_VERSION:
+            return version
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'Database schema is at version {version}, this service needs {SCHEMA_VERSION}')
+        logger.info(f'Waiting for schema version {SCHEMA_VERSION}, database is at {version}')
+        time.sleep(2)
+
+
+def warm_up():
+    """ connect the crawler pool and wait for the schema in the background, the server listens meanwhile """
+    global crawler_reachable, startup_seconds
+    while True:
+        try:
+            version = wait_for_schema()
+            break
+        except RuntimeError as e:
+            logger.error(f'{e}, still waiting')
+
+    startup_seconds = time.monotonic() - STARTED_AT
+    schema_ready.set()
+    logger.info(f'Controller ready {startup_seconds:.2f}s after start, schema version {version}')
+
+    try:
+        crawler_reachable = crawler_client.get('/health').status_code == 200
+    except requests.RequestException as e:
+        logger.warning(f'Crawler not reachable yet: {e}')
+        crawler_reachable = False
+
+
+def start():
+    """ start the warm-up thread, /ready reports when it is done """
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def update_crawler_config(path, payload, error_message):
+    """ apply a config change through the crawler, which owns crawler_config. returns (config, error_response) """
+    try:
+        response = crawler_client.post(path, json=payload)
+        body = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f'{error_message}: {e}')
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'crawler unavailable, config not changed'
+        }), 503)
+
+    if response.status_code != 200:
+        return None, (jsonify(body), response.status_code)
+    return body['config'], None
+
+
+@app.before_request
+def require_schema():
+    """ refuse api requests until the crawler has migrated the database """
+    if not schema_ready.is_set() and request.path not in ('/health', '/ready'):
+        return jsonify({'status': 'error', 'message': 'service is starting, database schema not ready'}), 503
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """ ready once the database schema is at SCHEMA_VERSION, the crawler check is informational """
+    ready = schema_ready.is_set()
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'checks': {'schema': ready, 'crawler': crawler_reachable},
+        'startup_seconds': round(startup_seconds, 3) if startup_seconds is not None else None,
+    }), 200 if ready else 503
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """ health check """
@@ -51,6 +181,13 @@ def health_check():
 @app.route('/api/config', methods=['GET'])
 def get_crawler_config():
     """ get crawler configuration """
+    try:
+        response = crawler_client.get('/internal/config')
+        if response.status_code == 200:
+            return jsonify(response.json())
+    except requests.RequestException as e:
+        logger.warning(f'Failed to get config from crawler, reading db: {e}')
+
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
@@ -62,6 +199,8 @@ def get_crawler_config():
                 config['last_run'] = config['last_run'].isoformat()
             if config['next_run']:
                 config['next_run'] = config['next_run'].isoformat()
+            if config.get('version_retention_cutoff'):
+                config['version_retention_cutoff'] = config['version_retention_cutoff'].isoformat()
 
             return jsonify(config)
     finally:
@@ -83,163 +222,91 @@ def update_schedule():
     except ValueError:
         return jsonify({'status': 'error', 'message': 'hours param must be int'}), 400
 
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(
-                'UPDATE crawler_config SET schedule_interval_hours = %s WHERE id = 1',
-                (hours,)
-            )
-            conn.commit()
-
-        try:
-            requests.post(
-                f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/update-schedule',
-                json={'hours': hours},
-                timeout=5
-            )
-        except requests.exceptions.RequestException as e:
-            logger.warning(f'Failed to update schedule: {e}')
+    config, error = update_crawler_config('/internal/update-schedule', {'hours': hours}, 'Failed to update schedule')
+    if error:
+        return error
 
-        return jsonify({
-            'status': 'success',
-            'message': f'Schedule updated to run every {hours} hours'
-        })
-    finally:
-        conn.close()
+    return jsonify({
+        'status': 'success',
+        'message': f'Schedule updated to run every {config["schedule_interval_hours"]} hours'
+    })
 
 
 @app.route('/api/config/schedule/increase', methods=['POST'])
 def increase_schedule():
     """ increase crawler schedule """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(
-                """
-                UPDATE crawler_config 
-                SET schedule_interval_hours = schedule_interval_hours + 1 
-                WHERE id = 1 RETURNING schedule_interval_hours
-                """
-            )
-            new_hours = cursor.fetchone()[0]
-            conn.commit()
+    config, error = update_crawler_config('/internal/update-schedule', {'delta': 1}, 'Failed to update schedule')
+    if error:
+        return error
 
-        try:
-            requests.post(
-                f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/update-schedule',
-                json={'hours': new_hours},
-                timeout=5
-            )
-        except requests.RequestException as e:
-            logger.warning(f'Failed to update schedule: {e}')
-
-        return jsonify({
-            'status': 'success',
-            'message': f'Schedule increased to run every {new_hours} hours'
-        })
-    finally:
-        conn.close()
+    return jsonify({
+        'status': 'success',
+        'message': f'Schedule increased to run every {config["schedule_interval_hours"]} hours'
+    })
 
 
 @app.route('/api/config/schedule/decrease', methods=['POST'])
 def decrease_schedule():
     """ decrease crawler schedule """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(
-                """
-                UPDATE crawler_config 
-                SET schedule_interval_hours = GREATEST(1, schedule_interval_hours - 1) 
-                WHERE id = 1 RETURNING schedule_interval_hours
-                """
-            )
-            new_hours = cursor.fetchone()[0]
-            conn.commit()
+    config, error = update_crawler_config('/internal/update-schedule', {'delta': -1}, 'Failed to update schedule')
+    if error:
+        return error
 
-        try:
-            requests.post(
-                f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/update-schedule',
-                json={'hours': new_hours},
-                timeout=5
-            )
-        except requests.RequestException as e:
-            logger.warning(f'Failed to update schedule: {e}')
-
-        return jsonify({
-            'status': 'success',
-            'message': f'Schedule decreased to run every {new_hours} hours'
-        })
-    finally:
-        conn.close()
+    return jsonify({
+        'status': 'success',
+        'message': f'Schedule decreased to run every {config["schedule_interval_hours"]} hours'
+    })
 
 
 @app.route('/api/config/enable', methods=['POST'])
 def enable_crawler():
     """ enable crawler """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(
-                'UPDATE crawler_config SET is_enabled = TRUE WHERE id = 1'
-            )
-            conn.commit()
-
-        try:
-            requests.post(
-                f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/enable',
-                timeout=5
-            )
-        except requests.RequestException as e:
-            logger.warning(f'Failed to enable crawler: {e}')
+    config, error = update_crawler_config('/internal/enable', None, 'Failed to enable crawler')
+    if error:
+        return error
 
-        return jsonify({
-            'status': 'success',
-            'message': f'Crawler enabled successfully'
-        })
-    finally:
-        conn.close()
+    return jsonify({
+        'status': 'success',
+        'message': 'Crawler enabled successfully'
+    })
 
 
 @app.route('/api/config/disable', methods=['POST'])
 def disable_crawler():
     """ disable crawler """
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(
-                'UPDATE crawler_config SET is_enabled = FALSE WHERE id = 1'
-            )
-            conn.commit()
+    config, error = update_crawler_config('/internal/disable', None, 'Failed to disable crawler')
+    if error:
+        return error
 
-        try:
-            requests.post(
-                f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/disable',
-                timeout=5
-            )
-        except requests.RequestException as e:
-            logger.warning(f'Failed to disable crawler: {e}')
-
-        return jsonify({
-            'status': 'success',
-            'message': f'Crawler disabled successfully'
-        })
-    finally:
-        conn.close()
+    return jsonify({
+        'status': 'success',
+        'message': 'Crawler disabled successfully'
+    })
 
 
 @app.route('/api/crawl/overview', methods=['POST'])
 def trigger_overview_crawl():
-    """ trigger crawl of overview page """
+    """ trigger crawl of overview page, {"mode": "full"} crawls every teaser, {"profile": true} profiles the run """
+    data = request.get_json(silent=True)
+    payload = {key: data[key] for key in ('mode', 'profile') if key in data} if isinstance(data, dict) else None
     try:
-        response = requests.post(
-            f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/crawl/overview',
+        response = crawler_client.post(
+            '/internal/crawl/overview',
+            json=payload,
             # crawling should finish within 5 minutes
             timeout=300
         )
+        # invalid request, or interrupted by a crawler shutdown and resumed after the restart
+        if response.status_code in (400, 503):
+            return jsonify(response.json()), response.status_code
         response.raise_for_status()
         return jsonify(response.json())
+    except CircuitOpenError as e:
+        logger.warning(f'Not triggering overview crawl: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'crawler unavailable, try again later'
+        }), 503
     except requests.RequestException as e:
         logger.error(f'Failed to trigger overview crawl: {e}')
         return jsonify({
@@ -251,28 +318,33 @@ def trigger_overview_crawl():
 @app.route('/api/crawl/article', methods=['POST'])
 def trigger_article_crawl():
     """ trigger crawl of article page """
-    data = request.json()
-    if not data or 'url' not in data:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'url' not in data:
         return jsonify({
             'status': 'error',
             'message': 'missing url'
         }), 400
 
     url = data['url']
-    if not url.startswith('https://www.tagesschau.de'):
+    if not isinstance(url, str) or not url.startswith(ARTICLE_URL_PREFIX):
         return jsonify({
             'status': 'error',
             'message': 'invalid url'
         }), 400
 
     try:
-        response = requests.post(
-            f'http://{CRAWLER_SERVICE}:{CRAWLER_PORT}/internal/crawl/article',
-            json={'url': url},
-            timeout=5
+        response = crawler_client.post(
+            '/internal/crawl/article',
+            json={'url': url}
         )
         response.raise_for_status()
         return jsonify(response.json())
+    except CircuitOpenError as e:
+        logger.warning(f'Not triggering article crawl: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'crawler unavailable, try again later'
+        }), 503
     except requests.RequestException as e:
         logger.error(f'Failed to trigger article crawl: {e}')
         return jsonify({
@@ -281,6 +353,246 @@ def trigger_article_crawl():
         }), 500
 
 
+@app.route('/api/crawl/articles', methods=['POST'])
+def trigger_batch_crawl():
+    """ crawl a list of article urls, streams the crawler's per-url results as json lines """
+    data = request.get_json(silent=True)
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not urls:
+        return jsonify({
+            'status': 'error',
+            'message': 'missing urls'
+        }), 400
+
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({
+            'status': 'error',
+            'message': f'at most {BATCH_MAX_URLS} urls per batch'
+        }), 400
+
+    valid = [url for url in urls if isinstance(url, str) and url.startswith(ARTICLE_URL_PREFIX)]
+    invalid = [url for url in urls if url not in valid]
+    if not valid:
+        return jsonify({
+            'status': 'error',
+            'message': 'no valid urls',
+            'invalid': invalid
+        }), 400
+
+    try:
+        response = crawler_client.post(
+            '/internal/crawl/articles',
+            json={'urls': valid, **({'profile': data['profile']} if 'profile' in data else {})},
+            timeout=CRAWLER_BATCH_TIMEOUT,
+            stream=True
+        )
+        response.raise_for_status()
+    except CircuitOpenError as e:
+        logger.warning(f'Not triggering batch crawl: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'crawler unavailable, try again later'
+        }), 503
+    except requests.RequestException as e:
+        logger.error(f'Failed to trigger batch crawl: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'failed to trigger batch crawl'
+        }), 500
+
+    def generate():
+        try:
+            for url in invalid:
+                yield json.dumps({'url': url, 'status': 'invalid'}) + '\n'
+            for line in response.iter_lines():
+                if line:
+                    yield line.decode() + '\n'
+        except requests.RequestException as e:
+            logger.error(f'Batch crawl stream interrupted: {e}')
+            yield json.dumps({'status': 'error', 'message': 'batch crawl stream interrupted'}) + '\n'
+        finally:
+            # hand the connection back to the pool
+            response.close()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def serialize_run(row):
+    """ crawl_runs row as json-ready dict """
+    run = dict(row)
+    if run['finished_at']:
+        run['duration_seconds'] = round((run['finished_at'] - run['started_at']).total_seconds(), 3)
+        run['finished_at'] = run['finished_at'].isoformat()
+    else:
+        run['duration_seconds'] = None
+    run['started_at'] = run['started_at'].isoformat()
+    # the path is only meaningful inside the crawler container
+    run['profiled'] = bool(run.pop('profile_path', None))
+    return run
+
+
+@app.route('/api/runs', methods=['GET'])
+def list_runs():
+    """ list crawl runs, newest first """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    status = request.args.get('status')
+    trigger = request.args.get('trigger')
+
+    if per_page > 100:
+        per_page = 100
+
+    offset = (page - 1) * per_page
+
+    conditions = []
+    params = []
+    if status:
+        conditions.append('status = %s')
+        params.append(status)
+    if trigger:
+        conditions.append('trigger = %s')
+        params.append(trigger)
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM crawl_runs {where}', params)
+            total_count = cursor.fetchone()[0]
+
+            cursor.execute(
+                f'SELECT * FROM crawl_runs {where} ORDER BY started_at DESC LIMIT %s OFFSET %s',
+                (*params, per_page, offset)
+            )
+            runs = [serialize_run(row) for row in cursor.fetchall()]
+
+            return jsonify({
+                'total': total_count,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total_count + per_page - 1) // per_page,
+                'runs': runs,
+            })
+    finally:
+        conn.close()
+
+
+@app.route('/api/runs/<int:run_id>', methods=['GET'])
+def get_run(run_id):
+    """ get crawl run details """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute('SELECT * FROM crawl_runs WHERE id = %s', (run_id,))
+            row = cursor.fetchone()
+            if not row:
+                return jsonify({'status': 'error', 'message': f'run {run_id} not found'}), 404
+
+            return jsonify(serialize_run(row))
+    finally:
+        conn.close()
+
+
+@app.route('/api/runs/<int:run_id>/profile', methods=['GET'])
+def download_run_profile(run_id):
+    """ download the profile of a profiled run from the crawler: kind cpu, allocations or snapshot """
+    try:
+        response = crawler_client.get(
+            f'/internal/runs/{run_id}/profile',
+            params={'kind': request.args.get('kind', 'cpu')},
+            stream=True
+        )
+    except CircuitOpenError as e:
+        logger.warning(f'Not downloading profile: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'crawler unavailable, try again later'
+        }), 503
+    except requests.RequestException as e:
+        logger.error(f'Failed to download profile of run {run_id}: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': 'failed to download profile'
+        }), 500
+
+    if response.status_code != 200:
+        try:
+            return jsonify(response.json()), response.status_code
+        finally:
+            response.close()
+
+    def generate():
+        try:
+            yield from response.iter_content(chunk_size=64 * 1024)
+        finally:
+            response.close()
+
+    headers = {
+        name: response.headers[name] for name in ('Content-Disposition', 'Content-Length') if name in response.headers
+    }
+    return Response(generate(), mimetype=response.headers.get('Content-Type'), headers=headers)
+
+
+@app.route('/api/runs/stats', methods=['GET'])
+def get_run_stats():
+    """ aggregate crawl statistics per hour, day or week """
+    days = request.args.get('days', 28, type=int)
+    interval = request.args.get('interval', 'day')
+    if interval not in RUN_STATS_INTERVALS:
+        return jsonify({'status': 'error', 'message': f'interval must be one of {", ".join(RUN_STATS_INTERVALS)}'}), 400
+
+    aggregates = """
+        COUNT(*) AS runs,
+        COUNT(*) FILTER (WHERE status = 'failed') AS failed_runs,
+        COALESCE(SUM(links_found), 0) AS links_found,
+        COALESCE(SUM(links_skipped), 0) AS links_skipped,
+        COALESCE(SUM(fetched), 0) AS fetched,
+        COALESCE(SUM(not_modified), 0) AS not_modified,
+        COALESCE(SUM(new_articles), 0) AS new_articles,
+        COALESCE(SUM(updated_articles), 0) AS updated_articles,
+        COALESCE(SUM(unchanged), 0) AS unchanged,
+        COALESCE(SUM(failed), 0) AS failed_articles,
+        COALESCE(SUM(bytes_fetched), 0)::BIGINT AS bytes_fetched,
+        AVG(EXTRACT(EPOCH FROM finished_at - started_at))::FLOAT AS avg_duration_seconds,
+        MAX(EXTRACT(EPOCH FROM finished_at - started_at))::FLOAT AS max_duration_seconds,
+        AVG(fetch_seconds) AS avg_fetch_seconds,
+        AVG(parse_seconds) AS avg_parse_seconds,
+        AVG(store_seconds) AS avg_store_seconds,
+        (SUM(fetched) / NULLIF(SUM(EXTRACT(EPOCH FROM finished_at - started_at)), 0))::FLOAT AS pages_per_second
+    """
+    where = "WHERE finished_at IS NOT NULL AND started_at >= NOW() - make_interval(days => %s)"
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute(f'SELECT {aggregates} FROM crawl_runs {where}', (days,))
+            totals = dict(cursor.fetchone())
+
+            cursor.execute(
+                f"""
+                SELECT date_trunc(%s, started_at) AS bucket, {aggregates}
+                FROM crawl_runs {where}
+                GROUP BY bucket
+                ORDER BY bucket
+                """,
+                (interval, days)
+            )
+            buckets = []
+            for row in cursor.fetchall():
+                bucket = dict(row)
+                bucket['bucket'] = bucket['bucket'].isoformat()
+                buckets.append(bucket)
+
+            return jsonify({
+                'days': days,
+                'interval': interval,
+                'totals': totals,
+                'buckets': buckets,
+            })
+    finally:
+        conn.close()
+
+
 @app.errorhandler(400)
 def handle_bad_request(e):
     return jsonify({
@@ -307,4 +619,5 @@ def handle_server_error(e):
 
 
 if __name__ == '__main__':
+    start()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.RequestException):
+    """ raised instead of calling the crawler while the circuit is open """
+
+
+class CircuitBreaker:
+    """ stop calling a failing service for reset_timeout seconds after failure_threshold consecutive failures """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow_request(self):
+        """ closed lets everything through, half-open lets one trial request through """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # re-arm so concurrent callers wait for the trial request's outcome
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f'Circuit opened after {self.failures} consecutive failures')
+                self.opened_at = time.monotonic()
+
+
+def is_crawler_failure(response):
+    """ whether a response means the crawler is unhealthy
+
+        502 and 504 come from a proxy in front of a crawler that doesn't answer. other 5xx only count without the
+        crawler's json error body, a failed overview crawl (500) or a run interrupted by a restart (503) is the
+        crawler answering normally
+    """
+    if response.status_code in (502, 504):
+        return True
+    if response.status_code < 500:
+        return False
+    if not response.headers.get('Content-Type', '').startswith('application/json'):
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not (isinstance(body, dict) and body.get('status') == 'error')
+
+
+class CrawlerClient:
+    """ keep-alive connection pool to the crawler service with timeouts, retries and a circuit breaker """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=2, read_timeout=5, retries=2,
+                 failure_threshold=5, reset_timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        # only connection failures are retried, the request never reached the crawler so POSTs are safe to repeat
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """ call the crawler, raises requests.RequestException (CircuitOpenError while the circuit is open) """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f'crawler circuit open, not calling {path}')
+
+        try:
+            response = self.session.request(
+                method,
+                f'{self.base_url}{path}',
+                timeout=(self.connect_timeout, timeout or self.read_timeout),
+                **kwargs
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.record_failure()
+            raise
+
+        if is_crawler_failure(response):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
@@ -1,6 +1,21 @@
+import time
+
+# startup is measured from here, before flask and the crawler modules are imported
+STARTED_AT = time.monotonic()
+
+import json
 import logging
-from flask import Flask, request, jsonify
-from crawler import crawl_overview_page, crawl_single_article
+import os
+import queue
+import threading
+from flask import Flask, Response, request, jsonify, send_file
+from config import config_store, serialize_config
+from crawler import crawl_articles, crawl_overview_page, crawl_single_article, validate_article_urls
+from migrate import run_migrations
+from overview import OVERVIEW_MODES
+from pipeline import warm_parse_pool
+from profiler import PROFILE_FILES, profile_file
+from runs import CrawlRun, get_profile_path
 from scheduler import CrawlerScheduler
 
 # logging
@@ -10,11 +25,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# most urls accepted by one batch crawl request
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', '500'))
+# retry delay while migrations can't be applied, e.g. because the database is not reachable yet
+MIGRATION_RETRY_SECONDS = 5
+
 app = Flask(__name__)
 
 # init scheduler
 scheduler = CrawlerScheduler()
 
+# set by the warm-up thread once the parser pool is started and the scheduler has done its first check
+warmed_up = threading.Event()
+parse_pool_ready = threading.Event()
+# set once pending migrations are applied, the scheduler and the internal api wait for it
+schema_ready = threading.Event()
+startup_seconds = None
+
+logger.info(f'Crawler api imported in {time.monotonic() - STARTED_AT:.2f}s')
+
+
+def migrate_schema():
+    """ apply pending migrations, then start the scheduler. every worker tries, the migration lock lets one apply them
+        and the others wait for it
+    """
+    while True:
+        try:
+            run_migrations()
+            break
+        except Exception as e:
+            logger.error(f'Could not apply migrations: {e}, retrying in {MIGRATION_RETRY_SECONDS}s')
+            time.sleep(MIGRATION_RETRY_SECONDS)
+
+    schema_ready.set()
+    scheduler.start()
+
+
+def warm_up():
+    """ start the parser processes and wait for the scheduler, off the request path so the server listens meanwhile """
+    global startup_seconds
+    try:
+        # the modules the first parse imports
+        warm_parse_pool('crawler', 'bs4')
+    except Exception as e:
+        logger.error(f'Could not warm up the parser pool: {e}')
+    parse_pool_ready.set()
+
+    scheduler.ready_event.wait()
+    startup_seconds = time.monotonic() - STARTED_AT
+    warmed_up.set()
+    logger.info(f'Crawler ready {startup_seconds:.2f}s after start')
+
+
+def start():
+    """ migrate and start the scheduler, and warm up, in the background. /ready reports when they are done """
+    threading.Thread(target=migrate_schema, name='migrate', daemon=True).start()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+@app.before_request
+def require_schema():
+    """ refuse internal api requests until the database is migrated """
+    if not schema_ready.is_set() and request.path not in ('/health', '/ready'):
+        return jsonify({'status': 'error', 'message': 'service is starting, database schema not ready'}), 503
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -22,14 +96,65 @@ def health_check():
     return jsonify({'status': 'healthy'})
 
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """ ready once migrations are applied, the config is cached, the scheduler did its first check and the parser pool
+        is started
+    """
+    checks = {
+        'schema': schema_ready.is_set(),
+        'config': config_store.is_loaded,
+        'scheduler': scheduler.ready_event.is_set(),
+        'parse_pool': parse_pool_ready.is_set(),
+    }
+    ready = warmed_up.is_set()
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'checks': checks,
+        'startup_seconds': round(startup_seconds, 3) if startup_seconds is not None else None,
+    }), 200 if ready else 503
+
+
+def profile_requested():
+    """ profile flag of a crawl request from the json body or the query string, None if not given """
+    data = request.get_json(silent=True)
+    value = data['profile'] if isinstance(data, dict) and 'profile' in data else request.args.get('profile')
+    if value is None:
+        return None
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
 @app.route('/internal/crawl/overview', methods=['POST'])
 def trigger_overview_crawl():
-    """ trigger a crawl of the overview page """
+    """ trigger a crawl of the overview page, full or incremental and profiled if the request asks for it """
+    data = request.get_json(silent=True)
+    mode = data.get('mode') if isinstance(data, dict) else request.args.get('mode')
+    if mode is not None and mode not in OVERVIEW_MODES:
+        return jsonify({
+            'status': 'error',
+            'message': f'mode must be one of {", ".join(OVERVIEW_MODES)}'
+        }), 400
+
     try:
-        new_articles = crawl_overview_page()
+        run = CrawlRun('manual', profile=profile_requested())
+        new_articles = crawl_overview_page(run, mode)
+        if run.status == 'failed':
+            return jsonify({
+                'status': 'error',
+                'message': 'Error during crawl, see run for details',
+                'run': run.as_dict()
+            }), 500
+        if run.status == 'interrupted':
+            return jsonify({
+                'status': 'error',
+                'message': 'Crawl interrupted by a crawler shutdown, it is resumed after the restart',
+                'run': run.as_dict()
+            }), 503
+
         return jsonify({
             'status': 'success',
-            'message': f'Crawl completed successfully. Found {new_articles} new article versions.'
+            'message': f'Crawl completed successfully. Found {new_articles} new article versions.',
+            'run': run.as_dict()
         })
     except Exception as e:
         logger.error(f'Error in overview crawl: {e}')
@@ -42,8 +167,8 @@ def trigger_overview_crawl():
 @app.route('/internal/crawl/article', methods=['POST'])
 def trigger_article_crawl():
     """ trigger a crawl of a specific article """
-    data = request.json
-    if not data or 'url' not in data:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('url'), str):
         return jsonify({
             'status': 'error',
             'message': 'Missing url'
@@ -70,34 +195,143 @@ def trigger_article_crawl():
         }), 500
 
 
+@app.route('/internal/crawl/articles', methods=['POST'])
+def trigger_batch_crawl():
+    """ crawl a list of article urls, streams one json line per url as it finishes and the run statistics last """
+    data = request.get_json(silent=True)
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not urls:
+        return jsonify({
+            'status': 'error',
+            'message': 'Missing urls'
+        }), 400
+
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({
+            'status': 'error',
+            'message': f'At most {BATCH_MAX_URLS} urls per batch'
+        }), 400
+
+    valid, invalid = validate_article_urls(urls)
+    if not valid:
+        return jsonify({
+            'status': 'error',
+            'message': 'No valid urls',
+            'invalid': invalid
+        }), 400
+
+    run = CrawlRun('batch', profile=profile_requested())
+    results = queue.Queue()
+
+    def report(url, outcome, error=None):
+        results.put({'url': url, 'status': outcome, **({'error': error} if error else {})})
+
+    def crawl():
+        try:
+            crawl_articles(valid, run, on_result=report)
+        finally:
+            results.put(None)
+
+    # the crawl finishes and is recorded even if the client goes away
+    threading.Thread(target=crawl, daemon=True).start()
+
+    def generate():
+        for url in invalid:
+            yield json.dumps({'url': url, 'status': 'invalid'}) + '\n'
+        while (result := results.get()) is not None:
+            yield json.dumps(result) + '\n'
+        yield json.dumps({'run': run.as_dict()}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/internal/runs/<int:run_id>/profile', methods=['GET'])
+def download_profile(run_id):
+    """ download the profile of a run: kind cpu (folded stacks), allocations or snapshot """
+    kind = request.args.get('kind', 'cpu')
+    if kind not in PROFILE_FILES:
+        return jsonify({
+            'status': 'error',
+            'message': 'kind must be cpu, allocations or snapshot'
+        }), 400
+
+    try:
+        path = get_profile_path(run_id)
+    except KeyError:
+        return jsonify({
+            'status': 'error',
+            'message': f'Run {run_id} not found'
+        }), 404
+    except Exception as e:
+        logger.error(f'Error reading run {run_id}: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': f'Error reading run: {str(e)}'
+        }), 500
+
+    if not path:
+        return jsonify({
+            'status': 'error',
+            'message': f'Run {run_id} was not profiled'
+        }), 404
+
+    found = profile_file(path, kind)
+    if found is None or not os.path.exists(found[0]):
+        return jsonify({
+            'status': 'error',
+            'message': f'Profile of run {run_id} not found'
+        }), 404
+    full_path, mimetype = found
+
+    return send_file(full_path, mimetype=mimetype, as_attachment=True,
+                     download_name=f'run-{run_id}-{os.path.basename(full_path)}')
+
+
+@app.route('/internal/config', methods=['GET'])
+def get_config():
+    """ current crawler config, served from cache """
+    try:
+        return jsonify(serialize_config(config_store.get()))
+    except Exception as e:
+        logger.error(f'Error reading config: {e}')
+        return jsonify({
+            'status': 'error',
+            'message': f'Error reading config: {str(e)}'
+        }), 500
+
+
 @app.route('/internal/update-schedule', methods=['POST'])
 def update_schedule():
-    """ update the crawler schedule """
+    """ update the crawler schedule, either to an absolute number of hours or by a delta """
     data = request.json
-    if not data or 'hours' not in data:
+    if not data or ('hours' not in data and 'delta' not in data):
         return jsonify({
             'status': 'error',
-            'message': 'Missing required param: hours'
+            'message': 'Missing required param: hours or delta'
         }), 400
 
     try:
-        hours = int(data['hours'])
-        if hours < 1:
-            return jsonify({
-                'status': 'error',
-                'message': 'Schedule interval must be at least 1 hour'
-            }), 400
-
-        scheduler.update_schedule(hours=hours)
+        if 'hours' in data:
+            hours = int(data['hours'])
+            if hours < 1:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Schedule interval must be at least 1 hour'
+                }), 400
+            config = config_store.update(hours=hours)
+        else:
+            config = config_store.update(delta=int(data['delta']))
 
+        hours = config['schedule_interval_hours']
         return jsonify({
             'status': 'success',
-            'message': f'Schedule updated to run every {hours} hours'
+            'message': f'Schedule updated to run every {hours} hours',
+            'config': serialize_config(config)
         })
     except ValueError:
         return jsonify({
             'status': 'error',
-            'message': 'Hours param must be an int'
+            'message': 'Hours and delta params must be ints'
         }), 400
     except Exception as e:
         logger.error(f'Error updating schedule: {e}')
@@ -111,11 +345,12 @@ def update_schedule():
 def enable_schedule():
     """ enable the crawler schedule """
     try:
-        scheduler.update_schedule(enabled=True)
+        config = config_store.update(enabled=True)
 
         return jsonify({
             'status': 'success',
-            'message': 'Crawler schedule enabled'
+            'message': 'Crawler schedule enabled',
+            'config': serialize_config(config)
         })
     except Exception as e:
         logger.error(f'Error enabling schedule: {e}')
@@ -129,11 +364,12 @@ def enable_schedule():
 def disable_schedule():
     """ disable the crawler schedule """
     try:
-        scheduler.update_schedule(enabled=False)
+        config = config_store.update(enabled=False)
 
         return jsonify({
             'status': 'success',
-            'message': 'Crawler schedule disabled'
+            'message': 'Crawler schedule disabled',
+            'config': serialize_config(config)
         })
     except Exception as e:
         logger.error(f'Error disabling schedule: {e}')
@@ -144,7 +380,7 @@ def disable_schedule():
 
 
 if __name__ == '__main__':
-    scheduler.start()
+    start()
 
     try:
         app.run(host='0.0.0.0', port=8000)
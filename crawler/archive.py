@@ -0,0 +1,182 @@
+import fcntl
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# raw html archive, disabled unless ARCHIVE_DIR is set
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '')
+ARCHIVE_CODEC = os.environ.get('ARCHIVE_CODEC', 'zstd' if zstandard else 'gzip')
+# start a new segment file once the current one is larger than this
+ARCHIVE_SEGMENT_BYTES = int(os.environ.get('ARCHIVE_SEGMENT_BYTES', str(256 * 1024 * 1024)))
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('archive contains zstd blobs but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class HtmlArchive:
+    """ content addressed, compressed store of raw responses
+
+        blobs are deduplicated by sha256 and appended to segment files, index.sqlite3 maps each hash to its segment
+        and offset and records every capture (url, hash, time). safe to share between threads and processes.
+    """
+
+    def __init__(self, path, codec=ARCHIVE_CODEC, segment_bytes=ARCHIVE_SEGMENT_BYTES):
+        if codec == 'zstd' and zstandard is None:
+            logger.warning('zstandard not installed, archiving with gzip')
+            codec = 'gzip'
+
+        self.path = path
+        self.codec = codec
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(path, 'index.sqlite3'), timeout=30, check_same_thread=False)
+        self.index.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256 TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                codec TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS captures (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+                encoding TEXT,
+                fetched_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_captures_url ON captures (url, fetched_at);
+            """
+        )
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f'segment-{segment:06d}.dat')
+
+    def store(self, url, body, encoding=None):
+        """ archive a response body, returns its sha256
+
+            the body is compressed outside the locks so fetcher threads and workers don't wait on each other's
+            compression. a body another thread stores in the meantime is compressed for nothing, not written twice
+        """
+        sha256 = hashlib.sha256(body).hexdigest()
+
+        with self.lock:
+            known = self.index.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        data = None if known else compress(body, self.codec)
+
+        with self.lock, open(os.path.join(self.path, 'archive.lock'), 'w') as lock_file:
+            # other crawler workers append to the same segments
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            if data is not None and not self.index.execute(
+                    'SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone():
+                segment = self.index.execute('SELECT COALESCE(MAX(segment), 1) FROM blobs').fetchone()[0]
+                if os.path.exists(self.segment_path(segment)) and \
+                        os.path.getsize(self.segment_path(segment)) >= self.segment_bytes:
+                    segment += 1
+
+                with open(self.segment_path(segment), 'ab') as segment_file:
+                    segment_file.seek(0, os.SEEK_END)
+                    offset = segment_file.tell()
+                    segment_file.write(data)
+
+                self.index.execute(
+                    'INSERT INTO blobs (sha256, segment, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?)',
+                    (sha256, segment, offset, len(data), len(body), self.codec)
+                )
+
+            self.index.execute(
+                'INSERT INTO captures (url, sha256, encoding, fetched_at) VALUES (?, ?, ?, ?)',
+                (url, sha256, encoding, datetime.now().isoformat())
+            )
+            self.index.commit()
+
+        return sha256
+
+    def read(self, sha256):
+        """ raw body of an archived blob """
+        with self.lock:
+            row = self.index.execute(
+                'SELECT segment, offset, length, codec FROM blobs WHERE sha256 = ?', (sha256,)
+            ).fetchone()
+        if not row:
+            raise KeyError(sha256)
+
+        segment, offset, length, codec = row
+        with open(self.segment_path(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            return decompress(segment_file.read(length), codec)
+
+    def captures(self, latest_only=True, since=None):
+        """ (url, sha256, encoding, fetched_at) of archived captures, only the newest per url by default """
+        params = []
+        where = ''
+        if since:
+            where = 'WHERE fetched_at >= ?'
+            params.append(since)
+
+        if latest_only:
+            query = f"""
+                SELECT url, sha256, encoding, MAX(fetched_at) FROM captures {where}
+                GROUP BY url ORDER BY url
+            """
+        else:
+            query = f'SELECT url, sha256, encoding, fetched_at FROM captures {where} ORDER BY fetched_at'
+        with self.lock:
+            return self.index.execute(query, params).fetchall()
+
+    def stats(self):
+        with self.lock:
+            blobs, raw_bytes, stored_bytes = self.index.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blobs'
+            ).fetchone()
+            captures = self.index.execute('SELECT COUNT(*) FROM captures').fetchone()[0]
+        return {
+            'captures': captures,
+            'blobs': blobs,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+        }
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """ process wide archive, None if archiving is disabled """
+    global _archive
+    if not ARCHIVE_DIR:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            _archive = HtmlArchive(ARCHIVE_DIR)
+            logger.info(f'Archiving raw html to {ARCHIVE_DIR} ({_archive.codec})')
+        return _archive
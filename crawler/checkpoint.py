@@ -0,0 +1,106 @@
+""" crawl run checkpoints
+
+    a run saves the urls it is going to crawl to crawl_run_frontier before it starts and records each url's outcome
+    as it finishes, together with the run's counters. outcomes are written in batches, so after a crash the last
+    CHECKPOINT_SIZE urls or CHECKPOINT_SECONDS of work may be crawled again. that is harmless, a stored article is
+    sent its validators and comes back not modified or unchanged.
+"""
+import logging
+import os
+import threading
+import time
+from psycopg2.extras import execute_values
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# outcomes written per checkpoint, and the longest time an outcome waits for one
+CHECKPOINT_SIZE = int(os.environ.get('CHECKPOINT_SIZE', '20'))
+CHECKPOINT_SECONDS = float(os.environ.get('CHECKPOINT_SECONDS', '5'))
+
+
+class Frontier:
+    """ urls of one run and their outcomes, record() is called from the pipeline threads """
+
+    def __init__(self, run):
+        self.run = run
+        self.outcomes = []
+        self.last_checkpoint = time.monotonic()
+        self.lock = threading.Lock()
+
+    def save(self, urls):
+        """ remember the urls to crawl, in crawl order """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO crawl_run_frontier (run_id, url, position)
+                    VALUES %s
+                    ON CONFLICT (run_id, url) DO NOTHING
+                    """,
+                    [(self.run.id, url, position) for position, url in enumerate(urls)]
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def load(self):
+        """ pending urls in crawl order, None if the run never saved a frontier """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT url, status = 'pending' FROM crawl_run_frontier
+                    WHERE run_id = %s
+                    ORDER BY position
+                    """,
+                    (self.run.id,)
+                )
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return None
+        return [url for url, pending in rows if pending]
+
+    def record(self, url, outcome):
+        """ outcome of a url, checkpointed with the next batch """
+        with self.lock:
+            self.outcomes.append((url, outcome))
+            due = (len(self.outcomes) >= CHECKPOINT_SIZE or
+                   time.monotonic() - self.last_checkpoint >= CHECKPOINT_SECONDS)
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """ write the recorded outcomes and the run's counters in one transaction """
+        with self.lock:
+            outcomes, self.outcomes = self.outcomes, []
+            self.last_checkpoint = time.monotonic()
+        if not outcomes:
+            return
+
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    """
+                    UPDATE crawl_run_frontier f
+                    SET status = done.status, finished_at = NOW()
+                    FROM (VALUES %s) AS done (run_id, url, status)
+                    WHERE f.run_id = done.run_id AND f.url = done.url
+                    """,
+                    [(self.run.id, url, outcome) for url, outcome in outcomes]
+                )
+                self.run.checkpoint(cursor)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            # the urls stay pending and are crawled again if the run is resumed
+            logger.error(f'Error checkpointing crawl run {self.run.id}: {e}')
+        finally:
+            conn.close()
@@ -0,0 +1,182 @@
+import logging
+import select
+import threading
+from psycopg2.extras import DictCursor
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# every write to crawler_config goes through ConfigStore and notifies this channel, so all processes refresh their cache
+CONFIG_CHANNEL = 'crawler_config'
+
+# how often the listener checks for stop while no notification arrives
+CONFIG_LISTEN_TIMEOUT = 5
+
+# wait before reconnecting the listener after a db error
+CONFIG_RECONNECT_DELAY = 5
+
+
+def serialize_config(config):
+    """ config row as json-ready dict """
+    config = dict(config)
+    # convert datetime to string
+    if config['last_run']:
+        config['last_run'] = config['last_run'].isoformat()
+    if config['next_run']:
+        config['next_run'] = config['next_run'].isoformat()
+    if config.get('version_retention_cutoff'):
+        config['version_retention_cutoff'] = config['version_retention_cutoff'].isoformat()
+    return config
+
+
+def record_version_retention_cutoff(cursor, superseded_at):
+    """ versions superseded up to superseded_at were removed, written in retention's transaction with the removal """
+    if superseded_at is None:
+        return
+    cursor.execute(
+        """
+        UPDATE crawler_config
+        SET version_retention_cutoff = GREATEST(version_retention_cutoff, %s)
+        WHERE id = 1
+        """,
+        (superseded_at,)
+    )
+    cursor.execute('SELECT pg_notify(%s, %s)', (CONFIG_CHANNEL, ''))
+
+
+class ConfigStore:
+    """ in-memory copy of the crawler_config row and the only writer of it, except for the retention cutoff """
+
+    def __init__(self):
+        self.config = None
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def is_loaded(self):
+        return self.config is not None
+
+    def get(self):
+        """ current config from cache, loaded from db on first use """
+        if self.config is None:
+            self.refresh()
+        with self.lock:
+            return dict(self.config)
+
+    def refresh(self):
+        """ reload config from db """
+        conn = get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute('SELECT * FROM crawler_config WHERE id = 1')
+                config = dict(cursor.fetchone())
+        finally:
+            conn.close()
+
+        self._apply(config)
+        return dict(config)
+
+    def subscribe(self, callback):
+        """ callback(old_config, new_config) is called after every change """
+        self.listeners.append(callback)
+
+    def update(self, hours=None, delta=None, enabled=None, next_run=None):
+        """ apply a config change in one statement, returns the new config """
+        assignments = []
+        params = []
+
+        if hours is not None:
+            assignments.append('schedule_interval_hours = %s')
+            params.append(hours)
+        if delta:
+            assignments.append('schedule_interval_hours = GREATEST(1, schedule_interval_hours + %s)')
+            params.append(delta)
+        if enabled is not None:
+            assignments.append('is_enabled = %s')
+            params.append(enabled)
+        if next_run is not None:
+            assignments.append('next_run = %s')
+            params.append(next_run)
+
+        if not assignments:
+            return self.get()
+        return self._write(', '.join(assignments), params)
+
+    def mark_last_run(self):
+        """ record that a crawl just finished """
+        return self._write('last_run = NOW()', [])
+
+    def _write(self, assignments, params):
+        conn = get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(f'UPDATE crawler_config SET {assignments} WHERE id = 1 RETURNING *', params)
+                config = dict(cursor.fetchone())
+                cursor.execute('SELECT pg_notify(%s, %s)', (CONFIG_CHANNEL, ''))
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self._apply(config)
+        return dict(config)
+
+    def _apply(self, config):
+        with self.lock:
+            old_config = self.config
+            self.config = config
+
+        if old_config == config:
+            return
+        for callback in self.listeners:
+            try:
+                callback(old_config, dict(config))
+            except Exception as e:
+                logger.error(f'Error in config listener: {e}')
+
+    def start(self):
+        """ start listening for changes made by other processes """
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._listen_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """ stop the listener thread """
+        if self.thread and self.thread.is_alive():
+            self.stop_event.set()
+            self.thread.join(CONFIG_LISTEN_TIMEOUT + 1)
+
+    def _listen_loop(self):
+        while not self.stop_event.is_set():
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CONFIG_CHANNEL}')
+
+                # reload after subscribing so changes made while we were not listening are not missed
+                self.refresh()
+
+                while not self.stop_event.is_set():
+                    if select.select([conn], [], [], CONFIG_LISTEN_TIMEOUT) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.refresh()
+
+            except Exception as e:
+                logger.error(f'Config listener error: {e}')
+                self.stop_event.wait(CONFIG_RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+config_store = ConfigStore()
@@ -1,11 +1,19 @@
 import logging
 import os
-import requests
-import psycopg2
-from bs4 import BeautifulSoup
 from datetime import datetime
 from psycopg2.extras import DictCursor
-from urllib.parse import urljoin
+from urllib.parse import urlparse
+from archive import get_archive
+from checkpoint import Frontier
+from config import config_store
+from db import get_db_connection
+from metadata import extract_metadata, to_local_time
+from overview import OVERVIEW_MODE, save_teasers, select_changed, stream_teasers
+from pipeline import PARSE_WORKERS, CrawlPipeline
+from profiler import profile_run
+from rollups import EditRollup
+from runs import CrawlRun, unfinished_run_ids
+from similarity import PLACEHOLDER_CONTENT, article_simhash, index_articles
 
 
 # logging
@@ -15,237 +23,571 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-TAGESSCHAU_URL = 'https://www.tagesschau.de/'
+# overview page, pointed at loadtest/replay_server.py for load tests
+TAGESSCHAU_URL = os.environ.get('TAGESSCHAU_URL', 'https://www.tagesschau.de/')
+# seconds to wait for a connection and between bytes of a response
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '10'))
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3' # I am not a robot
 
-DB_HOST = os.environ.get('DB_HOST', 'postgres')
-DB_PORT = os.environ.get('DB_PORT', '5432')
-DB_NAME = os.environ.get('DB_NAME', 'tagesschau')
-DB_USER = os.environ.get('DB_USER', 'postgres')
-DB_PASSWORD = os.environ.get('DB_PASSWORD', 'postgres')
+# run counter for each store outcome
+STORE_OUTCOME_COUNTERS = {
+    'new': 'new_articles',
+    'updated': 'updated_articles',
+    'unchanged': 'unchanged',
+    'failed': 'failed',
+}
 
+# structured metadata columns, kept when a later crawl doesn't find them
+ARTICLE_METADATA_FIELDS = ('published_at', 'modified_at', 'author', 'section', 'keywords')
+METADATA_ASSIGNMENTS = ', '.join(f'{field} = COALESCE(%s, {field})' for field in ARTICLE_METADATA_FIELDS)
+
+# change feed, see explorer /api/changes
+CHANGE_FEED_CHANNEL = 'article_changes'
+CHANGE_FEED_LOCK_ID = 26001
+
+
+def fetch_page(url, run, validators=None, stream=False):
+    """ get a page, sending validators from the previous crawl. returns None if the page did not change
+
+        a streamed response is left unread, the caller reads it, counts its bytes and closes it
+    """
+    # imported on first use, the parser processes and the server's startup don't need it
+    import requests
+
+    headers = {'User-Agent': USER_AGENT}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    response = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT, stream=stream)
+
+    if response.status_code == 304:
+        response.close()
+        run.count('not_modified')
+        return None
 
-def get_db_connection():
-    """ connect to db """
     try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except Exception as e:
-        logger.error(f'Database connection error: {e}')
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
         raise
+    run.count('fetched')
+    if not stream:
+        run.count('bytes_fetched', len(response.content))
+    return response
+
+
+def parse_article_page(url, html):
+    """ extract article fields from article page html, metadata from JSON-LD/meta tags before the page selectors """
+    # imported on first use, only the parser processes need it
+    from bs4 import BeautifulSoup
+
+    metadata = extract_metadata(html)
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # the visible headline is what versions are compared on, JSON-LD only fills in when it is missing
+    headline_elem = soup.select_one('.seitenkopf__headline--text')
+    if headline_elem:
+        headline = headline_elem.get_text(strip=True)
+    else:
+        headline = metadata['headline'] or 'No headline found'
+
+    sub_headline_elem = soup.select_one('.seitenkopf__topline')
+    sub_headline = sub_headline_elem.get_text(strip=True) if sub_headline_elem else ''
+
+    article_body = soup.select_one('div.article__body')
+    if article_body:
+        content_elems = article_body.find_all('p')
+    elif soup.select('p.textabsatz'):
+        content_elems = soup.select('p.textabsatz')
+    else:
+        content_elems = []
+
+    content = '\n\n'.join(p.get_text(strip=True) for p in content_elems)
+    if not content:
+        logger.warning(f'No content found for {url}')
+        content = PLACEHOLDER_CONTENT
+
+    # local wall time, like the "Stand:" line
+    updated_at = to_local_time(metadata['modified_at']).isoformat() if metadata['modified_at'] else None
+    updated_at_elem = None if updated_at else soup.select_one('.metatextline')
+    if updated_at_elem:
+        date_text_raw = updated_at_elem.get_text(strip=True)
+        date_text = date_text_raw.replace('Stand:', '').replace('Uhr', '').strip()
+
+        try:
+            updated_at = datetime.strptime(date_text, '%d.%m.%Y %H:%M').isoformat()
+        except ValueError:
+            logger.warning('Can not parse date, skipping')
+            updated_at = None
+    if not updated_at:
+        logger.warning(f'No updated_at element found for {url}')
+
+    return {
+        'url': url,
+        'headline': headline,
+        'sub_headline': sub_headline,
+        'content': content,
+        'updated_at': updated_at,
+        'published_at': metadata['published_at'].isoformat() if metadata['published_at'] else None,
+        'modified_at': metadata['modified_at'].isoformat() if metadata['modified_at'] else None,
+        'author': metadata['author'],
+        'section': metadata['section'],
+        'keywords': metadata['keywords'],
+    }
+
+
+def archive_response(url, response):
+    """ keep the raw html for re-parsing if the archive is enabled """
+    archive = get_archive()
+    if archive is None:
+        return
+    try:
+        archive.store(url, response.content, response.encoding)
+    except Exception as e:
+        logger.warning(f'Could not archive {url}: {e}')
 
 
-def crawl_article_page(url):
-    """ get content from an article page """
+def fetch_article(url, run, validators=None):
+    """ fetch stage, raw article page or None if it was not modified. errors are raised to the caller """
     logger.info(f'Crawling article page: {url}')
 
-    try:
-        headers = {'User-Agent': USER_AGENT}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+    response = fetch_page(url, run, validators)
+    if response is None:
+        logger.info(f'Article {url} not modified')
+        touch_article(url)
+        return None
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+    archive_response(url, response)
 
-        headline_elem = soup.select_one('.seitenkopf__headline--text')
-        headline = headline_elem.get_text(strip=True) if headline_elem else 'No headline found'
+    return {
+        'url': url,
+        'html': response.text,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
 
-        sub_headline_elem = soup.select_one('.seitenkopf__topline')
-        sub_headline = sub_headline_elem.get_text(strip=True) if sub_headline_elem else ''
 
-        article_body = soup.select_one('div.article__body')
-        if article_body:
-            content_elems = article_body.find_all('p')
-        elif soup.select('p.textabsatz'):
-            content_elems = soup.select('p.textabsatz')
-        else:
-            content_elems = []
-
-        content = '\n\n'.join(p.get_text(strip=True) for p in content_elems)
-        if not content:
-            logger.warning(f'No content found for {url}')
-            content = 'No content found'
-
-        updated_at = None
-        updated_at_elem = soup.select_one('.metatextline')
-        if updated_at_elem:
-            date_text_raw = updated_at_elem.get_text(strip=True)
-            date_text = date_text_raw.replace('Stand:', '').replace('Uhr', '').strip()
-
-            try:
-                updated_at = datetime.strptime(date_text, '%d.%m.%Y %H:%M').isoformat()
-            except ValueError:
-                logger.warning('Can not parse date, skipping')
-                updated_at = None
-        if not updated_at:
-            logger.warning(f'No updated_at element found for {url}')
-
-        return {
-            'url': url,
-            'headline': headline,
-            'sub_headline': sub_headline,
-            'content': content,
-            'updated_at': updated_at,
-        }
+def parse_fetched_article(page):
+    """ parse stage, runs in the parser processes """
+    article_data = parse_article_page(page['url'], page['html'])
+    article_data['etag'] = page['etag']
+    article_data['last_modified'] = page['last_modified']
+    # hashed here so the writer doesn't have to
+    article_data['simhash'] = article_simhash(article_data)
+    return article_data
 
+
+def crawl_article_page(url, run=None, validators=None):
+    """ get content from an article page, None if it failed or is unchanged since the last crawl """
+    run = run if run is not None else CrawlRun('article')
+
+    try:
+        with run.timed('fetch'):
+            page = fetch_article(url, run, validators)
     except Exception as e:
+        run.count('failed')
         logger.error(f'Crawling article page error: {e}')
         return None
+    if page is None:
+        return None
+
+    try:
+        with run.timed('parse'):
+            return parse_fetched_article(page)
+    except Exception as e:
+        run.count('failed')
+        logger.error(f'Parsing article page error: {e}')
+        return None
 
 
-def store_article(article_data):
-    """ store article data in db with version history """
-    if not article_data:
-        return False
+def load_validators(urls):
+    """ etag and last-modified of known articles, used for conditional requests """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT url, etag, last_modified FROM articles WHERE url = ANY(%s)',
+                (list(urls),)
+            )
+            return {url: (etag, last_modified) for url, etag, last_modified in cursor.fetchall()}
+    finally:
+        conn.close()
+
 
+def touch_article(url):
+    """ article not modified, just update last_crawled_at """
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cursor:
-            # check for existing
+        with conn.cursor() as cursor:
             cursor.execute(
-                'SELECT * FROM articles WHERE url = %s', (article_data['url'],)
+                'UPDATE articles SET last_crawled_at = GREATEST(last_crawled_at, NOW()) WHERE url = %s', (url,)
             )
-            existing_article = cursor.fetchone()
-
-            if existing_article:
-                if (existing_article['headline'] != article_data['headline'] or
-                    existing_article['sub_headline'] != article_data['sub_headline'] or
-                    existing_article['content'] != article_data['content']):
-
-                    # store old version
-                    cursor.execute(
-                        """
-                        INSERT INTO articles_versions (article_id, headline, sub_headline, content, crawled_at)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """,
-                        (
-                            existing_article['id'],
-                            existing_article['headline'],
-                            existing_article['sub_headline'],
-                            existing_article['content'],
-                            existing_article['last_crawled_at']
-                        )
-                    )
-
-                    # update current version
-                    cursor.execute(
-                        """
-                        UPDATE articles
-                        SET headline = %s, sub_headline = %s, content = %s, updated_at = %s, last_crawled_at = NOW()
-                        WHERE id = %s 
-                        """,
-                        (
-                            article_data['headline'],
-                            article_data['sub_headline'],
-                            article_data['content'],
-                            article_data['updated_at'],
-                            existing_article['id']
-                        )
-                    )
-
-                    logger.info(f'Updated article {existing_article['id']} with new version')
-                    conn.commit()
-                    return True
-                else:
-                    # just update last_crawled_at
-                    cursor.execute(
-                        'UPDATE articles SET last_crawled_at = NOW() WHERE id = %s',
-                        (existing_article['id'],)
-                    )
-                    logger.info(f'Article {existing_article['id']} unchanged')
-                    conn.commit()
-                    return False
-            else:
-                # new article
-                cursor.execute(
-                    """
-                    INSERT INTO articles (url, headline, sub_headline, content, updated_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                    """,
-                    (
-                        article_data['url'],
-                        article_data['headline'],
-                        article_data['sub_headline'],
-                        article_data['content'],
-                        article_data['updated_at']
-                    )
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def lock_change_feed(cursor):
+    """ serialise change_seq assignment until commit so the feed never skips a lower, later-committed seq. taken
+        before any article row lock, otherwise two batches could each hold what the other one waits for
+    """
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (CHANGE_FEED_LOCK_ID,))
+
+
+def notify_change(cursor, change_seq):
+    """ wake up change feed listeners, delivered by postgres on commit """
+    cursor.execute('SELECT pg_notify(%s, %s)', (CHANGE_FEED_CHANNEL, str(change_seq)))
+
+
+def content_hash(article_data):
+    """ simhash from the parse stage, computed now for articles from other sources """
+    if 'simhash' not in article_data:
+        return article_simhash(article_data)
+    return article_data['simhash']
+
+
+def word_count(text):
+    """ whitespace separated words, same as the backfill in migrations/0003 """
+    return len(text.split())
+
+
+def metadata_values(article_data):
+    return tuple(article_data.get(field) for field in ARTICLE_METADATA_FIELDS)
+
+
+def _store_article(cursor, article_data, rollup=None, hashes=None):
+    """ write one article and its previous version, returns 'new', 'updated' or 'unchanged'
+
+        the caller holds the change feed lock. new articles and edits are counted on rollup and the simhash of new
+        content is added to hashes last, after every statement that could fail. hashes are indexed for the whole batch
+        at once. NOW() is when the transaction started, a batch that committed first may have started later, so
+        last_crawled_at and superseded_at never go back from the article's last_crawled_at
+    """
+    # check for existing, compared in the database so the stored content isn't shipped back to us. the row is updated
+    # either way, locking it now keeps changed and first_edit right when another batch writes the same article
+    cursor.execute(
+        """
+        SELECT id, (headline, sub_headline, content) IS DISTINCT FROM (%s, %s, %s) AS changed,
+            first_edited_at IS NULL AS first_edit
+        FROM articles WHERE url = %s
+        FOR UPDATE
+        """,
+        (article_data['headline'], article_data['sub_headline'], article_data['content'], article_data['url'])
+    )
+    existing_article = cursor.fetchone()
+
+    if existing_article:
+        article_id = existing_article['id']
+        if existing_article['changed']:
+
+            # store old version, it was current until now
+            cursor.execute(
+                """
+                INSERT INTO articles_versions (article_id, headline, sub_headline, content, crawled_at, superseded_at)
+                SELECT id, headline, sub_headline, content, last_crawled_at, GREATEST(last_crawled_at, NOW())
+                FROM articles WHERE id = %s
+                """,
+                (article_id,)
+            )
+
+            # update current version
+            cursor.execute(
+                f"""
+                UPDATE articles
+                SET headline = %s, sub_headline = %s, content = %s, updated_at = %s,
+                    last_crawled_at = GREATEST(last_crawled_at, NOW()),
+                    etag = COALESCE(%s, etag), last_modified = COALESCE(%s, last_modified),
+                    change_seq = nextval('articles_change_seq'), word_count = %s, version_count = version_count + 1,
+                    first_edited_at = COALESCE(first_edited_at, GREATEST(last_crawled_at, NOW())),
+                    {METADATA_ASSIGNMENTS}
+                WHERE id = %s
+                RETURNING change_seq, EXTRACT(EPOCH FROM NOW() - first_crawled_at)::FLOAT
+                """,
+                (
+                    article_data['headline'],
+                    article_data['sub_headline'],
+                    article_data['content'],
+                    article_data['updated_at'],
+                    article_data.get('etag'),
+                    article_data.get('last_modified'),
+                    word_count(article_data['content']),
+                    *metadata_values(article_data),
+                    article_id
                 )
-                article_id = cursor.fetchone()[0]
-                logger.info(f'Inserted new article {article_id}')
-                conn.commit()
-                return True
+            )
+            change_seq, seconds_since_first_crawl = cursor.fetchone()
+            notify_change(cursor, change_seq)
+            if hashes is not None:
+                hashes[article_id] = content_hash(article_data)
+            if rollup is not None:
+                rollup.add_edit(article_id, seconds_since_first_crawl if existing_article['first_edit'] else None)
+
+            logger.info(f'Updated article {article_id} with new version')
+            return 'updated'
+        else:
+            # just update last_crawled_at, validators and metadata
+            cursor.execute(
+                f"""
+                UPDATE articles
+                SET last_crawled_at = GREATEST(last_crawled_at, NOW()),
+                    etag = COALESCE(%s, etag), last_modified = COALESCE(%s, last_modified),
+                    {METADATA_ASSIGNMENTS}
+                WHERE id = %s
+                """,
+                (article_data.get('etag'), article_data.get('last_modified'), *metadata_values(article_data), article_id)
+            )
+            logger.info(f'Article {article_id} unchanged')
+            return 'unchanged'
+    else:
+        # new article
+        cursor.execute(
+            f"""
+            INSERT INTO articles (
+                url, headline, sub_headline, content, updated_at, etag, last_modified, word_count,
+                {', '.join(ARTICLE_METADATA_FIELDS)}
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, {', '.join(['%s'] * len(ARTICLE_METADATA_FIELDS))})
+            RETURNING id, change_seq
+            """,
+            (
+                article_data['url'],
+                article_data['headline'],
+                article_data['sub_headline'],
+                article_data['content'],
+                article_data['updated_at'],
+                article_data.get('etag'),
+                article_data.get('last_modified'),
+                word_count(article_data['content']),
+                *metadata_values(article_data)
+            )
+        )
+        article_id, change_seq = cursor.fetchone()
+        notify_change(cursor, change_seq)
+        if hashes is not None:
+            hashes[article_id] = content_hash(article_data)
+        if rollup is not None:
+            rollup.add_new()
+        logger.info(f'Inserted new article {article_id}')
+        return 'new'
+
+
+def index_similar(cursor, hashes):
+    """ link the batch's new content to its near-duplicates, a failure leaves the articles stored """
+    cursor.execute('SAVEPOINT similarity_index')
+    try:
+        index_articles(cursor, hashes)
+        cursor.execute('RELEASE SAVEPOINT similarity_index')
+    except Exception as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT similarity_index')
+        logger.error(f'Error indexing near-duplicates: {e}')
+
+
+def store_articles(articles, run=None):
+    """ store a batch of articles in one transaction with version history
+
+        returns the outcome per article: 'new', 'updated', 'unchanged' or 'failed'
+    """
+    if not articles:
+        return []
+    run = run if run is not None else CrawlRun('article')
+
+    outcomes = []
+    rollup = EditRollup()
+    hashes = {}
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            lock_change_feed(cursor)
+            for article_data in articles:
+                # a bad article must not roll back the rest of the batch
+                cursor.execute('SAVEPOINT store_article')
+                try:
+                    outcomes.append(_store_article(cursor, article_data, rollup, hashes))
+                    cursor.execute('RELEASE SAVEPOINT store_article')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT store_article')
+                    outcomes.append('failed')
+                    logger.error(f'Error storing article {article_data["url"]}: {e}')
+            index_similar(cursor, hashes)
+            rollup.flush(cursor)
+        conn.commit()
 
     except Exception as e:
         conn.rollback()
-        logger.error(f'Error storing article: {e}')
-        return False
+        logger.error(f'Error storing articles: {e}')
+        outcomes = ['failed'] * len(articles)
     finally:
         conn.close()
 
-def extract_article_links(overview_html):
-    """ extract article links from overview page """
-    soup = BeautifulSoup(overview_html, 'html.parser')
+    for outcome in outcomes:
+        run.count(STORE_OUTCOME_COUNTERS[outcome])
+    return outcomes
+
+
+def store_article(article_data, run=None):
+    """ store article data in db with version history, returns True if a new version was created """
+    return store_articles([article_data], run)[0] in ('new', 'updated')
+
+
+def crawl_article_links(urls, run, on_result=None, frontier=None):
+    """ fetch, parse and store articles through the crawl pipeline, returns the number of new versions
+
+        every url's outcome is checkpointed on the run's frontier, saved here unless a resumed run passes its own.
+        an interrupted run stops taking new urls and leaves the rest pending
+    """
+    if frontier is None:
+        frontier = Frontier(run)
+        frontier.save(urls)
+    validators = load_validators(urls)
+
+    def report(url, outcome, error=None):
+        frontier.record(url, outcome)
+        if on_result is not None:
+            on_result(url, outcome, error)
+
+    pipeline = CrawlPipeline(
+        run,
+        fetch=lambda url: fetch_article(url, run, validators.get(url)),
+        parse=parse_fetched_article,
+        store=lambda batch: store_articles(batch, run),
+        on_result=report,
+        # the profiler only samples this process, so profiled runs parse in the fetcher threads
+        parse_workers=0 if run.profile else PARSE_WORKERS,
+        stop_event=run.stop_event,
+    )
+    try:
+        return pipeline.process(urls)
+    finally:
+        frontier.checkpoint()
 
-    links = []
 
-    link_elems = soup.select('.teaser__link')
+def crawl_overview_page(run=None, mode=None):
+    """ crawl the overview page and process its articles, all of them or in incremental mode only new or changed ones """
+    mode = mode or OVERVIEW_MODE
+    logger.info(f'Starting overview page crawl ({mode})')
+    run = run if run is not None else CrawlRun('manual')
 
-    for link_elem in link_elems:
-        if link_elem.has_attr('href'):
-            href = link_elem['href']
-            href = urljoin(TAGESSCHAU_URL, href)
-            links.append(href)
+    try:
+        run.start()
 
-    return list(set(links))
+        with profile_run(run):
+            # the teasers are parsed while the page downloads
+            with run.timed('fetch'):
+                response = fetch_page(TAGESSCHAU_URL, run, stream=True)
+                teasers = stream_teasers(response, TAGESSCHAU_URL, run)
+            run.count('links_found', len(teasers))
 
+            article_links = select_changed(teasers) if mode == 'incremental' else list(teasers)
+            run.count('links_skipped', len(teasers) - len(article_links))
+            logger.info(f'Found {len(teasers)} article links, {len(article_links)} to crawl')
 
-def crawl_overview_page():
-    """ crawl the overview page and process all articles"""
-    logger.info(f'Starting overview page crawl')
+            checked = []
 
-    try:
-        headers = {'User-Agent': USER_AGENT}
-        response = requests.get(TAGESSCHAU_URL, headers=headers, timeout=10)
-        response.raise_for_status()
+            def on_result(url, outcome, error=None):
+                if outcome != 'failed':
+                    checked.append(url)
 
-        article_links = extract_article_links(response.text)
-        logger.info(f'Found {len(article_links)} article links')
+            new_versions_count = crawl_article_links(article_links, run, on_result) if article_links else 0
+            save_teasers(teasers, checked)
 
-        new_versions_count = 0
-        for link in article_links:
-            article_data = crawl_article_page(link)
-            if article_data and store_article(article_data):
-                new_versions_count += 1
+        if run.interrupted:
+            logger.info(f'Crawl interrupted after {new_versions_count} new versions, the rest is resumed later')
+            run.finish('interrupted')
+            return new_versions_count
 
         logger.info(f'Crawl complete. Found {new_versions_count} new versions')
 
-        conn = get_db_connection()
-        try:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute(
-                    'UPDATE crawler_config SET last_run = NOW() WHERE id =1'
-                )
-                conn.commit()
-        finally:
-            conn.close()
+        config_store.mark_last_run()
+        run.finish('success')
 
         return new_versions_count
 
     except Exception as e:
         logger.error(f'Error crawling page: {e}')
+        run.finish('failed', error=str(e))
         return 0
 
 
 def crawl_single_article(url):
     """ crawl an article by url """
     logger.info(f'Starting single article crawl: {url}')
-    article_data = crawl_article_page(url)
+    article_data = crawl_article_page(url, validators=load_validators([url]).get(url))
     if article_data and store_article(article_data):
         return True
     return False
+
+
+def validate_article_urls(urls):
+    """ split into valid, de-duplicated http(s) urls and invalid entries """
+    valid, invalid = [], []
+    for url in urls:
+        parsed = urlparse(url) if isinstance(url, str) else None
+        if parsed is None or parsed.scheme not in ('http', 'https') or not parsed.netloc or len(url) > 255:
+            invalid.append(url)
+        elif url not in valid:
+            valid.append(url)
+    return valid, invalid
+
+
+def crawl_articles(urls, run, on_result=None):
+    """ crawl a list of article urls as one run, on_result(url, outcome, error) is called as each url finishes """
+    logger.info(f'Starting batch crawl of {len(urls)} articles')
+
+    try:
+        run.start()
+        run.count('links_found', len(urls))
+        with profile_run(run):
+            new_versions_count = crawl_article_links(urls, run, on_result)
+        if run.interrupted:
+            logger.info(f'Batch crawl interrupted after {new_versions_count} new versions, the rest is resumed later')
+            run.finish('interrupted')
+            return new_versions_count
+        logger.info(f'Batch crawl complete. Found {new_versions_count} new versions')
+        run.finish('success')
+        return new_versions_count
+
+    except Exception as e:
+        logger.error(f'Error in batch crawl: {e}')
+        run.finish('failed', error=str(e))
+        return 0
+
+
+def resume_run(run):
+    """ crawl the pending urls of a claimed run, returns the number of new versions
+
+        teasers of a resumed overview run are not saved, an incremental crawl checks them again
+    """
+    frontier = Frontier(run)
+    try:
+        pending = frontier.load()
+        if pending is None:
+            run.finish('failed', error='crawler stopped before the run saved its urls')
+            return 0
+
+        logger.info(f'Resuming {run.trigger} crawl run {run.id} with {len(pending)} urls left')
+        new_versions_count = crawl_article_links(pending, run, frontier=frontier) if pending else 0
+        run.finish('interrupted' if run.interrupted else 'success')
+        return new_versions_count
+
+    except Exception as e:
+        logger.error(f'Error resuming crawl run {run.id}: {e}')
+        run.finish('failed', error=str(e))
+        return 0
+
+
+def resume_interrupted_runs(stop_event=None):
+    """ finish the runs of stopped or crashed crawlers, returns the number of runs resumed """
+    resumed = 0
+    for run_id in unfinished_run_ids():
+        if stop_event is not None and stop_event.is_set():
+            break
+        run = CrawlRun.claim(run_id)
+        if run is None:
+            continue
+        resume_run(run)
+        resumed += 1
+    return resumed
@@ -0,0 +1,39 @@
+import os
+
+# production server settings, see README "Running in production"
+bind = f'0.0.0.0:{os.environ.get("PORT", "8000")}'
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+threads = int(os.environ.get('WEB_THREADS', '4'))
+# overview crawls run inside the request, gthread workers keep heartbeating while a request is busy
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """ every worker migrates the database and then runs a scheduler thread in the background, the advisory locks
+        make only one of them apply migrations and only one crawl. the api answers 503 until migrations are applied,
+        see /ready
+    """
+    import signal
+    from api import start
+    from runs import interrupt_runs
+    start()
+
+    # crawls running in requests stop taking new urls on shutdown, so they finish within graceful_timeout and are
+    # resumed after the restart
+    handle_exit = worker.handle_exit
+
+    def interrupt_and_exit(sig, frame):
+        interrupt_runs()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, interrupt_and_exit)
+
+
+def worker_exit(server, worker):
+    """ stop the scheduler cleanly so its leader lock is released for the other workers """
+    from api import scheduler
+    scheduler.stop()
@@ -0,0 +1,154 @@
+""" article metadata from embedded JSON-LD and meta tags
+
+    both are found with regular expressions on the raw html, which is much cheaper than building a DOM. JSON-LD
+    values win over meta tags.
+"""
+import html
+import json
+import logging
+import re
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+JSON_LD_RE = re.compile(
+    r'<script[^>]*\btype\s*=\s*["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.IGNORECASE | re.DOTALL
+)
+META_RE = re.compile(r'<meta\b([^>]*)>', re.IGNORECASE)
+ATTRIBUTE_RE = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+# meta tags per field, first match wins
+META_TAGS = {
+    'published_at': ('article:published_time', 'date', 'dcterms.created'),
+    'modified_at': ('article:modified_time', 'last-modified', 'dcterms.modified'),
+    'author': ('author', 'article:author'),
+    'section': ('article:section',),
+    'keywords': ('keywords', 'news_keywords', 'article:tag'),
+}
+
+# tagesschau.de publishes in german time, timestamps without an offset are in it
+LOCAL_TIMEZONE = ZoneInfo('Europe/Berlin')
+
+MAX_HEADLINE_LENGTH = 255
+MAX_AUTHOR_LENGTH = 255
+MAX_SECTION_LENGTH = 100
+MAX_KEYWORDS = 50
+
+
+def json_ld_objects(raw_html):
+    """ all JSON-LD objects of the page, including the ones inside @graph """
+    objects = []
+    for block in JSON_LD_RE.findall(raw_html):
+        try:
+            data = json.loads(block.strip())
+        except ValueError:
+            logger.warning('Invalid JSON-LD block, skipping')
+            continue
+
+        pending = data if isinstance(data, list) else [data]
+        while pending:
+            item = pending.pop(0)
+            if isinstance(item, dict):
+                objects.append(item)
+                graph = item.get('@graph', [])
+                pending.extend(graph if isinstance(graph, list) else [graph])
+    return objects
+
+
+def is_article(item):
+    types = item.get('@type', [])
+    types = types if isinstance(types, list) else [types]
+    return any(isinstance(type_, str) and type_.endswith(('Article', 'BlogPosting')) for type_ in types)
+
+
+def meta_tags(raw_html):
+    """ lower cased name/property -> list of content values """
+    tags = {}
+    for attributes in META_RE.findall(raw_html):
+        values = {name.lower(): double or single for name, double, single in ATTRIBUTE_RE.findall(attributes)}
+        key = values.get('property') or values.get('name') or values.get('itemprop')
+        if key and 'content' in values:
+            tags.setdefault(key.lower(), []).append(html.unescape(values['content']).strip())
+    return tags
+
+
+def first(values):
+    return values[0] if values else None
+
+
+def parse_datetime(value):
+    """ ISO 8601 timestamp as naive local wall time or None, values with an offset are converted to LOCAL_TIMEZONE """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f'Can not parse date {value!r}, skipping')
+        return None
+    return to_local_time(parsed)
+
+
+def to_local_time(value):
+    """ naive wall time in LOCAL_TIMEZONE, naive values are taken to be in it already """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+
+def localize(value):
+    """ naive local wall time as an aware datetime, for the timestamptz columns """
+    return value.replace(tzinfo=LOCAL_TIMEZONE) if value is not None else None
+
+
+def names(value):
+    """ author names from a string, a Person/Organization object or a list of them """
+    values = value if isinstance(value, list) else [value]
+    result = []
+    for item in values:
+        name = item.get('name') if isinstance(item, dict) else item
+        if isinstance(name, str) and name.strip() and name.strip() not in result:
+            result.append(name.strip())
+    return result
+
+
+def keyword_list(values):
+    """ keywords from comma separated strings and lists, de-duplicated in order """
+    result = []
+    for value in values:
+        parts = value if isinstance(value, list) else str(value).split(',')
+        for part in parts:
+            keyword = str(part).strip()
+            if keyword and keyword not in result:
+                result.append(keyword)
+    return result[:MAX_KEYWORDS]
+
+
+def extract_metadata(raw_html):
+    """ published_at/modified_at (timezone aware datetimes), author, section, keywords and headline, None if absent """
+    article = next((item for item in json_ld_objects(raw_html) if is_article(item)), {})
+    tags = meta_tags(raw_html)
+
+    def meta(field):
+        return next((tags[tag] for tag in META_TAGS[field] if tags.get(tag)), [])
+
+    section = article.get('articleSection')
+    if isinstance(section, list):
+        section = first(section)
+    section = section or first(meta('section'))
+
+    authors = names(article.get('author')) or meta('author')[:1]
+    keywords = keyword_list([article['keywords']] if article.get('keywords') else meta('keywords'))
+    headline = article.get('headline')
+
+    published_at = parse_datetime(article.get('datePublished')) or parse_datetime(first(meta('published_at')))
+    modified_at = parse_datetime(article.get('dateModified')) or parse_datetime(first(meta('modified_at')))
+
+    return {
+        'published_at': localize(published_at),
+        'modified_at': localize(modified_at),
+        'author': ', '.join(authors)[:MAX_AUTHOR_LENGTH] or None,
+        'section': section.strip()[:MAX_SECTION_LENGTH] if isinstance(section, str) and section.strip() else None,
+        'keywords': keywords or None,
+        'headline': headline.strip()[:MAX_HEADLINE_LENGTH] if isinstance(headline, str) and headline.strip() else None,
+    }
@@ -0,0 +1,281 @@
+""" versioned schema migrations for the crawler database
+
+    migrations live in migrations/ as NNNN_name.sql or NNNN_name.py and are applied in order, each exactly once,
+    by whichever process holds the migration lock. the crawler runs them at startup, the other services wait until the
+    schema version they need is applied.
+
+    .sql files run in one transaction. files starting with `-- migrate: no-transaction` run statement by statement in
+    autocommit mode instead, which CREATE INDEX CONCURRENTLY needs.
+    .py files define migrate(conn). with TRANSACTIONAL = False the module commits itself, e.g. through backfill(), and
+    must be safe to re-run after an interruption.
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   list applied and pending migrations
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import re
+import time
+from psycopg2 import errors
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+CONCURRENT_INDEX_RE = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.IGNORECASE
+)
+
+# session level advisory lock, serialises migrations across workers and containers
+MIGRATION_LOCK_ID = 29001
+
+# DDL waits at most this long for a table lock, so a migration queued behind a long query doesn't block all traffic
+MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+MIGRATION_LOCK_RETRIES = int(os.environ.get('MIGRATION_LOCK_RETRIES', '5'))
+
+# rows per transaction in backfill(), and the pause between batches to leave room for normal traffic
+BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE', '1000'))
+BACKFILL_PAUSE_SECONDS = float(os.environ.get('BACKFILL_PAUSE_SECONDS', '0.05'))
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def is_python(self):
+        return self.path.endswith('.py')
+
+    def read_sql(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+    def load_module(self):
+        spec = importlib.util.spec_from_file_location(f'migration_{self.version:04d}', self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def is_transactional(self):
+        if self.is_python:
+            return getattr(self.load_module(), 'TRANSACTIONAL', True)
+        return not self.read_sql().lstrip().startswith(NO_TRANSACTION_MARKER)
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """ migrations in version order """
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f'Duplicate migration versions in {directory}')
+    return migrations
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            duration_seconds DOUBLE PRECISION NOT NULL
+        )
+        """
+    )
+
+
+def applied_versions(cursor):
+    cursor.execute('SELECT version FROM schema_migrations')
+    return {row[0] for row in cursor.fetchall()}
+
+
+def split_statements(sql):
+    """ split a no-transaction migration into statements, one per ';' at the end of a line """
+    statements = re.split(r';\s*$', sql, flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if strip_comments(statement).strip()]
+
+
+def strip_comments(sql):
+    return re.sub(r'--[^\n]*', '', sql)
+
+
+def drop_invalid_indexes(cursor, sql):
+    """ an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index that IF NOT EXISTS would skip """
+    for name in CONCURRENT_INDEX_RE.findall(sql):
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid
+            """,
+            (name,)
+        )
+        if cursor.fetchone():
+            logger.warning(f'Dropping invalid index {name} left by an interrupted migration')
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+def backfill(conn, table, assignments, where, params=(), key='id', batch_size=None, pause=None):
+    """ UPDATE table SET assignments for the rows matching where, in key order batches of one short transaction each
+
+        keyset pagination keeps every batch an index range scan, so the whole backfill is linear in the table size.
+        returns the number of updated rows.
+    """
+    batch_size = batch_size or BACKFILL_BATCH_SIZE
+    pause = BACKFILL_PAUSE_SECONDS if pause is None else pause
+    last_key = None
+    total = 0
+
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT MAX({key}) FROM (
+                    SELECT {key} FROM {table}
+                    WHERE %s IS NULL OR {key} > %s
+                    ORDER BY {key} LIMIT %s
+                ) batch
+                """,
+                (last_key, last_key, batch_size)
+            )
+            upper_key = cursor.fetchone()[0]
+            if upper_key is None:
+                break
+
+            cursor.execute(
+                f"""
+                UPDATE {table} SET {assignments}
+                WHERE (%s IS NULL OR {key} > %s) AND {key} <= %s AND ({where})
+                """,
+                (*params, last_key, last_key, upper_key)
+            )
+            total += cursor.rowcount
+        conn.commit()
+
+        last_key = upper_key
+        if pause:
+            time.sleep(pause)
+
+    logger.info(f'Backfilled {total} rows of {table}')
+    return total
+
+
+def with_lock_retries(func):
+    """ retry func when it gave up waiting for a table lock """
+    for attempt in range(1, MIGRATION_LOCK_RETRIES + 1):
+        try:
+            return func()
+        except errors.LockNotAvailable:
+            if attempt == MIGRATION_LOCK_RETRIES:
+                raise
+            logger.warning(f'Migration timed out waiting for a lock, retry {attempt}/{MIGRATION_LOCK_RETRIES - 1}')
+            time.sleep(attempt)
+
+
+def apply_migration(conn, migration):
+    """ apply one migration and record it, in the same transaction unless it is a no-transaction migration """
+    transactional = migration.is_transactional()
+    logger.info(
+        f'Applying migration {migration.version:04d}_{migration.name}' +
+        ('' if transactional else ' (no transaction)')
+    )
+
+    def run():
+        started = time.perf_counter()
+        conn.autocommit = not transactional
+        try:
+            with conn.cursor() as cursor:
+                if migration.is_python:
+                    migration.load_module().migrate(conn)
+                elif transactional:
+                    cursor.execute(migration.read_sql())
+                else:
+                    sql = migration.read_sql()
+                    drop_invalid_indexes(cursor, sql)
+                    for statement in split_statements(sql):
+                        cursor.execute(statement)
+
+                duration = time.perf_counter() - started
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, name, duration_seconds) VALUES (%s, %s, %s)',
+                    (migration.version, migration.name, duration)
+                )
+            conn.commit()
+            return duration
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.autocommit = True
+
+    duration = with_lock_retries(run)
+    logger.info(f'Applied migration {migration.version:04d}_{migration.name} in {duration:.2f}s')
+
+
+def run_migrations():
+    """ apply all pending migrations, returns the versions applied by this call """
+    migrations = discover_migrations()
+    conn = get_db_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+            cursor.execute('SET lock_timeout = %s', (MIGRATION_LOCK_TIMEOUT,))
+            ensure_migrations_table(cursor)
+            applied = applied_versions(cursor)
+
+        pending = [migration for migration in migrations if migration.version not in applied]
+        for migration in pending:
+            apply_migration(conn, migration)
+
+        if pending:
+            logger.info(f'Schema at version {migrations[-1].version}')
+        return [migration.version for migration in pending]
+    finally:
+        # closing the session releases the advisory lock
+        conn.close()
+
+
+def print_status():
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            ensure_migrations_table(cursor)
+            cursor.execute('SELECT version, applied_at FROM schema_migrations')
+            applied = dict(cursor.fetchall())
+        conn.commit()
+    finally:
+        conn.close()
+
+    for migration in discover_migrations():
+        state = f'applied {applied[migration.version]:%Y-%m-%d %H:%M}' if migration.version in applied else 'pending'
+        print(f'{migration.version:04d}_{migration.name:<40} {state}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawler database migrations')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations')
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+    else:
+        run_migrations()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
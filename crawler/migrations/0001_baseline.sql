@@ -0,0 +1,105 @@
+-- schema as of the introduction of migrations. idempotent, so databases created from db/init.sql before that
+-- (including ones missing later columns) are brought to the same state
+
+-- monotonic sequence bumped on every insert/content change, drives the explorer change feed
+CREATE SEQUENCE IF NOT EXISTS articles_change_seq;
+
+-- articles table
+CREATE TABLE IF NOT EXISTS articles (
+    id SERIAL PRIMARY KEY,
+    url VARCHAR(255) NOT NULL UNIQUE,
+    headline VARCHAR(255) NOT NULL,
+    sub_headline VARCHAR(255) NOT NULL,
+    content TEXT NOT NULL,
+    updated_at TIMESTAMP,
+    first_crawled_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_crawled_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE articles
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('articles_change_seq'),
+    -- validators from the last response, sent back as If-None-Match / If-Modified-Since
+    ADD COLUMN IF NOT EXISTS etag VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS last_modified VARCHAR(64),
+    -- 64 bit simhash of headline + content and its four 16 bit bands for near-duplicate lookups
+    ADD COLUMN IF NOT EXISTS simhash BIGINT,
+    ADD COLUMN IF NOT EXISTS simhash_band0 INT,
+    ADD COLUMN IF NOT EXISTS simhash_band1 INT,
+    ADD COLUMN IF NOT EXISTS simhash_band2 INT,
+    ADD COLUMN IF NOT EXISTS simhash_band3 INT;
+
+-- articles_versions table to hold previous versions of articles, partitioned by month. the crawler creates
+-- monthly partitions ahead of time (crawler/retention.py), the default partition only catches stragglers.
+-- an existing unpartitioned table is converted by 0002
+CREATE TABLE IF NOT EXISTS articles_versions (
+    id SERIAL,
+    article_id INT REFERENCES articles(id) ON DELETE CASCADE,
+    headline VARCHAR(255) NOT NULL,
+    sub_headline VARCHAR(255) NOT NULL,
+    content TEXT NOT NULL,
+    crawled_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, crawled_at)
+) PARTITION BY RANGE (crawled_at);
+
+-- near-duplicate links, stored in both directions
+CREATE TABLE IF NOT EXISTS article_similarities (
+    article_id INT NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+    similar_article_id INT NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+    distance SMALLINT NOT NULL,
+    detected_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (article_id, similar_article_id)
+);
+
+-- crawler_config table to hold crawler configuration
+CREATE TABLE IF NOT EXISTS crawler_config (
+    id INT PRIMARY KEY DEFAULT 1, -- only one record needed
+    schedule_interval_hours INT NOT NULL DEFAULT 1,
+    is_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    last_run TIMESTAMP,
+    next_run TIMESTAMP
+);
+
+-- crawl_runs table, one row per overview crawl with its statistics
+CREATE TABLE IF NOT EXISTS crawl_runs (
+    id SERIAL PRIMARY KEY,
+    trigger VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP,
+    links_found INT NOT NULL DEFAULT 0,
+    fetched INT NOT NULL DEFAULT 0,
+    not_modified INT NOT NULL DEFAULT 0,
+    new_articles INT NOT NULL DEFAULT 0,
+    updated_articles INT NOT NULL DEFAULT 0,
+    unchanged INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    bytes_fetched BIGINT NOT NULL DEFAULT 0,
+    fetch_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    parse_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    store_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    error TEXT
+);
+
+-- items, busy/wall seconds, throughput and queue high-water mark per pipeline stage
+ALTER TABLE crawl_runs ADD COLUMN IF NOT EXISTS stage_metrics JSONB;
+
+CREATE INDEX IF NOT EXISTS idx_crawl_runs_started_at ON crawl_runs (started_at);
+
+-- insert default config
+INSERT INTO crawler_config (schedule_interval_hours, is_enabled)
+VALUES (1, TRUE)
+ON CONFLICT (id) DO NOTHING;
+
+-- create index for text search on articles table using Generic Inverted Index (GIN) adjusted for Deutsch
+CREATE INDEX IF NOT EXISTS idx_articles_headline ON articles USING gin(to_tsvector('german', headline));
+CREATE INDEX IF NOT EXISTS idx_articles_content ON articles USING gin(to_tsvector('german', content));
+
+-- change feed lookups (WHERE change_seq > cursor ORDER BY change_seq)
+CREATE INDEX IF NOT EXISTS idx_articles_change_seq ON articles (change_seq);
+
+-- near-duplicate candidates, one equality lookup per band
+CREATE INDEX IF NOT EXISTS idx_articles_simhash_band0 ON articles (simhash_band0);
+CREATE INDEX IF NOT EXISTS idx_articles_simhash_band1 ON articles (simhash_band1);
+CREATE INDEX IF NOT EXISTS idx_articles_simhash_band2 ON articles (simhash_band2);
+CREATE INDEX IF NOT EXISTS idx_articles_simhash_band3 ON articles (simhash_band3);
+CREATE INDEX IF NOT EXISTS idx_article_similarities_similar ON article_similarities (similar_article_id);
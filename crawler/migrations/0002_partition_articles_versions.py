@@ -0,0 +1,105 @@
+""" partition articles_versions by month
+
+    databases created before partitioning have a plain articles_versions table. it is converted online: a partitioned
+    copy is filled in id batches while the crawler keeps writing, then the tables are swapped in one short
+    transaction that also copies the rows written in the meantime. versions are only ever inserted, so copying by id
+    catches every row. an interrupted run resumes from the rows already copied.
+"""
+import logging
+from datetime import date
+from retention import add_months, partition_name
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONAL = False
+COPY_BATCH_SIZE = 5000
+VERSION_COLUMNS = 'id, article_id, headline, sub_headline, content, crawled_at'
+
+
+def create_partitioned_table(cursor, name):
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INT NOT NULL DEFAULT nextval('articles_versions_id_seq'),
+            article_id INT CONSTRAINT articles_versions_article_id_fkey REFERENCES articles(id) ON DELETE CASCADE,
+            headline VARCHAR(255) NOT NULL,
+            sub_headline VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL,
+            crawled_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            CONSTRAINT {name}_pkey PRIMARY KEY (id, crawled_at)
+        ) PARTITION BY RANGE (crawled_at)
+        """
+    )
+
+
+def create_default_partition_and_index(cursor, table):
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS articles_versions_default PARTITION OF {table} DEFAULT')
+    # version history of an article (WHERE article_id = ? ORDER BY crawled_at), inherited by every partition
+    cursor.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_articles_versions_article_crawled ON {table} (article_id, crawled_at)'
+    )
+
+
+def copy_batches(cursor, last_id, batch_size=COPY_BATCH_SIZE):
+    """ copy versions with id > last_id into the partitioned table, returns the highest copied id """
+    while True:
+        cursor.execute(
+            f"""
+            WITH batch AS (
+                SELECT {VERSION_COLUMNS} FROM articles_versions
+                WHERE id > %s ORDER BY id LIMIT %s
+            )
+            INSERT INTO articles_versions_partitioned SELECT * FROM batch
+            RETURNING id
+            """,
+            (last_id, batch_size)
+        )
+        copied = [row[0] for row in cursor.fetchall()]
+        if not copied:
+            return last_id
+        last_id = max(copied)
+        logger.info(f'Copied versions up to id {last_id}')
+
+
+def migrate(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'articles_versions'::regclass")
+        if cursor.fetchone()[0] == 'p':
+            create_default_partition_and_index(cursor, 'articles_versions')
+            return
+
+        create_partitioned_table(cursor, 'articles_versions_partitioned')
+        create_default_partition_and_index(cursor, 'articles_versions_partitioned')
+
+        # monthly partitions for the existing history, so copied rows go straight to their month
+        cursor.execute('SELECT MIN(crawled_at), MAX(crawled_at) FROM articles_versions')
+        first, last = cursor.fetchone()
+        this_month = date.today().replace(day=1)
+        month = first.date().replace(day=1) if first else this_month
+        end = add_months(max(last.date().replace(day=1), this_month) if last else this_month, 1)
+        while month < end:
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {partition_name(month)}
+                PARTITION OF articles_versions_partitioned FOR VALUES FROM (%s) TO (%s)
+                """,
+                (month, add_months(month, 1))
+            )
+            month = add_months(month, 1)
+
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM articles_versions_partitioned')
+        last_id = copy_batches(cursor, cursor.fetchone()[0])
+
+    # swap, writers wait only for the rows inserted since the last batch
+    conn.autocommit = False
+    with conn.cursor() as cursor:
+        cursor.execute('LOCK TABLE articles_versions IN ACCESS EXCLUSIVE MODE')
+        copy_batches(cursor, last_id)
+        cursor.execute('ALTER SEQUENCE articles_versions_id_seq OWNED BY articles_versions_partitioned.id')
+        cursor.execute('DROP TABLE articles_versions')
+        cursor.execute('ALTER TABLE articles_versions_partitioned RENAME TO articles_versions')
+        cursor.execute(
+            'ALTER TABLE articles_versions RENAME CONSTRAINT articles_versions_partitioned_pkey TO articles_versions_pkey'
+        )
+    conn.commit()
+    logger.info('articles_versions is now partitioned by month')
@@ -0,0 +1,23 @@
+""" summary columns on articles, so lists and metadata lookups don't need the content or the versions table
+
+    word_count and version_count are maintained by the crawler on write. existing rows are backfilled in batches.
+"""
+from migrate import backfill
+
+TRANSACTIONAL = False
+
+
+def migrate(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('ALTER TABLE articles ADD COLUMN IF NOT EXISTS word_count INT')
+        cursor.execute('ALTER TABLE articles ADD COLUMN IF NOT EXISTS version_count INT NOT NULL DEFAULT 0')
+
+    backfill(
+        conn,
+        'articles',
+        """
+        word_count = (SELECT COUNT(*) FROM regexp_matches(content, '\\S+', 'g')),
+        version_count = (SELECT COUNT(*) FROM articles_versions v WHERE v.article_id = articles.id)
+        """,
+        'word_count IS NULL'
+    )
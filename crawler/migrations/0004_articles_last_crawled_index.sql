@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- newest first article list (ORDER BY last_crawled_at DESC LIMIT n) without sorting the whole table
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_articles_last_crawled_at ON articles (last_crawled_at);
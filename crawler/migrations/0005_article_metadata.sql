@@ -0,0 +1,15 @@
+-- migrate: no-transaction
+-- structured metadata from JSON-LD/meta tags. filled on the next crawl of an article, or for all archived pages at
+-- once with `python reparse.py`
+ALTER TABLE articles
+    ADD COLUMN IF NOT EXISTS published_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS modified_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS author VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS section VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS keywords TEXT[];
+
+-- explorer filters: section and published date together, author, published date, keyword containment
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_articles_section_published_at ON articles (section, published_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_articles_author ON articles (author);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_articles_published_at ON articles (published_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_articles_keywords ON articles USING gin(keywords);
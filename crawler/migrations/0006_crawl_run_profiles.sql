@@ -0,0 +1,2 @@
+-- directory with the profile of a profiled crawl run, see profiler.py
+ALTER TABLE crawl_runs ADD COLUMN IF NOT EXISTS profile_path VARCHAR(255);
@@ -0,0 +1,14 @@
+-- teasers of the previous overview crawls, an incremental crawl only fetches new or changed ones, see overview.py
+CREATE TABLE IF NOT EXISTS overview_teasers (
+    url TEXT PRIMARY KEY,
+    fingerprint CHAR(40) NOT NULL,
+    headline TEXT NOT NULL,
+    topline TEXT NOT NULL,
+    first_seen_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    last_seen_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    -- last time the article behind the teaser was crawled without failing
+    checked_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- teaser links an incremental crawl left out because nothing changed
+ALTER TABLE crawl_runs ADD COLUMN IF NOT EXISTS links_skipped INT NOT NULL DEFAULT 0;
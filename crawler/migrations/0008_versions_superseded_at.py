@@ -0,0 +1,74 @@
+""" record when each version was replaced, for point in time queries
+
+    a version was the current state of its article from the superseded_at of the version before it (or the article's
+    first_crawled_at) until its own superseded_at. older versions only know when they were last seen, which is the
+    closest known time and is used as their superseded_at.
+
+    indexes can't be built concurrently on a partitioned table, so the parent index is created ON ONLY (invalid),
+    each partition's index concurrently and attached, which makes the parent index valid once all are attached.
+"""
+import logging
+from migrate import backfill
+
+logger = logging.getLogger(__name__)
+
+TRANSACTIONAL = False
+INDEX_NAME = 'idx_articles_versions_article_superseded'
+INDEX_COLUMNS = '(article_id, superseded_at)'
+
+
+def partitions(cursor):
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'articles_versions'::regclass
+        ORDER BY c.relname
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def attached_indexes(cursor):
+    """ partitions whose index is already attached to the parent index """
+    cursor.execute(
+        """
+        SELECT t.relname FROM pg_inherits i
+        JOIN pg_index x ON x.indexrelid = i.inhrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        (INDEX_NAME,)
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('ALTER TABLE articles_versions ADD COLUMN IF NOT EXISTS superseded_at TIMESTAMP')
+        # only applies to new rows, so no table rewrite
+        cursor.execute('ALTER TABLE articles_versions ALTER COLUMN superseded_at SET DEFAULT NOW()')
+
+    backfill(conn, 'articles_versions', 'superseded_at = crawled_at', 'superseded_at IS NULL')
+
+    with conn.cursor() as cursor:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY articles_versions {INDEX_COLUMNS}')
+        attached = attached_indexes(cursor)
+
+        for partition in partitions(cursor):
+            if partition in attached:
+                continue
+            index = f'{partition}_article_superseded_idx'
+            # left invalid by an interrupted run
+            cursor.execute(
+                """
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND NOT i.indisvalid
+                """,
+                (index,)
+            )
+            if cursor.fetchone():
+                cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {index}')
+            cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {partition} {INDEX_COLUMNS}')
+            cursor.execute(f'ALTER INDEX {INDEX_NAME} ATTACH PARTITION {index}')
+            logger.info(f'Indexed {partition} on {INDEX_COLUMNS}')
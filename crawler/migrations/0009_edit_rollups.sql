@@ -0,0 +1,46 @@
+-- rollups for the explorer analytics endpoints, maintained by the crawler on every store, see rollups.py
+CREATE TABLE IF NOT EXISTS edit_rollup_hourly (
+    bucket TIMESTAMP PRIMARY KEY,
+    new_articles INT NOT NULL DEFAULT 0,
+    -- versions superseded in the hour
+    edits INT NOT NULL DEFAULT 0,
+    -- articles edited for the first time in the hour and the seconds from their first crawl to that edit
+    first_edits INT NOT NULL DEFAULT 0,
+    first_edit_seconds DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS article_edits_daily (
+    day DATE NOT NULL,
+    article_id INT NOT NULL REFERENCES articles(id) ON DELETE CASCADE,
+    edits INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, article_id)
+);
+
+-- existing history, versions already moved to versions_archive by retention are not counted
+INSERT INTO edit_rollup_hourly (bucket, new_articles, edits, first_edits, first_edit_seconds)
+SELECT bucket, SUM(new_articles), SUM(edits), SUM(first_edits), SUM(first_edit_seconds)
+FROM (
+    SELECT date_trunc('hour', first_crawled_at) AS bucket, COUNT(*) AS new_articles, 0 AS edits,
+        0 AS first_edits, 0 AS first_edit_seconds
+    FROM articles
+    GROUP BY 1
+    UNION ALL
+    SELECT date_trunc('hour', superseded_at), 0, COUNT(*), 0, 0
+    FROM articles_versions
+    GROUP BY 1
+    UNION ALL
+    SELECT date_trunc('hour', first_edit.superseded_at), 0, 0, COUNT(*),
+        SUM(GREATEST(EXTRACT(EPOCH FROM first_edit.superseded_at - a.first_crawled_at), 0))
+    FROM (
+        SELECT article_id, MIN(superseded_at) AS superseded_at FROM articles_versions GROUP BY article_id
+    ) first_edit
+    JOIN articles a ON a.id = first_edit.article_id
+    GROUP BY 1
+) history
+GROUP BY bucket;
+
+INSERT INTO article_edits_daily (day, article_id, edits)
+SELECT superseded_at::DATE, article_id, COUNT(*)
+FROM articles_versions
+WHERE article_id IS NOT NULL
+GROUP BY 1, 2;
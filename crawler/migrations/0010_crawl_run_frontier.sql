@@ -0,0 +1,19 @@
+-- urls of crawl runs with their outcome, a run interrupted by a restart resumes with the pending ones, see checkpoint.py
+CREATE TABLE IF NOT EXISTS crawl_run_frontier (
+    run_id INT NOT NULL REFERENCES crawl_runs(id) ON DELETE CASCADE,
+    url TEXT NOT NULL,
+    position INT NOT NULL,
+    -- pending, or the outcome: new, updated, unchanged, not_modified or failed
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    finished_at TIMESTAMP,
+    PRIMARY KEY (run_id, url)
+);
+
+CREATE INDEX IF NOT EXISTS idx_crawl_run_frontier_pending ON crawl_run_frontier (run_id, position)
+    WHERE status = 'pending';
+
+-- times the run was resumed after its crawler stopped
+ALTER TABLE crawl_runs ADD COLUMN IF NOT EXISTS resumed INT NOT NULL DEFAULT 0;
+
+-- runs the scheduler leader checks for resuming
+CREATE INDEX IF NOT EXISTS idx_crawl_runs_unfinished ON crawl_runs (id) WHERE status IN ('running', 'interrupted');
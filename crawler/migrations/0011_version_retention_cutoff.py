@@ -0,0 +1,47 @@
+""" record how far back version history is complete
+
+    retention moves whole partitions out of articles_versions and stores in crawler_config.version_retention_cutoff
+    the latest superseded_at it removed, so readers can tell which points in time have no history left. partitions
+    already in versions_archive set the initial cutoff, and the version_count of their articles is recounted.
+    partitions dropped earlier left nothing to recover it from.
+"""
+
+ARCHIVE_SCHEMA = 'versions_archive'
+
+
+def migrate(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('ALTER TABLE crawler_config ADD COLUMN IF NOT EXISTS version_retention_cutoff TIMESTAMP')
+
+        cursor.execute(
+            """
+            SELECT t.table_name, EXISTS (
+                SELECT 1 FROM information_schema.columns c
+                WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name
+                    AND c.column_name = 'superseded_at'
+            )
+            FROM information_schema.tables t
+            WHERE t.table_schema = %s
+            ORDER BY t.table_name
+            """,
+            (ARCHIVE_SCHEMA,)
+        )
+        for table, has_superseded_at in cursor.fetchall():
+            # archived before superseded_at existed, it was backfilled with crawled_at
+            column = 'superseded_at' if has_superseded_at else 'crawled_at'
+            cursor.execute(
+                f"""
+                UPDATE crawler_config
+                SET version_retention_cutoff = GREATEST(
+                    version_retention_cutoff, (SELECT MAX({column}) FROM {ARCHIVE_SCHEMA}.{table})
+                )
+                WHERE id = 1
+                """
+            )
+            cursor.execute(
+                f"""
+                UPDATE articles a
+                SET version_count = (SELECT COUNT(*) FROM articles_versions v WHERE v.article_id = a.id)
+                WHERE a.id IN (SELECT article_id FROM {ARCHIVE_SCHEMA}.{table})
+                """
+            )
@@ -0,0 +1,16 @@
+""" updated_at taken from a JSON-LD dateModified in UTC was stored as UTC wall time, convert it to german local time
+
+    such rows have updated_at equal to modified_at in UTC. after the conversion they don't, so re-running is safe.
+"""
+from migrate import backfill
+
+TRANSACTIONAL = False
+
+
+def migrate(conn):
+    backfill(
+        conn,
+        'articles',
+        "updated_at = modified_at AT TIME ZONE 'Europe/Berlin'",
+        "modified_at IS NOT NULL AND updated_at = modified_at AT TIME ZONE 'UTC'"
+    )
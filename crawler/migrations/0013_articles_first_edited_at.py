@@ -0,0 +1,50 @@
+""" when each article was first edited, so the edit rollups don't depend on versions that retention may remove
+
+    filled from the earliest superseded_at in articles_versions and in partitions already moved to versions_archive.
+"""
+from migrate import backfill
+
+TRANSACTIONAL = False
+
+ARCHIVE_SCHEMA = 'versions_archive'
+
+
+def migrate(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('ALTER TABLE articles ADD COLUMN IF NOT EXISTS first_edited_at TIMESTAMP')
+
+    backfill(
+        conn,
+        'articles',
+        'first_edited_at = (SELECT MIN(superseded_at) FROM articles_versions v WHERE v.article_id = articles.id)',
+        'first_edited_at IS NULL AND version_count > 0'
+    )
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT t.table_name, EXISTS (
+                SELECT 1 FROM information_schema.columns c
+                WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name
+                    AND c.column_name = 'superseded_at'
+            )
+            FROM information_schema.tables t
+            WHERE t.table_schema = %s
+            ORDER BY t.table_name
+            """,
+            (ARCHIVE_SCHEMA,)
+        )
+        for table, has_superseded_at in cursor.fetchall():
+            column = 'superseded_at' if has_superseded_at else 'crawled_at'
+            cursor.execute(
+                f"""
+                UPDATE articles a
+                SET first_edited_at = LEAST(a.first_edited_at, archived.first_edited_at)
+                FROM (
+                    SELECT article_id, MIN({column}) AS first_edited_at
+                    FROM {ARCHIVE_SCHEMA}.{table}
+                    GROUP BY article_id
+                ) archived
+                WHERE a.id = archived.article_id
+                """
+            )
@@ -0,0 +1,27 @@
+-- put each article's version times back in order
+-- versions were stamped with NOW(), the start of their transaction. when two batches wrote the same article, the one
+-- that started first could commit second, so its version got a superseded_at before the crawled_at it was copied from
+-- and before the superseded_at of the version it replaced. versions are inserted under the article's row lock, so
+-- id order is the order they were replaced in. superseded_at becomes the running maximum in that order and crawled_at
+-- is raised to the superseded_at of the version before it, which keeps every version's crawled_at between the two
+-- and lets point in time queries bound the partitions they read. in order rows are left alone.
+WITH ordered AS (
+    SELECT id, crawled_at,
+        MAX(GREATEST(superseded_at, crawled_at)) OVER history AS superseded_at,
+        MAX(GREATEST(superseded_at, crawled_at)) OVER (
+            history ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+        ) AS previous_superseded_at
+    FROM articles_versions
+    WINDOW history AS (PARTITION BY article_id ORDER BY id)
+)
+UPDATE articles_versions v
+SET crawled_at = GREATEST(v.crawled_at, ordered.previous_superseded_at), superseded_at = ordered.superseded_at
+FROM ordered
+WHERE v.id = ordered.id AND v.crawled_at = ordered.crawled_at
+    AND (v.superseded_at <> ordered.superseded_at OR v.crawled_at < ordered.previous_superseded_at);
+
+-- the current version was crawled no earlier than the last one was replaced
+UPDATE articles a
+SET last_crawled_at = latest.superseded_at
+FROM (SELECT article_id, MAX(superseded_at) AS superseded_at FROM articles_versions GROUP BY article_id) latest
+WHERE a.id = latest.article_id AND a.last_crawled_at < latest.superseded_at;
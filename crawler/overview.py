@@ -0,0 +1,188 @@
+""" teasers of the overview page and the diff against the previous crawl
+
+    the overview is parsed as it downloads with a streaming HTMLParser that only keeps the teaser anchor it is in,
+    so memory doesn't grow with the page. every teaser's link, headline and topline are fingerprinted and compared
+    with overview_teasers: an incremental crawl only fetches links that are new, whose teaser text changed, or that
+    weren't checked for OVERVIEW_RECHECK_HOURS, because an article can change without its teaser changing.
+"""
+import codecs
+import hashlib
+import logging
+import os
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from psycopg2.extras import execute_values
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# full: every teaser link is crawled, incremental: only new or changed teasers. incremental is the default since
+# overview_teasers was added, before that every run crawled every link
+OVERVIEW_MODE = os.environ.get('OVERVIEW_MODE', 'incremental')
+OVERVIEW_MODES = ('full', 'incremental')
+# links of unchanged teasers are crawled again after this many hours
+OVERVIEW_RECHECK_HOURS = float(os.environ.get('OVERVIEW_RECHECK_HOURS', '6'))
+# teasers not on the overview for this many days are forgotten
+OVERVIEW_TEASER_RETENTION_DAYS = int(os.environ.get('OVERVIEW_TEASER_RETENTION_DAYS', '30'))
+
+TEASER_LINK_CLASS = 'teaser__link'
+TEASER_TEXT_CLASSES = {'teaser__headline': 'headline', 'teaser__topline': 'topline'}
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr',
+}
+
+
+class Teaser:
+    def __init__(self, url):
+        self.url = url
+        self.texts = set()
+
+    @property
+    def fingerprint(self):
+        """ stable over the order and number of teasers linking to the same url """
+        text = '\n'.join(f'{topline}\t{headline}' for topline, headline in sorted(self.texts))
+        return hashlib.sha1(f'{self.url}\n{text}'.encode('utf-8')).hexdigest()
+
+    @property
+    def headline(self):
+        return min(self.texts)[1] if self.texts else ''
+
+    @property
+    def topline(self):
+        return min(self.texts)[0] if self.texts else ''
+
+
+class TeaserParser(HTMLParser):
+    """ collects teaser links with their headline and topline text, fed chunk by chunk """
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.teasers = {}
+        # inside a teaser anchor: its url, the open elements in it and the text per field
+        self.url = None
+        self.open_elements = []
+        self.text = {}
+
+    def handle_starttag(self, tag, attrs):
+        classes = set()
+        href = None
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes.update(value.split())
+            elif name == 'href':
+                href = value
+
+        if self.url is None:
+            if tag == 'a' and TEASER_LINK_CLASS in classes and href:
+                self.url = urljoin(self.base_url, href)
+                self.open_elements = []
+                self.text = {field: [] for field in TEASER_TEXT_CLASSES.values()}
+            return
+
+        if tag in VOID_ELEMENTS:
+            return
+        field = next((TEASER_TEXT_CLASSES[name] for name in classes if name in TEASER_TEXT_CLASSES), None)
+        inherited = self.open_elements[-1][1] if self.open_elements else None
+        self.open_elements.append((tag, field or inherited))
+
+    def handle_endtag(self, tag):
+        if self.url is None:
+            return
+        if tag == 'a' and not any(name == 'a' for name, _ in self.open_elements):
+            self.finish_teaser()
+            return
+        # close up to the matching element, tolerating unclosed ones in between
+        for index in range(len(self.open_elements) - 1, -1, -1):
+            if self.open_elements[index][0] == tag:
+                del self.open_elements[index:]
+                break
+
+    def handle_data(self, data):
+        if self.url is not None and self.open_elements and self.open_elements[-1][1]:
+            self.text[self.open_elements[-1][1]].append(data)
+
+    def finish_teaser(self):
+        headline, topline = (' '.join(''.join(self.text[field]).split()) for field in ('headline', 'topline'))
+        self.teasers.setdefault(self.url, Teaser(self.url)).texts.add((topline, headline))
+        self.url = None
+
+
+def stream_teasers(response, base_url, run, chunk_size=16 * 1024):
+    """ teasers of a streamed overview response by url, counts the downloaded bytes on the run """
+    parser = TeaserParser(base_url)
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    received = 0
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            received += len(chunk)
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+    finally:
+        response.close()
+    run.count('bytes_fetched', received)
+    return parser.teasers
+
+
+def select_changed(teasers):
+    """ urls of the teasers that are new, changed or due for a recheck, in overview order """
+    if not teasers:
+        return []
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT seen.url
+                FROM overview_teasers seen
+                JOIN unnest(%s::TEXT[], %s::TEXT[]) AS current (url, fingerprint)
+                    ON current.url = seen.url AND current.fingerprint = seen.fingerprint
+                WHERE seen.checked_at >= NOW() - make_interval(secs => %s)
+                """,
+                (
+                    list(teasers),
+                    [teaser.fingerprint for teaser in teasers.values()],
+                    OVERVIEW_RECHECK_HOURS * 3600,
+                )
+            )
+            unchanged = {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+    return [url for url in teasers if url not in unchanged]
+
+
+def save_teasers(teasers, checked_urls):
+    """ remember the teasers seen on this run, checked_urls were crawled without failing """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            checked = [teasers[url] for url in checked_urls if url in teasers]
+            if checked:
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO overview_teasers (url, fingerprint, headline, topline)
+                    VALUES %s
+                    ON CONFLICT (url) DO UPDATE
+                    SET fingerprint = EXCLUDED.fingerprint, headline = EXCLUDED.headline,
+                        topline = EXCLUDED.topline, checked_at = NOW(), last_seen_at = NOW()
+                    """,
+                    [(teaser.url, teaser.fingerprint, teaser.headline, teaser.topline) for teaser in checked]
+                )
+
+            cursor.execute(
+                'UPDATE overview_teasers SET last_seen_at = NOW() WHERE url = ANY(%s)',
+                (list(set(teasers) - set(checked_urls)),)
+            )
+            cursor.execute(
+                'DELETE FROM overview_teasers WHERE last_seen_at < NOW() - make_interval(days => %s)',
+                (OVERVIEW_TEASER_RETENTION_DAYS,)
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        # the next run crawls these teasers again, nothing is lost
+        logger.error(f'Error saving overview teasers: {e}')
+    finally:
+        conn.close()
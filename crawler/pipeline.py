@@ -0,0 +1,285 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# fetcher threads, network bound
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '8'))
+# parser processes, cpu bound. 0 parses in the fetcher threads
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(os.cpu_count() or 1)))
+# fetched pages waiting for or being parsed, fetchers block when it is full
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '32'))
+# parsed articles written per transaction
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', '20'))
+# longest time a parsed article waits for its batch to fill up
+WRITE_BATCH_TIMEOUT = 0.5
+
+_STOP = object()
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """ process wide parser pool, spawned rather than forked since the server process is multi-threaded """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+
+def reset_parse_pool(pool):
+    """ drop a broken parser pool, the next submit starts a new one. a pool another thread already replaced is left
+        alone, so the pages submitted to its replacement aren't cancelled
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def preload(name):
+    """ import a module in a parser process, returns nothing since modules can't be pickled back """
+    importlib.import_module(name)
+
+
+def warm_parse_pool(*modules):
+    """ start the parser processes and import the modules the first parse needs, so the first crawl doesn't wait """
+    if PARSE_WORKERS <= 0:
+        return
+    pool = get_parse_pool()
+    futures = [pool.submit(preload, name) for _ in range(PARSE_WORKERS) for name in modules]
+    for future in futures:
+        future.result()
+
+
+def timed_call(func, item):
+    """ run func in the parser process and report how long it took """
+    started = time.perf_counter()
+    result = func(item)
+    return result, time.perf_counter() - started
+
+
+class StageMetrics:
+    """ items processed, busy time and wall time of one pipeline stage """
+
+    def __init__(self):
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.first_started = None
+        self.last_finished = None
+        self.max_queue = 0
+        self.lock = threading.Lock()
+
+    def record(self, started, finished, busy_seconds=None):
+        with self.lock:
+            self.items += 1
+            self.busy_seconds += finished - started if busy_seconds is None else busy_seconds
+            if self.first_started is None or started < self.first_started:
+                self.first_started = started
+            if self.last_finished is None or finished > self.last_finished:
+                self.last_finished = finished
+
+    def observe_queue(self, size):
+        with self.lock:
+            self.max_queue = max(self.max_queue, size)
+
+    def as_dict(self):
+        with self.lock:
+            wall_seconds = (self.last_finished - self.first_started) if self.items else 0.0
+            return {
+                'items': self.items,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'wall_seconds': round(wall_seconds, 3),
+                'items_per_second': round(self.items / wall_seconds, 2) if wall_seconds else None,
+                'max_queue': self.max_queue,
+            }
+
+
+class CrawlPipeline:
+    """ fetch -> parse -> store with bounded queues between the stages
+
+        fetch(url) runs in fetcher threads and returns an item to parse, or None if the url is not modified.
+        parse(item) runs in the parser process pool, so it must be a picklable module level function.
+        store(batch) runs in the single writer thread and returns one outcome per item: 'new', 'updated',
+        'unchanged' or 'failed'.
+        on_result(url, outcome, error), if given, is called once per url from the pipeline threads, with outcome
+        'not_modified' or 'failed' for urls that didn't reach the writer.
+        once stop_event is set no more urls are fetched, the ones in flight are parsed and stored and urls that were
+        not started get no result.
+    """
+
+    def __init__(self, run, fetch, parse, store, on_result=None, fetch_workers=FETCH_WORKERS,
+                 parse_workers=PARSE_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE,
+                 stop_event=None):
+        self.run = run
+        self.fetch = fetch
+        self.parse = parse
+        self.store = store
+        self.on_result = on_result
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.batch_size = batch_size
+        self.stop_event = stop_event
+
+        # futures of pages being parsed, bounded so fetchers can't run ahead of the parsers
+        self.parse_queue = queue.Queue(maxsize=queue_size)
+        # parsed articles waiting for the writer, bounded so parsers can't run ahead of the db
+        self.write_queue = queue.Queue(maxsize=queue_size)
+
+        self.metrics = {stage: StageMetrics() for stage in ('fetch', 'parse', 'store')}
+        self.new_versions = 0
+
+    def report(self, url, outcome, error=None):
+        if self.on_result is not None:
+            try:
+                self.on_result(url, outcome, error)
+            except Exception as e:
+                logger.error(f'Error reporting result for {url}: {e}')
+
+    def process(self, urls):
+        """ run all urls through the pipeline, returns the number of new versions """
+        started = time.perf_counter()
+        collector = threading.Thread(target=self._collect, daemon=True)
+        writer = threading.Thread(target=self._write, daemon=True)
+        collector.start()
+        writer.start()
+
+        try:
+            with ThreadPoolExecutor(self.fetch_workers, thread_name_prefix='fetch') as fetchers:
+                for future in [fetchers.submit(self._fetch_and_submit, url) for url in urls]:
+                    future.result()
+        finally:
+            self.parse_queue.put(_STOP)
+            collector.join()
+            writer.join()
+
+        elapsed = time.perf_counter() - started
+        self.run.stage_metrics = {stage: metrics.as_dict() for stage, metrics in self.metrics.items()}
+        logger.info(f'Pipeline processed {len(urls)} urls in {elapsed:.2f}s: {self.run.stage_metrics}')
+        return self.new_versions
+
+    def _fetch_and_submit(self, url):
+        if self.stop_event is not None and self.stop_event.is_set():
+            return
+        fetch_started = time.perf_counter()
+        try:
+            item = self.fetch(url)
+        except Exception as e:
+            logger.error(f'Error fetching {url}: {e}')
+            self.run.count('failed')
+            self.report(url, 'failed', str(e))
+            return
+        self.metrics['fetch'].record(fetch_started, time.perf_counter())
+        self.run.add_duration('fetch', time.perf_counter() - fetch_started)
+
+        if item is None:
+            self.report(url, 'not_modified')
+            return
+
+        submitted = time.perf_counter()
+        pool = None
+        if self.parse_workers > 0:
+            try:
+                pool, future = self._submit_parse(item)
+            except BrokenProcessPool as e:
+                logger.error(f'Parser pool died before parsing {url}: {e}')
+                self.run.count('failed')
+                self.report(url, 'failed', 'parser pool died')
+                return
+        else:
+            future = Future()
+            try:
+                future.set_result(timed_call(self.parse, item))
+            except Exception as e:
+                future.set_exception(e)
+
+        # blocks while the parsers are saturated
+        self.parse_queue.put((url, submitted, pool, future))
+        self.metrics['parse'].observe_queue(self.parse_queue.qsize())
+
+    def _submit_parse(self, item):
+        """ submit to the parser pool, a pool broken by a dead parser process is replaced and the submit retried """
+        pool = get_parse_pool()
+        try:
+            return pool, pool.submit(timed_call, self.parse, item)
+        except BrokenProcessPool as e:
+            logger.warning(f'Parser pool broken, starting a new one: {e}')
+            reset_parse_pool(pool)
+        pool = get_parse_pool()
+        return pool, pool.submit(timed_call, self.parse, item)
+
+    def _collect(self):
+        """ hand parse results to the writer in submission order """
+        while True:
+            entry = self.parse_queue.get()
+            if entry is _STOP:
+                self.write_queue.put(_STOP)
+                return
+
+            url, submitted, pool, future = entry
+            try:
+                article_data, parse_seconds = future.result()
+            except BrokenProcessPool as e:
+                logger.error(f'Parser pool died while parsing {url}: {e}')
+                reset_parse_pool(pool)
+                self.run.count('failed')
+                self.report(url, 'failed', 'parser pool died')
+                continue
+            except Exception as e:
+                logger.error(f'Error parsing {url}: {e}')
+                self.run.count('failed')
+                self.report(url, 'failed', str(e))
+                continue
+
+            self.metrics['parse'].record(submitted, time.perf_counter(), parse_seconds)
+            self.run.add_duration('parse', parse_seconds)
+            self.write_queue.put((url, article_data))
+            self.metrics['store'].observe_queue(self.write_queue.qsize())
+
+    def _write(self):
+        """ batch parsed articles into transactions """
+        batch = []
+        done = False
+        while not done:
+            try:
+                entry = self.write_queue.get(timeout=WRITE_BATCH_TIMEOUT if batch else None)
+            except queue.Empty:
+                # batch waited long enough
+                entry = None
+
+            if entry is _STOP:
+                done = True
+            elif entry is not None:
+                batch.append(entry)
+
+            if batch and (done or entry is None or len(batch) >= self.batch_size):
+                self._flush(batch)
+                batch = []
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            outcomes = self.store([article_data for _, article_data in batch])
+        except Exception as e:
+            logger.error(f'Error storing batch of {len(batch)} articles: {e}')
+            self.run.count('failed', len(batch))
+            outcomes = ['failed'] * len(batch)
+        finished = time.perf_counter()
+
+        self.new_versions += sum(1 for outcome in outcomes if outcome in ('new', 'updated'))
+        for (url, _), outcome in zip(batch, outcomes):
+            self.report(url, outcome)
+
+        self.run.add_duration('store', finished - started)
+        for _ in batch:
+            self.metrics['store'].record(started, finished, (finished - started) / len(batch))
@@ -0,0 +1,169 @@
+""" opt-in profiling of crawl runs
+
+    a profiled run samples the stacks of the threads it starts (fetchers, collector, writer) and the thread that
+    runs it every PROFILE_INTERVAL seconds and traces allocations with tracemalloc. the samples are wall clock, so
+    time waiting for the network or the database shows up next to cpu time. results are written to
+    PROFILE_DIR/run-<id>/:
+
+    cpu.folded               folded stacks ("thread;frame;frame count"), input for flamegraph.pl or speedscope
+    allocations.txt          largest allocation sites still alive at the end of the run, and the peak
+    allocations.tracemalloc  the full snapshot, tracemalloc.Snapshot.load() for offline analysis
+
+    only one run per process is profiled at a time, tracemalloc and the sampler are process wide.
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# profile every run, otherwise only runs started with profile enabled
+PROFILE_CRAWLS = os.environ.get('PROFILE_CRAWLS', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'crawler-profiles'))
+# seconds between stack samples
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.01'))
+# frames kept per allocation traceback
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', '10'))
+PROFILE_TOP_ALLOCATIONS = 50
+
+PROFILE_FILES = {
+    'cpu': ('cpu.folded', 'text/plain'),
+    'allocations': ('allocations.txt', 'text/plain'),
+    'snapshot': ('allocations.tracemalloc', 'application/octet-stream'),
+}
+
+_active_lock = threading.Lock()
+
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """ counts folded stacks of the sampled threads from a background thread """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.ignored = set()
+
+    def start(self):
+        # threads that already run belong to the server, not to this crawl
+        self.ignored = {thread.ident for thread in threading.enumerate()} - {threading.get_ident()}
+        self.thread = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _sample_loop(self):
+        self.ignored.add(threading.get_ident())
+        while not self.stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in self.ignored:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack = ';'.join([names.get(ident, str(ident)), *reversed(frames)])
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+def write_allocations(snapshot, peak, path):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        # the sampler's own stack counts
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    statistics = snapshot.statistics('traceback')
+    total = sum(stat.size for stat in statistics)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'peak traced memory: {peak / 1024:.1f} KiB, alive at end: {total / 1024:.1f} KiB\n\n')
+        for number, stat in enumerate(statistics[:PROFILE_TOP_ALLOCATIONS], 1):
+            f.write(f'#{number}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n')
+            for line in stat.traceback.format(most_recent_first=True):
+                f.write(f'{line}\n')
+            f.write('\n')
+
+
+def profile_path(run_id):
+    return os.path.join(PROFILE_DIR, f'run-{run_id}')
+
+
+@contextmanager
+def profile_run(run):
+    """ profile the block if the run asks for it and no other run is being profiled, sets run.profile_path """
+    if not run.profile or run.id is None:
+        yield
+        return
+    if not _active_lock.acquire(blocking=False):
+        logger.warning(f'Another run is being profiled, not profiling run {run.id}')
+        yield
+        return
+
+    sampler = StackSampler()
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            save_profile(run, sampler, snapshot, peak, time.perf_counter() - started)
+    finally:
+        _active_lock.release()
+
+
+def save_profile(run, sampler, snapshot, peak, seconds):
+    """ write the profile files, a failure here must not fail the crawl """
+    path = profile_path(run.id)
+    try:
+        os.makedirs(path, exist_ok=True)
+        sampler.write(os.path.join(path, PROFILE_FILES['cpu'][0]))
+        write_allocations(snapshot, peak, os.path.join(path, PROFILE_FILES['allocations'][0]))
+        snapshot.dump(os.path.join(path, PROFILE_FILES['snapshot'][0]))
+    except Exception as e:
+        logger.error(f'Could not save profile of run {run.id}: {e}')
+        return
+
+    run.profile_path = path
+    logger.info(f'Profiled run {run.id}: {sampler.samples} samples over {seconds:.1f}s in {path}')
+
+
+def profile_file(path, kind):
+    """ file name and mimetype of one profile output, None for unknown kinds or paths outside PROFILE_DIR """
+    if kind not in PROFILE_FILES or not path:
+        return None
+    filename, mimetype = PROFILE_FILES[kind]
+    full_path = os.path.realpath(os.path.join(path, filename))
+    if os.path.commonpath([full_path, os.path.realpath(PROFILE_DIR)]) != os.path.realpath(PROFILE_DIR):
+        return None
+    return full_path, mimetype
@@ -0,0 +1,91 @@
+""" re-run the article parser over the raw html archive, without any network traffic
+
+    python reparse.py [--all-captures] [--since 2024-01-01] [--workers 8] [--dry-run]
+"""
+import argparse
+import logging
+import os
+import time
+from multiprocessing import Pool
+from archive import ARCHIVE_DIR, HtmlArchive
+from crawler import parse_article_page, store_article
+from runs import CrawlRun
+
+logger = logging.getLogger(__name__)
+
+# per worker process, sqlite connections must not be shared across fork
+worker_archive = None
+
+
+def init_worker(archive_path):
+    global worker_archive
+    worker_archive = HtmlArchive(archive_path)
+
+
+def parse_capture(capture):
+    """ parse one archived capture, returns (url, article_data or None, parse seconds) """
+    url, sha256, encoding, _ = capture
+    started = time.perf_counter()
+    try:
+        html = worker_archive.read(sha256).decode(encoding or 'utf-8', errors='replace')
+        article_data = parse_article_page(url, html)
+    except Exception as e:
+        logger.error(f'Error re-parsing {url}: {e}')
+        article_data = None
+    return url, article_data, time.perf_counter() - started
+
+
+def reparse_archive(archive_path, latest_only=True, since=None, workers=None, dry_run=False):
+    """ parse archived captures on all cores and store the results as a 'reparse' crawl run """
+    archive = HtmlArchive(archive_path)
+    captures = archive.captures(latest_only=latest_only, since=since)
+    logger.info(f'Re-parsing {len(captures)} archived captures with {workers or os.cpu_count()} processes')
+
+    run = CrawlRun('reparse')
+    if not dry_run:
+        run.start()
+    run.count('links_found', len(captures))
+
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(archive_path,)) as pool:
+            for url, article_data, parse_seconds in pool.imap_unordered(parse_capture, captures, chunksize=16):
+                run.add_duration('parse', parse_seconds)
+                if article_data is None:
+                    run.count('failed')
+                elif not dry_run:
+                    with run.timed('store'):
+                        store_article(article_data, run)
+
+        run.finish('success')
+    except Exception as e:
+        logger.error(f'Error re-parsing archive: {e}')
+        run.finish('failed', error=str(e))
+        raise
+
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-parse the raw html archive')
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help='archive directory, defaults to ARCHIVE_DIR')
+    parser.add_argument('--all-captures', action='store_true', help='parse every capture, not just the newest per url')
+    parser.add_argument('--since', help='only captures fetched at or after this ISO date')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes, defaults to all cores')
+    parser.add_argument('--dry-run', action='store_true', help='parse only, do not write to the database')
+    args = parser.parse_args()
+
+    if not args.archive:
+        parser.error('no archive directory, set ARCHIVE_DIR or pass --archive')
+
+    run = reparse_archive(
+        args.archive,
+        latest_only=not args.all_captures,
+        since=args.since,
+        workers=args.workers,
+        dry_run=args.dry_run
+    )
+    logger.info(f'Re-parse finished: {run.as_dict()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+""" monthly partitions and retention for articles_versions
+
+    python retention.py   creates upcoming partitions and applies the retention policy once
+"""
+import logging
+import os
+import re
+from datetime import date
+from config import record_version_retention_cutoff
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_TABLE = 'articles_versions'
+VERSIONS_DEFAULT_PARTITION = 'articles_versions_default'
+PARTITION_NAME_RE = re.compile(r'^articles_versions_(\d{4})_(\d{2})$')
+
+# partitions created ahead of time so inserts never land in the default partition
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', '2'))
+# versions older than this many months are archived or dropped, 0 keeps everything
+VERSION_RETENTION_MONTHS = int(os.environ.get('VERSION_RETENTION_MONTHS', '0'))
+# archive: detach old partitions into the versions_archive schema, drop: delete them
+VERSION_RETENTION_MODE = os.environ.get('VERSION_RETENTION_MODE', 'archive')
+ARCHIVE_SCHEMA = 'versions_archive'
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{VERSIONS_TABLE}_{month.year:04d}_{month.month:02d}'
+
+
+def list_partitions(cursor):
+    """ first day of the month of every monthly partition """
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        """,
+        (VERSIONS_TABLE,)
+    )
+    months = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_partition(cursor, month):
+    """ create the partition for a month, moving matching rows out of the default partition """
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+
+    cursor.execute(f'CREATE TABLE {name} (LIKE {VERSIONS_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {VERSIONS_DEFAULT_PARTITION}
+            WHERE crawled_at >= %s AND crawled_at < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+        """,
+        (start, end)
+    )
+    moved = cursor.rowcount
+    cursor.execute(
+        f'ALTER TABLE {VERSIONS_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)',
+        (start, end)
+    )
+    logger.info(f'Created partition {name}' + (f', moved {moved} rows from default partition' if moved else ''))
+
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """ partitions for the current and upcoming months and for any month stuck in the default partition """
+    with conn.cursor() as cursor:
+        existing = set(list_partitions(cursor))
+
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', crawled_at)::date FROM {VERSIONS_DEFAULT_PARTITION}"
+        )
+        wanted = {row[0] for row in cursor.fetchall()}
+        this_month = date.today().replace(day=1)
+        wanted.update(add_months(this_month, offset) for offset in range(months_ahead + 1))
+
+        created = 0
+        for month in sorted(wanted - existing):
+            create_partition(cursor, month)
+            conn.commit()
+            created += 1
+        return created
+
+
+def expire_partition(cursor, name, mode):
+    """ detach a partition and archive or drop it, keeping version_count and the retention cutoff in step """
+    cursor.execute(f'ALTER TABLE {VERSIONS_TABLE} DETACH PARTITION {name}')
+
+    cursor.execute(
+        f"""
+        UPDATE articles a
+        SET version_count = GREATEST(a.version_count - expired.versions, 0)
+        FROM (SELECT article_id, COUNT(*) AS versions FROM {name} GROUP BY article_id) expired
+        WHERE a.id = expired.article_id
+        """
+    )
+    cursor.execute(f'SELECT MAX(superseded_at) FROM {name}')
+    record_version_retention_cutoff(cursor, cursor.fetchone()[0])
+
+    if mode == 'drop':
+        cursor.execute(f'DROP TABLE {name}')
+        logger.info(f'Dropped expired partition {name}')
+        return
+
+    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+    cursor.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (ARCHIVE_SCHEMA, name)
+    )
+    archived_columns = [row[0] for row in cursor.fetchall()]
+    if not archived_columns:
+        cursor.execute(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}')
+        logger.info(f'Archived expired partition {name} to schema {ARCHIVE_SCHEMA}')
+        return
+
+    # the month was archived before and recreated by a late version, add its rows to the archived table. tables
+    # archived before a column was added don't have it
+    columns = ', '.join(archived_columns)
+    cursor.execute(f'INSERT INTO {ARCHIVE_SCHEMA}.{name} ({columns}) SELECT {columns} FROM {name}')
+    merged = cursor.rowcount
+    cursor.execute(f'DROP TABLE {name}')
+    logger.info(f'Merged {merged} rows of expired partition {name} into {ARCHIVE_SCHEMA}.{name}')
+
+
+def apply_retention(conn, retention_months=VERSION_RETENTION_MONTHS, mode=VERSION_RETENTION_MODE):
+    """ archive or drop partitions entirely older than the retention period """
+    if retention_months <= 0:
+        return 0
+
+    cutoff = add_months(date.today().replace(day=1), -retention_months)
+    with conn.cursor() as cursor:
+        expired = [month for month in list_partitions(cursor) if add_months(month, 1) <= cutoff]
+
+        for month in expired:
+            expire_partition(cursor, partition_name(month), mode)
+            conn.commit()
+        return len(expired)
+
+
+def run_maintenance():
+    """ create upcoming partitions and apply retention """
+    conn = get_db_connection()
+    try:
+        created = ensure_partitions(conn)
+        expired = apply_retention(conn)
+        return {'partitions_created': created, 'partitions_expired': expired}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    logger.info(f'Maintenance finished: {run_maintenance()}')
@@ -0,0 +1,64 @@
+""" edit rollups behind the explorer analytics endpoints
+
+    every store transaction counts its new articles, edits and first edits and adds them to edit_rollup_hourly and
+    article_edits_daily before it commits, so dashboards read one row per bucket instead of scanning
+    articles_versions. buckets are NOW() of the transaction, the same time the versions get as superseded_at.
+"""
+import logging
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+
+class EditRollup:
+    """ counts of one store transaction """
+
+    def __init__(self):
+        self.new_articles = 0
+        self.edits = {}
+        self.first_edits = 0
+        self.first_edit_seconds = 0.0
+
+    def add_new(self):
+        self.new_articles += 1
+
+    def add_edit(self, article_id, first_edit_seconds=None):
+        """ a new version of the article, first_edit_seconds since its first crawl if it is the first one """
+        self.edits[article_id] = self.edits.get(article_id, 0) + 1
+        if first_edit_seconds is not None:
+            self.first_edits += 1
+            self.first_edit_seconds += max(first_edit_seconds, 0)
+
+    def flush(self, cursor):
+        """ add the counts to the rollup tables in the caller's transaction, a failure leaves the articles stored """
+        if not self.new_articles and not self.edits:
+            return
+        cursor.execute('SAVEPOINT edit_rollup')
+        try:
+            cursor.execute(
+                """
+                INSERT INTO edit_rollup_hourly (bucket, new_articles, edits, first_edits, first_edit_seconds)
+                VALUES (date_trunc('hour', NOW()), %s, %s, %s, %s)
+                ON CONFLICT (bucket) DO UPDATE
+                SET new_articles = edit_rollup_hourly.new_articles + EXCLUDED.new_articles,
+                    edits = edit_rollup_hourly.edits + EXCLUDED.edits,
+                    first_edits = edit_rollup_hourly.first_edits + EXCLUDED.first_edits,
+                    first_edit_seconds = edit_rollup_hourly.first_edit_seconds + EXCLUDED.first_edit_seconds
+                """,
+                (self.new_articles, sum(self.edits.values()), self.first_edits, self.first_edit_seconds)
+            )
+            if self.edits:
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO article_edits_daily (day, article_id, edits)
+                    VALUES %s
+                    ON CONFLICT (day, article_id) DO UPDATE SET edits = article_edits_daily.edits + EXCLUDED.edits
+                    """,
+                    sorted(self.edits.items()),
+                    template='(NOW()::DATE, %s, %s)'
+                )
+            cursor.execute('RELEASE SAVEPOINT edit_rollup')
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT edit_rollup')
+            logger.error(f'Error updating edit rollups: {e}')
@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2.extras import Json
+from db import get_db_connection
+from profiler import PROFILE_CRAWLS
+
+logger = logging.getLogger(__name__)
+
+RUN_COUNTERS = (
+    'links_found', 'fetched', 'not_modified', 'new_articles', 'updated_articles', 'unchanged', 'failed',
+    'bytes_fetched', 'links_skipped',
+)
+RUN_STAGES = ('fetch', 'parse', 'store')
+# statuses of runs that haven't finished, resumed by the scheduler leader once nobody holds their lock
+UNFINISHED_STATUSES = ('running', 'interrupted')
+
+# advisory lock class, the second key is the run id. a running run holds it on its own connection, so the lock is
+# released when the crawler process dies and another process can tell the run was abandoned
+CRAWL_RUN_LOCK_ID = 28001
+
+# runs of this process, interrupted on shutdown
+_active_runs = set()
+_active_runs_lock = threading.Lock()
+
+
+def interrupt_runs():
+    """ ask every run of this process to stop taking new urls, they checkpoint and finish as interrupted """
+    with _active_runs_lock:
+        runs = list(_active_runs)
+    for run in runs:
+        logger.info(f'Interrupting crawl run {run.id}')
+        run.stop_event.set()
+    return len(runs)
+
+
+class CrawlRun:
+    """ statistics of one crawl, persisted to crawl_runs once started """
+
+    def __init__(self, trigger, profile=None):
+        self.id = None
+        self.trigger = trigger
+        # sample a cpu profile and allocations while the run crawls, PROFILE_CRAWLS unless set per run
+        self.profile = PROFILE_CRAWLS if profile is None else profile
+        self.profile_path = None
+        self.status = None
+        self.counters = dict.fromkeys(RUN_COUNTERS, 0)
+        self.durations = dict.fromkeys(RUN_STAGES, 0.0)
+        # per stage throughput from the crawl pipeline
+        self.stage_metrics = None
+        self.lock = threading.Lock()
+        # set to stop the run at the next url, see interrupt_runs()
+        self.stop_event = threading.Event()
+        # holds the run's advisory lock while it runs
+        self.lock_conn = None
+
+    @property
+    def interrupted(self):
+        return self.stop_event.is_set()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def add_duration(self, stage, seconds):
+        with self.lock:
+            self.durations[stage] += seconds
+
+    @contextmanager
+    def timed(self, stage):
+        """ add the time spent in the block to a stage """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(stage, time.perf_counter() - started)
+
+    def start(self):
+        """ insert the run row, locked before it commits so it is never seen running without an owner """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO crawl_runs (trigger) VALUES (%s) RETURNING id',
+                    (self.trigger,)
+                )
+                self.id = cursor.fetchone()[0]
+                cursor.execute('SELECT pg_advisory_lock(%s, %s)', (CRAWL_RUN_LOCK_ID, self.id))
+                conn.commit()
+        except Exception:
+            conn.close()
+            raise
+
+        self._activate(conn)
+        logger.info(f'Started crawl run {self.id} ({self.trigger})')
+        return self.id
+
+    def _activate(self, lock_conn):
+        self.lock_conn = lock_conn
+        self.status = 'running'
+        with _active_runs_lock:
+            _active_runs.add(self)
+
+    def _release(self):
+        """ drop the run's lock by closing its connection """
+        with _active_runs_lock:
+            _active_runs.discard(self)
+        if self.lock_conn is not None:
+            try:
+                self.lock_conn.close()
+            except Exception:
+                pass
+            self.lock_conn = None
+
+    @classmethod
+    def claim(cls, run_id):
+        """ take over an unfinished run whose crawler stopped, None if it is still running or already finished
+
+            the counters and durations continue from the run's last checkpoint
+        """
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', (CRAWL_RUN_LOCK_ID, run_id))
+                if not cursor.fetchone()[0]:
+                    conn.close()
+                    return None
+
+                cursor.execute(
+                    f"""
+                    UPDATE crawl_runs SET status = 'running', resumed = resumed + 1
+                    WHERE id = %s AND status = ANY(%s)
+                    RETURNING trigger, {', '.join(RUN_COUNTERS)}, {', '.join(f'{stage}_seconds' for stage in RUN_STAGES)}
+                    """,
+                    (run_id, list(UNFINISHED_STATUSES))
+                )
+                row = cursor.fetchone()
+                conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if row is None:
+            conn.close()
+            return None
+
+        run = cls(row[0], profile=False)
+        run.id = run_id
+        run.counters.update(zip(RUN_COUNTERS, row[1:1 + len(RUN_COUNTERS)]))
+        run.durations.update(zip(RUN_STAGES, row[1 + len(RUN_COUNTERS):]))
+        run._activate(conn)
+        return run
+
+    def checkpoint(self, cursor):
+        """ save the counters and durations so far in the caller's transaction """
+        with self.lock:
+            counters = dict(self.counters)
+            durations = dict(self.durations)
+        cursor.execute(
+            f"""
+            UPDATE crawl_runs
+            SET {', '.join(f'{name} = %s' for name in RUN_COUNTERS)},
+                {', '.join(f'{stage}_seconds = %s' for stage in RUN_STAGES)}
+            WHERE id = %s
+            """,
+            (*(counters[name] for name in RUN_COUNTERS), *(durations[stage] for stage in RUN_STAGES), self.id)
+        )
+
+    def finish(self, status='success', error=None):
+        """ store final statistics and release the run's lock, status interrupted leaves it to be resumed """
+        self.status = status
+        if self.id is None:
+            return
+
+        with self.lock:
+            counters = dict(self.counters)
+            durations = dict(self.durations)
+
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    UPDATE crawl_runs
+                    SET status = %s, error = %s, finished_at = NOW(), stage_metrics = COALESCE(%s, stage_metrics),
+                        profile_path = COALESCE(%s, profile_path),
+                        {', '.join(f'{name} = %s' for name in RUN_COUNTERS)},
+                        {', '.join(f'{stage}_seconds = %s' for stage in RUN_STAGES)}
+                    WHERE id = %s
+                    """,
+                    (
+                        status,
+                        error,
+                        Json(self.stage_metrics) if self.stage_metrics else None,
+                        self.profile_path,
+                        *(counters[name] for name in RUN_COUNTERS),
+                        *(durations[stage] for stage in RUN_STAGES),
+                        self.id
+                    )
+                )
+                if status != 'interrupted':
+                    cursor.execute('DELETE FROM crawl_run_frontier WHERE run_id = %s', (self.id,))
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f'Error saving crawl run {self.id}: {e}')
+        finally:
+            conn.close()
+            self._release()
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'trigger': self.trigger,
+                'status': self.status,
+                **self.counters,
+                **{f'{stage}_seconds': round(seconds, 3) for stage, seconds in self.durations.items()},
+                'stage_metrics': self.stage_metrics,
+                'profile_path': self.profile_path,
+            }
+
+
+def unfinished_run_ids():
+    """ runs left running or interrupted, oldest first """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM crawl_runs WHERE status = ANY(%s) ORDER BY id',
+                (list(UNFINISHED_STATUSES),)
+            )
+            return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def get_profile_path(run_id):
+    """ profile directory of a run, None if the run was not profiled, KeyError if there is no such run """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT profile_path FROM crawl_runs WHERE id = %s', (run_id,))
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise KeyError(run_id)
+    return row[0]
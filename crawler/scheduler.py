@@ -1,9 +1,12 @@
 import logging
+import os
 import threading
-import time
-from crawler import get_db_connection, crawl_overview_page
+from config import config_store
+from crawler import crawl_overview_page, resume_interrupted_runs
+from db import get_db_connection
+from retention import run_maintenance
+from runs import CrawlRun, interrupt_runs
 from datetime import datetime, timedelta
-from psycopg2.extras import DictCursor
 
 # logging
 logging.basicConfig(
@@ -12,22 +15,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# session level advisory lock, whoever holds it runs scheduled crawls. with several gunicorn workers or crawler
+# containers exactly one of them is the leader, the others take over when its connection goes away
+SCHEDULER_LOCK_ID = 27001
+
+# longest sleep between checks. config is cached and changes wake the loop up, so this only bounds how quickly a
+# follower notices that the leader went away
+SCHEDULER_INTERVAL_SECONDS = 1200
+# retry delay while the first check can't reach the database
+SCHEDULER_STARTUP_RETRY_SECONDS = 5
+
+# how long stop() waits for the scheduler thread to finish, the crawl it runs stops fetching and stores what is in
+# flight first
+SCHEDULER_STOP_TIMEOUT = int(os.environ.get('SCHEDULER_STOP_TIMEOUT', '20'))
+
+# partition maintenance and version retention, run by the leader
+MAINTENANCE_INTERVAL = timedelta(hours=24)
+# the leader looks for interrupted crawl runs when it takes over and then this often, a crawler worker that stops
+# while another one leads leaves its runs for the next check
+RESUME_INTERVAL = timedelta(seconds=SCHEDULER_INTERVAL_SECONDS)
+
 
 class CrawlerScheduler:
-    def __init__(self):
+    def __init__(self, config_store=config_store):
+        self.config_store = config_store
         self.thread = None
-        self.should_stop = False
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.reschedule = False
+        self.leader_conn = None
+        self.last_maintenance = None
+        self.last_resume_check = None
+        # set once the thread has loaded the config and checked for leadership, see /ready
+        self.ready_event = threading.Event()
+        self.config_store.subscribe(self._on_config_change)
+
+    def acquire_leadership(self):
+        """ try to become the process running scheduled crawls, returns True if this process is the leader """
+        if self.leader_conn is not None:
+            try:
+                with self.leader_conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                return True
+            except Exception as e:
+                logger.warning(f'Lost scheduler leadership: {e}')
+                self.release_leadership()
 
-    def get_crawler_config(self):
-        """ get crawler config from db """
         conn = get_db_connection()
-        try:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute('SELECT * FROM crawler_config WHERE id=1')
-                config = dict(zip([desc[0] for desc in cursor.description], cursor.fetchone()))
-                return config
-        finally:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', (SCHEDULER_LOCK_ID,))
+            is_leader = cursor.fetchone()[0]
+
+        if not is_leader:
             conn.close()
+            return False
+
+        self.leader_conn = conn
+        # a new leader resumes the runs its predecessor left behind right away
+        self.last_resume_check = None
+        logger.info(f'Process {os.getpid()} is the scheduler leader')
+        return True
+
+    def release_leadership(self):
+        """ release the leader lock by closing its connection """
+        if self.leader_conn is not None:
+            try:
+                self.leader_conn.close()
+            except Exception:
+                pass
+            self.leader_conn = None
+
+    def get_crawler_config(self):
+        """ get crawler config from cache """
+        return self.config_store.get()
 
     def update_next_run(self):
         """ update next tun time based on current config """
@@ -40,88 +101,122 @@ class CrawlerScheduler:
         interval_hours = config['schedule_interval_hours']
         next_run = datetime.now() + timedelta(hours=interval_hours)
 
-        conn = get_db_connection()
         try:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute('UPDATE crawler_config SET next_run = %s WHERE id = 1', (next_run,))
-                conn.commit()
-                logger.info(f'Next crawler run at {next_run}')
+            self.config_store.update(next_run=next_run)
+            logger.info(f'Next crawler run at {next_run}')
             return True
         except Exception as e:
             logger.error(f'Error updating next_run: {e}')
             return False
-        finally:
-            conn.close()
+
+    def _on_config_change(self, old_config, new_config):
+        """ recalculate next_run when interval or enabled changed, wake the loop for any change """
+        if old_config is not None and (
+                old_config['schedule_interval_hours'] != new_config['schedule_interval_hours'] or
+                old_config['is_enabled'] != new_config['is_enabled']):
+            self.reschedule = True
+        self.wake_event.set()
+
+    def run_maintenance_if_due(self):
+        """ create upcoming versions partitions and apply retention, once per MAINTENANCE_INTERVAL """
+        if self.last_maintenance is not None and datetime.now() - self.last_maintenance < MAINTENANCE_INTERVAL:
+            return
+
+        self.last_maintenance = datetime.now()
+        try:
+            logger.info(f'Partition maintenance finished: {run_maintenance()}')
+        except Exception as e:
+            logger.error(f'Error in partition maintenance: {e}')
+
+    def resume_runs_if_due(self):
+        """ resume runs of a crawler that stopped or crashed mid-run, once per RESUME_INTERVAL """
+        if self.last_resume_check is not None and datetime.now() - self.last_resume_check < RESUME_INTERVAL:
+            return
+
+        self.last_resume_check = datetime.now()
+        resumed = resume_interrupted_runs(self.stop_event)
+        if resumed:
+            logger.info(f'Resumed {resumed} interrupted crawl runs')
+
+    def seconds_until_next_check(self):
+        """ sleep until next_run is due, bounded by SCHEDULER_INTERVAL_SECONDS """
+        config = self.get_crawler_config()
+        if self.leader_conn is None or not config['is_enabled'] or config['next_run'] is None:
+            return SCHEDULER_INTERVAL_SECONDS
+
+        remaining = (config['next_run'] - datetime.now()).total_seconds()
+        return min(SCHEDULER_INTERVAL_SECONDS, max(1, remaining + 1))
 
     def _scheduler_loop(self):
-        """ main schedule loop """
+        """ main schedule loop, its first check runs here rather than in start() so a slow db doesn't block startup """
         logger.info('Scheduler thread started')
 
-        while not self.should_stop:
+        while not self.stop_event.is_set():
             try:
-                config = self.get_crawler_config()
-
-                if config['is_enabled']:
-                    current_time = datetime.now()
-                    next_run = config['next_run']
+                is_leader = self.acquire_leadership()
+                if not self.ready_event.is_set():
+                    # the leader of a fresh start schedules the next crawl one interval from now
+                    if is_leader:
+                        self.update_next_run()
+                    self.get_crawler_config()
+                    self.ready_event.set()
 
-                    if next_run is None or current_time > next_run:
-                        logger.info('Running scheduled crawl')
-                        crawl_overview_page()
+                if is_leader:
+                    if self.reschedule:
+                        self.reschedule = False
                         self.update_next_run()
 
-                # sleep interval set to 20 minutes to balance database load, lower resource usage while still being responsive to schedule chnages
-                time.sleep(1200)
+                    self.run_maintenance_if_due()
+
+                    # before anything new is started
+                    self.resume_runs_if_due()
 
+                    config = self.get_crawler_config()
+
+                    if config['is_enabled'] and not self.stop_event.is_set():
+                        current_time = datetime.now()
+                        next_run = config['next_run']
+
+                        if next_run is None or current_time > next_run:
+                            logger.info('Running scheduled crawl')
+                            crawl_overview_page(CrawlRun('scheduled'))
+                            self.update_next_run()
+
+                sleep_seconds = self.seconds_until_next_check()
             except Exception as e:
                 logger.error(f'Error in main loop: {e}')
-                time.sleep(1200)
+                if self.ready_event.is_set():
+                    sleep_seconds = SCHEDULER_INTERVAL_SECONDS
+                else:
+                    sleep_seconds = SCHEDULER_STARTUP_RETRY_SECONDS
 
+            self.wake_event.wait(sleep_seconds)
+            self.wake_event.clear()
+
+        self.release_leadership()
         logger.info('Scheduler thread stopped')
 
     def start(self):
-        """ start scheduler thread """
+        """ start scheduler thread, returns right away. ready_event is set once its first check is done """
         if self.thread is None or not self.thread.is_alive():
-            self.should_stop = False
-            self.thread = threading.Thread(target=self._scheduler_loop, daemon=True)
+            self.stop_event.clear()
+            self.config_store.start()
+            self.thread = threading.Thread(target=self._scheduler_loop, name='scheduler', daemon=True)
             self.thread.start()
             logger.info('Scheduler started')
 
-            # run crawl and update next run time
-            self.update_next_run()
-
     def stop(self):
-        """ stop scheduler thread """
-        if self.thread and self.thread.is_alive():
-            self.should_stop = True
-            logger.info('Scheduler stopped')
+        """ stop scheduler thread and wait for it to exit
 
-    def update_schedule(self, hours=None, enabled=None):
-        """ update schedule configuration """
-        conn = get_db_connection()
-        try:
-            with conn.cursor(cursor_factory=DictCursor) as cursor:
-                if hours is not None:
-                    cursor.execute(
-                        'UPDATE crawler_config SET schedule_interval_hours = %s WHERE id = 1',
-                        (hours, )
-                    )
-
-                if enabled is not None:
-                    cursor.execute(
-                        'UPDATE crawler_config SET schedule_enabled = %s WHERE id = 1',
-                        (enabled, )
-                    )
-
-                conn.commit()
-
-            if self.thread and self.thread.is_alive():
-                self.update_next_run()
-
-            return True
-        except Exception as e:
-            conn.rollback()
-            logger.error(f'Error updating schedule: {e}')
-            return False
-        finally:
-            conn.close()
+            stop is the shutdown path of the process, so every crawl run of the process is interrupted. they stop
+            taking new urls, store what is in flight and are resumed by the next leader with their pending urls
+        """
+        interrupted = interrupt_runs()
+        if self.thread and self.thread.is_alive():
+            self.stop_event.set()
+            self.wake_event.set()
+            self.thread.join(SCHEDULER_STOP_TIMEOUT)
+            if self.thread.is_alive():
+                logger.warning('Scheduler thread still busy, abandoning it, its run is resumed after the restart')
+            logger.info(f'Scheduler stopped, {interrupted} crawl runs interrupted')
+        self.config_store.stop()
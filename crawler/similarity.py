@@ -0,0 +1,185 @@
+""" near-duplicate detection with 64 bit simhash over word shingles
+
+    the hash is split into SIMHASH_BANDS bands of 16 bits, each stored in an indexed column. two hashes within
+    NEAR_DUPLICATE_DISTANCE < SIMHASH_BANDS differing bits must agree on at least one band, so candidates come from
+    equality lookups on the band indexes instead of comparing against every article. articles without content get
+    no hash, they would all share one and be linked to each other.
+
+    python similarity.py --rebuild   recomputes hashes and links for all articles
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+from psycopg2.extras import DictCursor, execute_values
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+SHINGLE_SIZE = 3
+NEAR_DUPLICATE_DISTANCE = min(int(os.environ.get('NEAR_DUPLICATE_DISTANCE', '3')), SIMHASH_BANDS - 1)
+
+# stored by the parser when a page has no article text
+PLACEHOLDER_CONTENT = 'No content found'
+
+WORD_RE = re.compile(r'\w+')
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """ overlapping word n-grams of the lower cased text """
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text):
+    """ unsigned 64 bit simhash """
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles(text):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def article_simhash(article_data):
+    """ simhash of headline and content, None for articles without content """
+    content = article_data['content'].strip()
+    if not content or content == PLACEHOLDER_CONTENT:
+        return None
+    return simhash(f'{article_data["headline"]}\n{content}')
+
+
+def to_signed(value):
+    """ unsigned 64 bit value as postgres BIGINT """
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << SIMHASH_BITS) if value < 0 else value
+
+
+def bands(value):
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [(value >> (band * SIMHASH_BAND_BITS)) & mask for band in range(SIMHASH_BANDS)]
+
+
+def hamming_distance(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def index_articles(cursor, hashes):
+    """ store the hashes of {article_id: hash} and link the articles to their near-duplicates, returns the links
+
+        rows are locked and written in article id order, so concurrent store transactions can't deadlock
+    """
+    if not hashes:
+        return 0
+    article_ids = sorted(hashes)
+
+    for article_id in article_ids:
+        hash_value = hashes[article_id]
+        article_bands = bands(hash_value) if hash_value is not None else [None] * SIMHASH_BANDS
+        cursor.execute(
+            f"""
+            UPDATE articles
+            SET simhash = %s, {', '.join(f'simhash_band{band} = %s' for band in range(SIMHASH_BANDS))}
+            WHERE id = %s
+            """,
+            (to_signed(hash_value) if hash_value is not None else None, *article_bands, article_id)
+        )
+
+    # links of the previous content are stale
+    cursor.execute(
+        """
+        SELECT 1 FROM article_similarities
+        WHERE article_id = ANY(%s) OR similar_article_id = ANY(%s)
+        ORDER BY article_id, similar_article_id
+        FOR UPDATE
+        """,
+        (article_ids, article_ids)
+    )
+    cursor.execute(
+        'DELETE FROM article_similarities WHERE article_id = ANY(%s) OR similar_article_id = ANY(%s)',
+        (article_ids, article_ids)
+    )
+
+    links = {}
+    for article_id in article_ids:
+        hash_value = hashes[article_id]
+        if hash_value is None:
+            continue
+        cursor.execute(
+            f"""
+            SELECT id, simhash FROM articles
+            WHERE id <> %s AND ({' OR '.join(f'simhash_band{band} = %s' for band in range(SIMHASH_BANDS))})
+            """,
+            (article_id, *bands(hash_value))
+        )
+        matches = [
+            (candidate_id, distance)
+            for candidate_id, candidate_hash in cursor.fetchall()
+            if (distance := hamming_distance(hash_value, candidate_hash)) <= NEAR_DUPLICATE_DISTANCE
+        ]
+        for similar_id, distance in matches:
+            links[(article_id, similar_id)] = distance
+            links[(similar_id, article_id)] = distance
+        if matches:
+            logger.info(f'Article {article_id} is a near-duplicate of {[similar_id for similar_id, _ in matches]}')
+
+    if links:
+        execute_values(
+            cursor,
+            """
+            INSERT INTO article_similarities (article_id, similar_article_id, distance)
+            VALUES %s
+            ON CONFLICT (article_id, similar_article_id) DO UPDATE SET distance = EXCLUDED.distance
+            """,
+            [(article_id, similar_id, distance) for (article_id, similar_id), distance in sorted(links.items())]
+        )
+    return len(links) // 2
+
+
+def rebuild_index(batch_size=500):
+    """ recompute hashes and links for all articles """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute('SELECT id FROM articles ORDER BY id')
+            article_ids = [row['id'] for row in cursor.fetchall()]
+
+            for start in range(0, len(article_ids), batch_size):
+                cursor.execute(
+                    'SELECT id, headline, content FROM articles WHERE id = ANY(%s)',
+                    (article_ids[start:start + batch_size],)
+                )
+                index_articles(cursor, {row['id']: article_simhash(row) for row in cursor.fetchall()})
+                conn.commit()
+                logger.info(f'Indexed {min(start + batch_size, len(article_ids))}/{len(article_ids)} articles')
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Near-duplicate index')
+    parser.add_argument('--rebuild', action='store_true', help='recompute hashes and links for all articles')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_index()
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
@@ -1,7 +1,18 @@
+import time
+
+# startup is measured from here, before flask and psycopg2 are imported
+STARTED_AT = time.monotonic()
+
 import os
+import json
+import base64
+import gzip
+import select
+import threading
 import logging
 import psycopg2
-from flask import Flask, request, jsonify
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, request, jsonify
 from psycopg2.extras import DictCursor
 
 # logging
@@ -17,8 +28,52 @@ DB_NAME = os.environ.get('DB_NAME', 'tagesschau')
 DB_USER = os.environ.get('DB_USER', 'user')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'password')
 
+# schema_migrations version this service needs. the crawler applies migrations (crawler/migrations) at startup.
+# it is the newest migration this service reads from, 0014_versions_in_order for the partition bounds of the point in
+# time queries. raise it only when the service starts using a newer migration
+SCHEMA_VERSION = 14
+SCHEMA_WAIT_SECONDS = int(os.environ.get('SCHEMA_WAIT_SECONDS', '120'))
+
+# change feed, crawler notifies this channel on every insert/content change
+CHANGE_FEED_CHANNEL = 'article_changes'
+CHANGE_FEED_MAX_LIMIT = 1000
+CHANGE_FEED_MAX_WAIT = 30
+CHANGE_FEED_KEEPALIVE = 15
+# long-poll and stream clients per worker process. each one holds a worker thread while it waits, so keep some
+# threads free for other requests
+CHANGE_FEED_MAX_SUBSCRIBERS = int(os.environ.get('CHANGE_FEED_MAX_SUBSCRIBERS', '4'))
+
+# article columns selectable with ?fields=a,b. fields=summary selects the compact summary projection
+ARTICLE_FIELDS = (
+    'id', 'url', 'headline', 'sub_headline', 'content', 'first_crawled_at', 'last_crawled_at', 'updated_at',
+    'word_count', 'version_count', 'published_at', 'modified_at', 'author', 'section', 'keywords',
+)
+ARTICLE_SUMMARY_FIELDS = (
+    'id', 'url', 'headline', 'first_crawled_at', 'last_crawled_at', 'updated_at', 'word_count', 'version_count',
+)
+ARTICLE_LIST_FIELDS = tuple(field for field in ARTICLE_FIELDS if field != 'content')
+SEARCH_FIELDS = ARTICLE_FIELDS + ('content_excerpt',)
+SEARCH_DEFAULT_FIELDS = (
+    'id', 'url', 'headline', 'sub_headline', 'content_excerpt', 'first_crawled_at', 'last_crawled_at', 'updated_at',
+)
+
+# analytics buckets: default range and the most buckets one request may return
+ANALYTICS_INTERVALS = {'hour': timedelta(days=1), 'day': timedelta(days=30)}
+ANALYTICS_MAX_BUCKETS = 2000
+ANALYTICS_MAX_DAYS = 365
+
+# gzip responses of at least this many bytes for clients that accept it, 0 disables compression
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+
 app = Flask(__name__)
 
+# set by the warm-up thread once the database schema is at SCHEMA_VERSION, api requests are refused until then
+schema_ready = threading.Event()
+startup_seconds = None
+
+logger.info(f'Explorer api imported in {time.monotonic() - STARTED_AT:.2f}s')
+
 
 def get_db_connection():
     """ connect to db """
@@ -36,6 +91,234 @@ def get_db_connection():
         raise
 
 
+def wait_for_schema():
+    """ wait until the crawler has migrated the database to SCHEMA_VERSION """
+    deadline = time.monotonic() + SCHEMA_WAIT_SECONDS
+    while True:
+        version = 0
+        try:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT MAX(version) FROM schema_migrations')
+                    version = cursor.fetchone()[0] or 0
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            logger.info(f'Schema version not available yet: {e}')
+
+        if version >= SCHEMA_VERSION:
+            return version
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'Database schema is at version {version}, this service needs {SCHEMA_VERSION}')
+        logger.info(f'Waiting for schema version {SCHEMA_VERSION}, database is at {version}')
+        time.sleep(2)
+
+
+def warm_up():
+    """ wait for the schema in the background, so the server listens and answers /health meanwhile """
+    global startup_seconds
+    while True:
+        try:
+            version = wait_for_schema()
+            break
+        except RuntimeError as e:
+            logger.error(f'{e}, still waiting')
+
+    startup_seconds = time.monotonic() - STARTED_AT
+    schema_ready.set()
+    logger.info(f'Explorer ready {startup_seconds:.2f}s after start, schema version {version}')
+
+
+def start():
+    """ start the warm-up thread, /ready reports when it is done """
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def parse_fields(allowed, default):
+    """ columns requested with ?fields=, raises ValueError for unknown ones. id is always included """
+    raw = request.args.get('fields', '').strip()
+    if not raw:
+        return default
+    if raw == 'summary':
+        return ARTICLE_SUMMARY_FIELDS
+
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    return tuple(dict.fromkeys(['id', *fields]))
+
+
+def article_filters():
+    """ WHERE conditions and params for the section, author, keyword and published date filters
+
+        raises ValueError for an invalid date
+    """
+    conditions, params = [], []
+    for column in ('section', 'author'):
+        value = request.args.get(column)
+        if value:
+            conditions.append(f'{column} = %s')
+            params.append(value)
+
+    keyword = request.args.get('keyword')
+    if keyword:
+        conditions.append('keywords @> ARRAY[%s]::TEXT[]')
+        params.append(keyword)
+
+    for param, operator in (('published_after', '>='), ('published_before', '<')):
+        value = request.args.get(param)
+        if value:
+            try:
+                params.append(datetime.fromisoformat(value))
+            except ValueError:
+                raise ValueError(f'invalid {param}, expected an ISO 8601 date')
+            conditions.append(f'published_at {operator} %s')
+
+    return conditions, params
+
+
+def parse_timestamp(param):
+    """ query parameter as a naive UTC timestamp like the ones in the database, None if it is missing
+
+        raises ValueError if it is invalid
+    """
+    value = request.args.get(param)
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'invalid {param}, expected an ISO 8601 timestamp')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def parse_as_of():
+    """ ?at= as a naive UTC timestamp, raises ValueError if missing or invalid """
+    at = parse_timestamp('at')
+    if at is None:
+        raise ValueError('missing at, expected an ISO 8601 timestamp')
+    return at
+
+
+def history_removed(history_from, at):
+    """ error response if retention removed versions that could have been current at at, None otherwise
+
+        history_from is the latest superseded_at retention removed, the version current at a later time is still there
+    """
+    if history_from is None or at >= history_from:
+        return None
+    return jsonify({
+        'status': 'error',
+        'message': f'history before {history_from.isoformat()} was removed by retention',
+        'history_from': history_from.isoformat(),
+    }), 410
+
+
+def as_of_query(include_content, where, suffix='', count=False):
+    """ state of articles matching where at a point in time: the first version replaced after it, or the current row
+        if none was
+
+        one statement with the retention cutoff as history_from and, with count, the number of matching articles as
+        total. it always returns a row, the article columns are NULL if nothing matched or the time is before the
+        cutoff. params are the time and those of where for count, then the time four times, then those of where and
+        suffix. a version was current from the superseded_at of the one before it until its own superseded_at, both
+        lookups are range scans on (article_id, superseded_at). crawled_at, the partition key, lies between those
+        two (see migrations/0014), so partitions that can't hold the version are pruned
+    """
+    content_column = 'v.content' if include_content else ''
+    kept = "%s >= COALESCE(config.history_from, '-infinity')"
+    total = f'(SELECT COUNT(*) FROM articles a WHERE {kept} AND {where}) AS total,' if count else ''
+    return f"""
+        WITH config AS (
+            SELECT (SELECT version_retention_cutoff FROM crawler_config WHERE id = 1) AS history_from
+        )
+        SELECT config.history_from, {total} found.*
+        FROM config
+        LEFT JOIN LATERAL (
+            SELECT
+                a.id, a.url,
+                COALESCE(v.headline, a.headline) AS headline,
+                COALESCE(v.sub_headline, a.sub_headline) AS sub_headline,
+                {f'COALESCE({content_column}, a.content) AS content,' if include_content else ''}
+                a.first_crawled_at,
+                COALESCE(previous.superseded_at, a.first_crawled_at) AS valid_from,
+                v.superseded_at AS valid_until,
+                v.id AS version_id,
+                v.id IS NULL AS is_current
+            FROM articles a
+            LEFT JOIN LATERAL (
+                SELECT MAX(superseded_at) AS superseded_at
+                FROM articles_versions
+                WHERE article_id = a.id AND superseded_at <= %s AND crawled_at <= %s
+            ) previous ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT id, headline, sub_headline, {'content, ' if include_content else ''}superseded_at
+                FROM articles_versions
+                WHERE article_id = a.id AND superseded_at > %s
+                    AND crawled_at >= COALESCE(previous.superseded_at, a.first_crawled_at)
+                ORDER BY superseded_at, id
+                LIMIT 1
+            ) v ON TRUE
+            WHERE {kept} AND {where}
+            {suffix}
+        ) found ON TRUE
+    """
+
+
+def serialize_as_of_row(row):
+    """ article of an as_of_query row, without the columns of the statement """
+    article = serialize_row(row)
+    article.pop('history_from')
+    article.pop('total', None)
+    return article
+
+
+def serialize_row(row):
+    """ row as dict with timestamps converted to ISO format """
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in dict(row).items()}
+
+
+@app.after_request
+def compress_response(response):
+    """ gzip large responses, article lists and content compress several times over """
+    if (not COMPRESS_MIN_SIZE or response.direct_passthrough or response.is_streamed or
+            response.status_code < 200 or response.status_code >= 300 or
+            'Content-Encoding' in response.headers or
+            'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.before_request
+def require_schema():
+    """ refuse api requests until the crawler has migrated the database """
+    if not schema_ready.is_set() and request.path not in ('/health', '/ready'):
+        return jsonify({'status': 'error', 'message': 'service is starting, database schema not ready'}), 503
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """ ready once the database schema is at SCHEMA_VERSION """
+    ready = schema_ready.is_set()
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'checks': {'schema': ready},
+        'startup_seconds': round(startup_seconds, 3) if startup_seconds is not None else None,
+    }), 200 if ready else 503
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """ health check ep """
@@ -48,6 +331,13 @@ def list_articles():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
 
+    try:
+        fields = parse_fields(ARTICLE_FIELDS, ARTICLE_LIST_FIELDS)
+        conditions, filter_params = article_filters()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
     if per_page > 100:
         per_page = 100
 
@@ -57,33 +347,24 @@ def list_articles():
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             # get total for pagination
-            cursor.execute('SELECT COUNT(*) FROM articles')
+            cursor.execute(f'SELECT COUNT(*) FROM articles {where}', filter_params)
             total_count = cursor.fetchone()[0]
 
-            # get articles
+            # get articles, fields are whitelisted by parse_fields
             cursor.execute(
-                """
-                SELECT id, url, headline, sub_headline,
-                        first_crawled_at, last_crawled_at, updated_at,
-                        (SELECT COUNT(*) FROM articles_versions WHERE article_id = article_id) AS version_count
+                f"""
+                SELECT {', '.join(fields)}
                 FROM articles
+                {where}
                 ORDER BY last_crawled_at DESC
                 LIMIT %s OFFSET %s
                 """,
-                (per_page, offset)
+                (*filter_params, per_page, offset)
             )
-
-            articles = []
-            for row in cursor.fetchall():
-                article = dict(row)
-                # convert timestamps
-                article['first_crawled_at'] = article['first_crawled_at'].isoformat()
-                article['last_crawled_at'] = article['last_crawled_at'].isoformat()
-                article['updated_at'] = article['updated_at'].isoformat() if article['updated_at'] else None
-                articles.append(article)
+            articles = [serialize_row(row) for row in cursor.fetchall()]
 
             return jsonify({
-                'total': 'total_count',
+                'total': total_count,
                 'page': page,
                 'per_page': per_page,
                 'total_pages': (total_count + per_page - 1) // per_page,
@@ -96,11 +377,16 @@ def list_articles():
 @app.route('/api/articles/<int:article_id>', methods=['GET'])
 def get_article(article_id):
     """ get article details """
+    try:
+        fields = parse_fields(ARTICLE_FIELDS, ARTICLE_FIELDS)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(
-                'SELECT * FROM articles WHERE id = %s',
+                f'SELECT {", ".join(fields)}, version_count AS total_versions FROM articles WHERE id = %s',
                 (article_id,)
             )
             article_row = cursor.fetchone()
@@ -108,17 +394,8 @@ def get_article(article_id):
             if not article_row:
                 return jsonify({'status': 'error', 'message': 'article not found'}), 404
 
-            article = dict(article_row)
-            # convert timestamps
-            article['first_crawled_at'] = article['first_crawled_at'].isoformat()
-            article['last_crawled_at'] = article['last_crawled_at'].isoformat()
-            article['updated_at'] = article['updated_at'].isoformat() if article['updated_at'] else None
-
-            cursor.execute(
-                'SELECT COUNT(*) FROM articles_versions WHERE article_id = %s',
-                (article_id,)
-            )
-            version_count = cursor.fetchone()[0]
+            article = serialize_row(article_row)
+            version_count = article.pop('total_versions')
 
             return jsonify({
                 'article': article,
@@ -134,7 +411,7 @@ def get_article_versions(article_id):
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(
-                'SELECT * FROM articles WHERE id = %s',
+                'SELECT id FROM articles WHERE id = %s',
                 (article_id,)
             )
             if not cursor.fetchone():
@@ -166,37 +443,380 @@ def get_article_versions(article_id):
         conn.close()
 
 
+@app.route('/api/articles/<int:article_id>/as-of', methods=['GET'])
+def get_article_as_of(article_id):
+    """ article as it was at ?at=, from the current row or the version that was current then """
+    try:
+        at = parse_as_of()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            cursor.execute(as_of_query(True, 'a.id = %s'), (at, at, at, at, article_id))
+            row = cursor.fetchone()
+            error = history_removed(row['history_from'], at)
+            if error:
+                return error
+
+            if row['id'] is None:
+                return jsonify({'status': 'error', 'message': f'article {article_id} not found'}), 404
+            if row['first_crawled_at'] > at:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'article {article_id} was first crawled at {row["first_crawled_at"].isoformat()}'
+                }), 404
+            return jsonify({'at': at.isoformat(), 'article': serialize_as_of_row(row)})
+    finally:
+        conn.close()
+
+
+@app.route('/api/snapshot', methods=['GET'])
+def get_snapshot():
+    """ every article crawled by ?at= as it was then, newest first """
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 10, type=int), 100)
+    include_content = request.args.get('include_content', 'false').lower() in ('1', 'true', 'yes')
+
+    try:
+        at = parse_as_of()
+        conditions, filter_params = article_filters()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    filters = ''.join(f' AND {condition}' for condition in conditions)
+    offset = (page - 1) * per_page
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            where = f'a.first_crawled_at <= %s {filters}'
+            cursor.execute(
+                as_of_query(
+                    include_content,
+                    where,
+                    'ORDER BY a.first_crawled_at DESC, a.id DESC LIMIT %s OFFSET %s',
+                    count=True
+                ),
+                (at, at, *filter_params, at, at, at, at, at, *filter_params, per_page, offset)
+            )
+            rows = cursor.fetchall()
+            error = history_removed(rows[0]['history_from'], at)
+            if error:
+                return error
+
+            total_count = rows[0]['total']
+            articles = [serialize_as_of_row(row) for row in rows if row['id'] is not None]
+
+            return jsonify({
+                'at': at.isoformat(),
+                'total': total_count,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total_count + per_page - 1) // per_page,
+                'articles': articles,
+            })
+    finally:
+        conn.close()
+
+
 @app.route('/api/articles/<int:article_id>/changes', methods=['GET'])
 def get_article_changes(article_id):
     """ check an article for changes over time """
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
+            # retention lowers version_count when it removes old versions, first_edited_at stays set
             cursor.execute(
-                'SELECT * FROM articles WHERE id = %s',
+                'SELECT version_count, first_edited_at IS NOT NULL AS has_changed FROM articles WHERE id = %s',
                 (article_id,)
             )
-            if not cursor.fetchone():
+            article_row = cursor.fetchone()
+            if not article_row:
                 return jsonify({'status': 'error', 'message': f'article {article_id} not found'}), 404
 
-            # get all versions
+            version_count = article_row['version_count']
+
+            has_changed = article_row['has_changed']
+
+            return jsonify({
+                'article_id': article_id,
+                'has_changed': has_changed,
+                'version_count': version_count,
+            })
+    finally:
+        conn.close()
+
+
+@app.route('/api/articles/<int:article_id>/similar', methods=['GET'])
+def get_similar_articles(article_id):
+    """ near-duplicates of an article (republished, updated or regional variants) """
+    max_distance = request.args.get('max_distance', type=int)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
             cursor.execute(
-                'SELECT COUNT(*) FROM articles_versions WHERE article_id = %s',
+                'SELECT id FROM articles WHERE id = %s',
                 (article_id,)
             )
-            version_count = cursor.fetchone()[0]
+            if not cursor.fetchone():
+                return jsonify({'status': 'error', 'message': f'article {article_id} not found'}), 404
+
+            cursor.execute(
+                """
+                SELECT a.id, a.url, a.headline, a.sub_headline,
+                        a.first_crawled_at, a.last_crawled_at, a.updated_at, s.distance, s.detected_at
+                FROM article_similarities s
+                JOIN articles a ON a.id = s.similar_article_id
+                WHERE s.article_id = %s AND (%s IS NULL OR s.distance <= %s)
+                ORDER BY s.distance, a.last_crawled_at DESC
+                """,
+                (article_id, max_distance, max_distance)
+            )
 
-            has_changed = version_count > 0
+            similar = []
+            for row in cursor.fetchall():
+                article = dict(row)
+                # share of the 64 simhash bits that agree
+                article['similarity'] = round(1 - article['distance'] / 64, 3)
+                # convert timestamps
+                article['first_crawled_at'] = article['first_crawled_at'].isoformat()
+                article['last_crawled_at'] = article['last_crawled_at'].isoformat()
+                article['updated_at'] = article['updated_at'].isoformat() if article['updated_at'] else None
+                article['detected_at'] = article['detected_at'].isoformat()
+                similar.append(article)
 
             return jsonify({
                 'article_id': article_id,
-                'has_changed': has_changed,
-                'version_count': version_count,
+                'similar': similar,
+                'similar_count': len(similar),
             })
     finally:
         conn.close()
 
 
+def encode_cursor(change_seq):
+    """ opaque change feed cursor """
+    return base64.urlsafe_b64encode(f'seq:{change_seq}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ decode change feed cursor, raises ValueError if invalid """
+    if not cursor:
+        return 0
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except Exception:
+        raise ValueError('invalid cursor')
+    prefix, _, value = raw.partition(':')
+    if prefix != 'seq' or not value.isdigit():
+        raise ValueError('invalid cursor')
+    return int(value)
+
+
+def fetch_changes(conn, since_seq, limit, include_content=False):
+    """ get articles inserted or changed after since_seq, oldest change first """
+    with conn.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            f"""
+            SELECT a.id, a.url, a.headline, a.sub_headline,
+                    {'a.content,' if include_content else ''}
+                    a.first_crawled_at, a.last_crawled_at, a.updated_at, a.change_seq, a.word_count, a.version_count,
+                    a.first_edited_at IS NULL AS never_edited
+            FROM articles a
+            WHERE a.change_seq > %s
+            ORDER BY a.change_seq
+            LIMIT %s
+            """,
+            (since_seq, limit)
+        )
+
+        changes = []
+        for row in cursor.fetchall():
+            change = dict(row)
+            # not version_count, retention lowers it when it removes old versions
+            change['change'] = 'created' if change.pop('never_edited') else 'updated'
+            change['cursor'] = encode_cursor(change.pop('change_seq'))
+            # convert timestamps
+            change['first_crawled_at'] = change['first_crawled_at'].isoformat()
+            change['last_crawled_at'] = change['last_crawled_at'].isoformat()
+            change['updated_at'] = change['updated_at'].isoformat() if change['updated_at'] else None
+            changes.append(change)
+
+        return changes
+
+
+class ChangeListener:
+    """ one LISTEN connection per worker process, waiting clients share it instead of holding a connection each
+
+        every notification bumps generation and wakes the waiting clients, which then read the feed from the database
+    """
+
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self.subscribers = 0
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def subscribe(self):
+        """ register a waiting client, returns the current generation or None if max_subscribers are waiting """
+        with self.condition:
+            if self.subscribers >= self.max_subscribers:
+                return None
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='change-listener', daemon=True)
+                self.thread.start()
+            return self.generation
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def wait(self, generation, timeout):
+        """ block until a notification after generation or timeout, returns the generation then """
+        with self.condition:
+            self.condition.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+    def notify(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def run(self):
+        """ listen for change notifications, reconnecting when the connection is lost """
+        while True:
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANGE_FEED_CHANNEL}')
+                # clients that subscribed before the LISTEN took effect read the feed again
+                self.notify()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.notify()
+            except Exception as e:
+                logger.error(f'Change listener error: {e}, reconnecting')
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+change_listener = ChangeListener(CHANGE_FEED_MAX_SUBSCRIBERS)
+
+
+def read_changes(since_seq, limit, include_content=False):
+    """ fetch_changes on a connection of its own, so waiting clients don't hold one """
+    conn = get_db_connection()
+    try:
+        return fetch_changes(conn, since_seq, limit, include_content)
+    finally:
+        conn.close()
+
+
+def too_many_subscribers():
+    response = jsonify({
+        'status': 'error',
+        'message': f'Too many change feed clients, at most {CHANGE_FEED_MAX_SUBSCRIBERS} per worker',
+    })
+    response.headers['Retry-After'] = str(CHANGE_FEED_KEEPALIVE)
+    return response, 503
+
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """ articles created or changed since a cursor, optionally long-polling until there are any """
+    limit = request.args.get('limit', 100, type=int)
+    wait = request.args.get('wait', 0, type=int)
+    include_content = request.args.get('include_content', 'false').lower() in ('1', 'true', 'yes')
+
+    limit = max(1, min(limit, CHANGE_FEED_MAX_LIMIT))
+    wait = max(0, min(wait, CHANGE_FEED_MAX_WAIT))
+
+    try:
+        since_seq = decode_cursor(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
+
+    if not wait:
+        changes = read_changes(since_seq, limit, include_content)
+    else:
+        # subscribe before reading so a change committed in between still wakes us up
+        generation = change_listener.subscribe()
+        if generation is None:
+            return too_many_subscribers()
+        try:
+            deadline = time.monotonic() + wait
+            changes = read_changes(since_seq, limit, include_content)
+            while not changes and time.monotonic() < deadline:
+                notified = change_listener.wait(generation, deadline - time.monotonic())
+                if notified == generation:
+                    break
+                generation = notified
+                changes = read_changes(since_seq, limit, include_content)
+        finally:
+            change_listener.unsubscribe()
+
+    return jsonify({
+        'changes': changes,
+        'next_cursor': changes[-1]['cursor'] if changes else encode_cursor(since_seq),
+        'has_more': len(changes) == limit,
+    })
+
+
+@app.route('/api/changes/stream', methods=['GET'])
+def stream_changes():
+    """ server-sent events stream of article changes """
+    cursor_param = request.headers.get('Last-Event-ID') or request.args.get('since', '')
+    include_content = request.args.get('include_content', 'false').lower() in ('1', 'true', 'yes')
+
+    try:
+        since_seq = decode_cursor(cursor_param)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'invalid cursor'}), 400
+
+    generation = change_listener.subscribe()
+    if generation is None:
+        return too_many_subscribers()
+
+    def generate(since_seq, generation):
+        while True:
+            changes = read_changes(since_seq, CHANGE_FEED_MAX_LIMIT, include_content)
+            for change in changes:
+                yield f'id: {change["cursor"]}\nevent: change\ndata: {json.dumps(change)}\n\n'
+            if changes:
+                since_seq = decode_cursor(changes[-1]['cursor'])
+                if len(changes) == CHANGE_FEED_MAX_LIMIT:
+                    continue
+
+            notified = change_listener.wait(generation, CHANGE_FEED_KEEPALIVE)
+            if notified == generation:
+                # comment line keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+            generation = notified
+
+    response = Response(
+        generate(since_seq, generation),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # runs when the client disconnects, also if the stream never started
+    response.call_on_close(change_listener.unsubscribe)
+    return response
+
+
 @app.route('/api/search', methods=['GET'])
 def search_articles():
     """ search articles by keyword """
@@ -207,52 +827,61 @@ def search_articles():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
 
+    try:
+        fields = parse_fields(SEARCH_FIELDS, SEARCH_DEFAULT_FIELDS)
+        conditions, filter_params = article_filters()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    filters = ''.join(f' AND {condition}' for condition in conditions)
+
     if per_page > 100:
         per_page = 100
 
     offset = (page - 1) * per_page
 
+    # the excerpt is the expensive part, only computed when requested
+    columns = [
+        "ts_headline('german', content, plainto_tsquery('german', %s), "
+        "'MaxFragments=2, FragmentDelimiter=\" ... \"') AS content_excerpt"
+        if field == 'content_excerpt' else field
+        for field in fields
+    ]
+    excerpt_params = (query,) if 'content_excerpt' in fields else ()
+
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=DictCursor) as cursor:
             # get count of matching articles
             cursor.execute(
-                """
+                f"""
                 SELECT COUNT(*) 
                 FROM articles
-                WHERE 
+                WHERE (
                     to_tsvector('german', headline) @@ plainto_tsquery('german', %s)
                     OR to_tsvector('german', sub_headline) @@ plainto_tsquery('german', %s)
                     OR to_tsvector('german', content) @@ plainto_tsquery('german', %s)
+                ){filters}
                 """,
-                (query, query, query)
+                (query, query, query, *filter_params)
             )
             total_count = cursor.fetchone()[0]
 
             # get matching articles
             cursor.execute(
-                """
-                SELECT id, url, headline, sub_headline, ts_headline('german', content, plainto_tsquery('german', %s), 'MaxFragments=2, FragmentDelimiter=' ... '') as content_excerpt,
-                first_crawled_at, last_crawled_at, updated_at
+                f"""
+                SELECT {', '.join(columns)}
                 FROM articles
-                WHERE
+                WHERE (
                     to_tsvector('german', headline) @@ plainto_tsquery('german', %s)
                     OR to_tsvector('german', sub_headline) @@ plainto_tsquery('german', %s)
                     OR to_tsvector('german', content) @@ plainto_tsquery('german', %s)
+                ){filters}
                 ORDER BY updated_at DESC NULLS LAST
                 LIMIT %s OFFSET %s
                 """,
-                (query, query, query, query, per_page, offset)
+                (*excerpt_params, query, query, query, *filter_params, per_page, offset)
             )
-
-            results = []
-            for row in cursor.fetchall():
-                result = dict(row)
-                # convert timestamps
-                result['first_crawled_at'] = result['first_crawled_at'].isoformat()
-                result['last_crawled_at'] = result['last_crawled_at'].isoformat()
-                result['updated_at'] = result['updated_at'].isoformat() if result['updated_at'] else None
-                results.append(result)
+            results = [serialize_row(row) for row in cursor.fetchall()]
 
             return jsonify({
                 'query': query,
@@ -266,6 +895,119 @@ def search_articles():
         conn.close()
 
 
+@app.route('/api/analytics/edits', methods=['GET'])
+def get_edit_analytics():
+    """ new articles, edits and time to first edit per hour or day between ?from= and ?to=, from the rollups """
+    interval = request.args.get('interval', 'hour')
+    if interval not in ANALYTICS_INTERVALS:
+        return jsonify({
+            'status': 'error',
+            'message': f'invalid interval, expected one of {", ".join(ANALYTICS_INTERVALS)}'
+        }), 400
+
+    try:
+        end = parse_timestamp('to') or datetime.now(timezone.utc).replace(tzinfo=None)
+        start = parse_timestamp('from') or end - ANALYTICS_INTERVALS[interval]
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if start > end:
+        return jsonify({'status': 'error', 'message': 'from must not be after to'}), 400
+    bucket_size = timedelta(**{f'{interval}s': 1})
+    if (end - start) / bucket_size >= ANALYTICS_MAX_BUCKETS:
+        return jsonify({
+            'status': 'error',
+            'message': f'range too large, at most {ANALYTICS_MAX_BUCKETS} buckets per request'
+        }), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            # every bucket in the range, the rollup rows of one hour or 24 for a day
+            cursor.execute(
+                """
+                SELECT
+                    buckets.bucket,
+                    COALESCE(SUM(r.new_articles), 0) AS new_articles,
+                    COALESCE(SUM(r.edits), 0) AS edits,
+                    COALESCE(SUM(r.first_edits), 0) AS first_edits,
+                    COALESCE(SUM(r.first_edit_seconds), 0) AS first_edit_seconds
+                FROM generate_series(date_trunc(%s, %s::TIMESTAMP), %s::TIMESTAMP, %s::INTERVAL) AS buckets (bucket)
+                LEFT JOIN edit_rollup_hourly r
+                    ON r.bucket >= buckets.bucket AND r.bucket < buckets.bucket + %s::INTERVAL
+                GROUP BY buckets.bucket
+                ORDER BY buckets.bucket
+                """,
+                (interval, start, end, f'1 {interval}', f'1 {interval}')
+            )
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    def summary(new_articles, edits, first_edits, first_edit_seconds):
+        return {
+            'new_articles': new_articles,
+            'edits': edits,
+            'first_edits': first_edits,
+            'avg_seconds_to_first_edit': first_edit_seconds / first_edits if first_edits else None,
+        }
+
+    buckets = [
+        {
+            'bucket': row['bucket'].isoformat(),
+            **summary(row['new_articles'], row['edits'], row['first_edits'], row['first_edit_seconds']),
+        }
+        for row in rows
+    ]
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'interval': interval,
+        'totals': summary(*(
+            sum(row[column] for row in rows)
+            for column in ('new_articles', 'edits', 'first_edits', 'first_edit_seconds')
+        )),
+        'buckets': buckets,
+    })
+
+
+@app.route('/api/analytics/most-edited', methods=['GET'])
+def get_most_edited():
+    """ articles with the most edits in the last ?days= days, from the daily rollup """
+    days = request.args.get('days', 7, type=int)
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    if days < 1 or days > ANALYTICS_MAX_DAYS:
+        return jsonify({'status': 'error', 'message': f'days must be between 1 and {ANALYTICS_MAX_DAYS}'}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            # days as the crawler buckets them, today counts as the first
+            cursor.execute(
+                """
+                SELECT a.id, a.url, a.headline, a.first_crawled_at, a.version_count, edited.edits
+                FROM (
+                    SELECT article_id, SUM(edits) AS edits
+                    FROM article_edits_daily
+                    WHERE day > NOW()::DATE - %s
+                    GROUP BY article_id
+                    ORDER BY edits DESC, article_id DESC
+                    LIMIT %s
+                ) edited
+                JOIN articles a ON a.id = edited.article_id
+                ORDER BY edited.edits DESC, a.id DESC
+                """,
+                (days, limit)
+            )
+            articles = [serialize_row(row) for row in cursor.fetchall()]
+
+            return jsonify({
+                'days': days,
+                'articles': articles,
+            })
+    finally:
+        conn.close()
+
+
 @app.errorhandler(400)
 def handle_bad_request(e):
     return jsonify({
@@ -292,4 +1034,5 @@ def handle_server_error(e):
 
 
 if __name__ == '__main__':
+    start()
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,17 @@
+import os
+
+# production server settings, see README "Running in production"
+bind = f'0.0.0.0:{os.environ.get("PORT", "5001")}'
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+threads = int(os.environ.get('WEB_THREADS', '8'))
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    """ wait for the crawler to migrate the database in the background, api requests get 503 until then """
+    from app import start
+    start()
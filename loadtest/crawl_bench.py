@@ -0,0 +1,173 @@
+""" crawler load test against the local replay server
+
+    starts loadtest/replay_server.py, points TAGESSCHAU_URL at it and runs overview crawls in this process against
+    the database configured by DB_*. reports crawl throughput, the run counters, database writes per second and what
+    the replay server saw (requests, injected faults, retries).
+
+    python loadtest/crawl_bench.py --pages pages/ --articles 2000 --runs 3 --mutation-rate 0.1 --error-rate 0.02
+
+    every option of replay_server.py serve is accepted and passed on. use --url to crawl an already running server.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, LOADTEST_DIR)
+
+from replay_server import STATS_PATH, add_serve_arguments
+
+SERVER_START_TIMEOUT = 30
+
+# pg_stat_database counters reported as rates
+DB_COUNTERS = ('xact_commit', 'xact_rollback', 'tup_inserted', 'tup_updated', 'tup_deleted')
+
+
+def start_server(args):
+    """ replay server subprocess with the serve options given to this script """
+    command = [sys.executable, os.path.join(LOADTEST_DIR, 'replay_server.py'), 'serve']
+    for action in serve_actions():
+        value = getattr(args, action.dest)
+        if action.const is True:
+            if value:
+                command.append(action.option_strings[0])
+        elif value is not None:
+            command += [action.option_strings[0], str(value)]
+
+    process = subprocess.Popen(command)
+    url = f'http://{args.host}:{args.port}/'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('replay server exited')
+        try:
+            requests.get(url.rstrip('/') + STATS_PATH, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('replay server did not start')
+
+
+def serve_actions():
+    parser = argparse.ArgumentParser(add_help=False)
+    add_serve_arguments(parser)
+    return parser._actions
+
+
+def server_stats(url):
+    return requests.get(url.rstrip('/') + STATS_PATH, timeout=5).json()
+
+
+def db_snapshot():
+    """ table sizes and write counters of the crawler database """
+    from db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT (SELECT COUNT(*) FROM articles), (SELECT COUNT(*) FROM articles_versions),
+                    {', '.join(DB_COUNTERS)}
+                FROM pg_stat_database WHERE datname = current_database()
+                """
+            )
+            articles, versions, *counters = cursor.fetchone()
+        # statistics are only sent to the collector at transaction end
+        conn.commit()
+    finally:
+        conn.close()
+    return {'articles': articles, 'versions': versions, **dict(zip(DB_COUNTERS, counters))}
+
+
+def difference(after, before):
+    return {key: value - before.get(key, 0) for key, value in after.items()}
+
+
+def run_crawls(count, mode):
+    """ overview crawls back to back, returns the run summaries and the total time """
+    import crawler
+    from runs import CrawlRun
+
+    runs = []
+    started = time.perf_counter()
+    for number in range(1, count + 1):
+        run = CrawlRun('loadtest')
+        run_started = time.perf_counter()
+        crawler.crawl_overview_page(run, mode)
+        seconds = time.perf_counter() - run_started
+
+        summary = run.as_dict()
+        runs.append(summary)
+        print(
+            f'run {number}: {summary["status"]} in {seconds:.1f}s, {summary["links_found"]} links '
+            f'({summary["links_skipped"]} skipped), '
+            f'{summary["fetched"]} fetched ({summary["fetched"] / seconds:.1f}/s), '
+            f'{summary["not_modified"]} not modified, {summary["new_articles"]} new, '
+            f'{summary["updated_articles"]} updated, {summary["failed"]} failed',
+            flush=True
+        )
+    return runs, time.perf_counter() - started
+
+
+def report(runs, seconds, db_before, db_after, server_before, server_after):
+    totals = {}
+    for run in runs:
+        for key, value in run.items():
+            if isinstance(value, (int, float)) and key != 'id':
+                totals[key] = totals.get(key, 0) + value
+
+    db = difference(db_after, db_before)
+    server = difference(server_after, server_before)
+    pages = totals.get('fetched', 0) + totals.get('not_modified', 0)
+
+    print()
+    print(f'runs:             {len(runs)} in {seconds:.1f}s')
+    print(f'pages:            {pages} ({pages / seconds:.1f}/s), {totals.get("bytes_fetched", 0) / seconds / 1024:.0f} KiB/s')
+    print(f'articles:         {totals.get("new_articles", 0)} new, {totals.get("updated_articles", 0)} updated, '
+          f'{totals.get("unchanged", 0)} unchanged, {totals.get("failed", 0)} failed')
+    print(f'stage seconds:    fetch {totals.get("fetch_seconds", 0):.1f}, parse {totals.get("parse_seconds", 0):.1f}, '
+          f'store {totals.get("store_seconds", 0):.1f}')
+    print(f'db rows:          +{db["articles"]} articles, +{db["versions"]} versions')
+    print('db per second:    ' + ', '.join(f'{key} {db[key] / seconds:.1f}' for key in DB_COUNTERS))
+    print(f'server:           {json.dumps(server)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawler load test against the replay server')
+    parser.add_argument('--runs', type=int, default=1, help='overview crawls to run')
+    parser.add_argument('--url', help='crawl a running replay server instead of starting one')
+    parser.add_argument('--mode', choices=('full', 'incremental'), default='full',
+                        help='overview mode, incremental only crawls new or changed teasers')
+    add_serve_arguments(parser)
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if not url:
+        if not args.pages and not args.archive:
+            parser.error('pass --pages, --archive or --url')
+        process, url = start_server(args)
+
+    # read by crawler.py at import
+    os.environ['TAGESSCHAU_URL'] = url
+    sys.path.insert(0, os.path.join(LOADTEST_DIR, '..', 'crawler'))
+
+    try:
+        db_before, server_before = db_snapshot(), server_stats(url)
+        runs, seconds = run_crawls(args.runs, args.mode)
+        report(runs, seconds, db_before, db_snapshot(), server_before, server_stats(url))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
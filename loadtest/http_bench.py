@@ -0,0 +1,79 @@
+""" simple closed-loop HTTP load test, used to compare the dev server against gunicorn
+
+    python loadtest/http_bench.py http://localhost:5001/api/articles --concurrency 32 --duration 20
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import requests
+
+
+def run_worker(url, deadline, latencies, errors, lock):
+    """ send requests back to back until the deadline """
+    session = requests.Session()
+    local_latencies = []
+    local_errors = 0
+
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            response = session.get(url, timeout=30)
+            if response.status_code >= 500:
+                local_errors += 1
+        except requests.RequestException:
+            local_errors += 1
+        local_latencies.append(time.monotonic() - started)
+
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def percentile(values, pct):
+    """ nearest rank percentile """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP throughput benchmark')
+    parser.add_argument('url')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=run_worker, args=(args.url, deadline, latencies, errors, lock))
+        for _ in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    total = len(latencies)
+    print(f'url:          {args.url}')
+    print(f'concurrency:  {args.concurrency}')
+    print(f'requests:     {total} ({sum(errors)} errors)')
+    print(f'throughput:   {total / elapsed:.1f} req/s')
+    if latencies:
+        print(f'latency mean: {statistics.mean(latencies) * 1000:.1f} ms')
+        print(f'latency p50:  {percentile(latencies, 50) * 1000:.1f} ms')
+        print(f'latency p95:  {percentile(latencies, 95) * 1000:.1f} ms')
+        print(f'latency p99:  {percentile(latencies, 99) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
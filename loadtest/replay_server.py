@@ -0,0 +1,400 @@
+""" local stand-in for tagesschau.de that replays recorded pages, for crawler load tests
+
+    python loadtest/replay_server.py record pages/                 save the live overview and its articles once
+    python loadtest/replay_server.py serve --pages pages/ --articles 5000 --latency-ms 80 --error-rate 0.02
+
+    the overview lists --articles teaser links. article n is recorded page n % len(pages), copies get their number
+    in headline and first paragraph so they are distinct articles. --mutation-rate is the chance per request that
+    an article gets a new revision, which the crawler stores as a new version. the crawler's conditional requests
+    are answered with 304 while an article is unchanged.
+
+    pages come from a directory (index.html and the article files under their url path) or with --archive from the
+    crawler's raw html archive. GET /_replay/stats returns request, status and fault counters as json.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crawler'))
+
+TEASER_LINK_RE = re.compile(r'<a\b[^>]*class="[^"]*teaser__link[^"]*"[^>]*href="([^"]+)"', re.IGNORECASE)
+HREF_FIRST_RE = re.compile(r'<a\b[^>]*href="([^"]+)"[^>]*class="[^"]*teaser__link', re.IGNORECASE)
+HEADLINE_RE = re.compile(r'(<[^>]*class="[^"]*seitenkopf__headline--text[^"]*"[^>]*>)', re.IGNORECASE)
+PARAGRAPH_RE = re.compile(r'(<p\b[^>]*class="[^"]*textabsatz[^"]*"[^>]*>)', re.IGNORECASE)
+BODY_PARAGRAPH_RE = re.compile(r'(article__body.*?<p\b[^>]*>)', re.IGNORECASE | re.DOTALL)
+
+ERROR_STATUSES = (429, 500, 502, 503)
+CHUNK_SIZE = 16 * 1024
+STATS_PATH = '/_replay/stats'
+USER_AGENT = 'Mozilla/5.0 (replay recorder)'
+
+
+def load_pages(directory):
+    """ overview html (or None) and {path: html} of the articles in a recorded directory """
+    overview = None
+    pages = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            relative = '/' + os.path.relpath(path, directory).replace(os.sep, '/')
+            with open(path, encoding='utf-8') as f:
+                if relative == '/index.html':
+                    overview = f.read()
+                elif filename.endswith('.html'):
+                    pages[relative] = f.read()
+    return overview, pages
+
+
+def load_archive(directory):
+    """ newest capture of every url in the crawler's raw html archive """
+    from archive import HtmlArchive
+
+    archive = HtmlArchive(directory)
+    pages = {}
+    for url, sha256, encoding, _ in archive.captures():
+        pages[urlparse(url).path or '/'] = archive.read(sha256).decode(encoding or 'utf-8', errors='replace')
+    return None, pages
+
+
+def overview_paths(overview):
+    """ article paths in the order the recorded overview lists them """
+    paths = []
+    for href in TEASER_LINK_RE.findall(overview) + HREF_FIRST_RE.findall(overview):
+        path = urlparse(html.unescape(href)).path
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def mark_page(page, label):
+    """ put label into the headline and the first paragraph, so the page parses to different content """
+    page = HEADLINE_RE.sub(lambda m: f'{m.group(1)}{label} ', page, count=1)
+    if PARAGRAPH_RE.search(page):
+        return PARAGRAPH_RE.sub(lambda m: f'{m.group(1)}{label} ', page, count=1)
+    return BODY_PARAGRAPH_RE.sub(lambda m: f'{m.group(1)}{label} ', page, count=1)
+
+
+class ReplaySite:
+    """ the replayed pages and the revision of every article copy """
+
+    def __init__(self, overview, pages, articles=None, mutation_rate=0.0, seed=None):
+        if not pages:
+            raise ValueError('no recorded article pages found')
+
+        recorded = [path for path in overview_paths(overview) if path in pages] if overview else []
+        self.templates = [pages[path] for path in recorded or sorted(pages)]
+        self.template_paths = recorded or sorted(pages)
+        self.template_index = {path: index for index, path in enumerate(self.template_paths)}
+        self.articles = articles or len(self.templates)
+        self.mutation_rate = mutation_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.revisions = {}
+        self.modified_at = {}
+        self.started_at = time.time()
+
+    def article_path(self, number):
+        """ recorded path for the first copy of every page, numbered paths for the rest """
+        template_path = self.template_paths[number % len(self.templates)]
+        copy = number // len(self.templates)
+        if copy == 0:
+            return template_path
+        base, extension = os.path.splitext(template_path)
+        return f'{base}-{copy}{extension}'
+
+    def overview(self):
+        """ teaser per article, its headline shows the revision like a real teaser follows its article """
+        with self.lock:
+            revisions = dict(self.revisions)
+        teasers = ''.join(
+            f'<div class="teaser"><a class="teaser__link" href="{self.article_path(number)}">'
+            f'<span class="teaser__headline">Article {number}.{revisions.get(number, 0)}</span></a></div>'
+            for number in range(self.articles)
+        )
+        return f'<html><body>{teasers}</body></html>'
+
+    def article_number(self, path):
+        base, extension = os.path.splitext(path)
+        copy = 0
+        match = re.match(r'^(.*)-(\d+)$', base)
+        if match and f'{match.group(1)}{extension}' in self.template_index:
+            base, copy = match.group(1), int(match.group(2))
+        index = self.template_index.get(f'{base}{extension}')
+        if index is None:
+            return None
+        number = copy * len(self.templates) + index
+        return number if number < self.articles else None
+
+    def article(self, number):
+        """ page html, etag and last-modified of an article, possibly after a new revision """
+        with self.lock:
+            mutated = self.random.random() < self.mutation_rate
+            if mutated:
+                self.revisions[number] = self.revisions.get(number, 0) + 1
+                self.modified_at[number] = time.time()
+            revision = self.revisions.get(number, 0)
+            modified_at = self.modified_at.get(number, self.started_at)
+
+        page = self.templates[number % len(self.templates)]
+        copy = number // len(self.templates)
+        if copy or revision:
+            page = mark_page(page, f'[{copy}.{revision}]')
+
+        etag = '"' + hashlib.sha1(f'{number}.{revision}'.encode()).hexdigest()[:16] + '"'
+        return page, etag, formatdate(modified_at, usegmt=True), mutated
+
+
+class ReplayStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # paths whose last request got an injected fault, the next request for them is a retry
+        self.faulted = set()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def request(self, path):
+        """ count a request and whether it retries a faulted one """
+        with self.lock:
+            self.counters['requests'] = self.counters.get('requests', 0) + 1
+            if path in self.faulted:
+                self.faulted.discard(path)
+                self.counters['retries'] = self.counters.get('retries', 0) + 1
+
+    def fault(self, path, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            self.faulted.add(path)
+
+    def as_dict(self):
+        with self.lock:
+            return dict(sorted(self.counters.items()))
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """ serves the site with the fault settings of the server """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+
+        if path == STATS_PATH:
+            self.send_body(200, json.dumps(server.stats.as_dict()).encode(), 'application/json')
+            return
+
+        server.stats.request(path)
+        with server.slots:
+            if not self.inject_fault(path):
+                self.serve_page(path)
+
+    def inject_fault(self, path):
+        """ latency, then maybe an error status, a reset connection or a hang. True if the request was answered """
+        server = self.server
+        time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+
+        roll = random.random()
+        if roll < server.error_rate:
+            server.stats.fault(path, 'injected_errors')
+            self.send_body(random.choice(ERROR_STATUSES), b'injected error', 'text/plain')
+            return True
+        roll -= server.error_rate
+
+        if roll < server.reset_rate:
+            server.stats.fault(path, 'injected_resets')
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b'\x01\x00\x00\x00\x00\x00\x00\x00')
+            self.close_connection = True
+            self.connection.close()
+            return True
+        roll -= server.reset_rate
+
+        if roll < server.hang_rate:
+            server.stats.fault(path, 'injected_hangs')
+            time.sleep(server.hang_seconds)
+            self.close_connection = True
+            return True
+        return False
+
+    def serve_page(self, path):
+        site = self.server.site
+        if path in ('/', '/index.html'):
+            self.send_body(200, site.overview().encode('utf-8'), 'text/html; charset=utf-8')
+            return
+
+        number = site.article_number(path)
+        if number is None:
+            self.send_body(404, b'not found', 'text/plain')
+            return
+
+        page, etag, last_modified, mutated = site.article(number)
+        if mutated:
+            self.server.stats.count('mutations')
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', None, {'ETag': etag, 'Last-Modified': last_modified})
+            return
+        self.send_body(200, page.encode('utf-8'), 'text/html; charset=utf-8',
+                       {'ETag': etag, 'Last-Modified': last_modified})
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.server.stats.count(f'status_{status}')
+
+        if status == 304:
+            return
+        # bandwidth limit per response
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+        self.server.stats.count('bytes_sent', len(body))
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, site, latency_ms=0, jitter_ms=0, error_rate=0.0, reset_rate=0.0, hang_rate=0.0,
+                 hang_seconds=30, bandwidth=0, max_connections=0, verbose=False):
+        super().__init__(address, ReplayHandler)
+        self.site = site
+        self.stats = ReplayStats()
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.bandwidth = bandwidth
+        # requests served at once, the rest wait like on a saturated server
+        self.slots = threading.BoundedSemaphore(max_connections) if max_connections else NoLimit()
+        self.verbose = verbose
+
+
+class NoLimit:
+    """ stands in for the connection semaphore when concurrency is unlimited """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def record(url, directory, limit=None, delay=1.0):
+    """ save the overview page and its articles under their url path, politely one at a time """
+    os.makedirs(directory, exist_ok=True)
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+
+    response = session.get(url, timeout=10)
+    response.raise_for_status()
+    with open(os.path.join(directory, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(response.text)
+
+    paths = [path for path in overview_paths(response.text) if path.endswith('.html')][:limit]
+    for number, path in enumerate(paths, 1):
+        try:
+            page = session.get(urljoin(url, path), timeout=10)
+            page.raise_for_status()
+        except requests.RequestException as e:
+            print(f'skipping {path}: {e}')
+            continue
+        target = os.path.join(directory, path.lstrip('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(page.text)
+        print(f'{number}/{len(paths)} {path}')
+        time.sleep(delay)
+
+
+def add_serve_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', help='directory of recorded pages')
+    parser.add_argument('--archive', help='raw html archive directory (ARCHIVE_DIR of the crawler)')
+    parser.add_argument('--articles', type=int, help='article links on the overview (default: recorded pages)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='standard deviation of the latency')
+    parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second per response, 0 unlimited')
+    parser.add_argument('--max-connections', type=int, default=0, help='requests served at once, 0 unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 429/5xx responses')
+    parser.add_argument('--reset-rate', type=float, default=0.0, help='share of connections reset without response')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of requests that never get a response')
+    parser.add_argument('--hang-seconds', type=float, default=30)
+    parser.add_argument('--mutation-rate', type=float, default=0.0, help='chance per request of a new revision')
+    parser.add_argument('--seed', type=int, help='seed for the mutations')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+
+
+def serve(args):
+    if bool(args.pages) == bool(args.archive):
+        raise SystemExit('pass either --pages or --archive')
+    overview, pages = load_pages(args.pages) if args.pages else load_archive(args.archive)
+    site = ReplaySite(overview, pages, args.articles, args.mutation_rate, args.seed)
+
+    server = ReplayServer(
+        (args.host, args.port), site,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        reset_rate=args.reset_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        bandwidth=args.bandwidth, max_connections=args.max_connections, verbose=args.verbose,
+    )
+    print(f'replaying {len(site.templates)} recorded pages as {site.articles} articles '
+          f'on http://{args.host}:{server.server_address[1]}/', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay server for crawler load tests')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='serve recorded pages')
+    add_serve_arguments(serve_parser)
+
+    record_parser = commands.add_parser('record', help='record the live overview and its articles')
+    record_parser.add_argument('directory')
+    record_parser.add_argument('--url', default='https://www.tagesschau.de/')
+    record_parser.add_argument('--limit', type=int, help='record at most this many articles')
+    record_parser.add_argument('--delay', type=float, default=1.0, help='seconds between requests')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.url, args.directory, args.limit, args.delay)
+    else:
+        serve(args)
+
+
+if __name__ == '__main__':
+    main()